@@ -1,5 +1,14 @@
 from .aiosolr import Solr
-from .exceptions import SolrError
+from .buffered_writer import BufferedWriter
+from .commit_scheduler import CommitScheduler
+from .exceptions import (
+    SolrError, SolrBadRequestError, SolrConnectionError, SolrNotFoundError,
+    SolrOverloadedError, SolrTimeoutError)
+from .indexing_queue import IndexingQueue
+from .scan import ParallelScan
 
 
-__all__ = [Solr, SolrError]
+__all__ = [
+    Solr, BufferedWriter, CommitScheduler, IndexingQueue, ParallelScan, SolrError,
+    SolrBadRequestError, SolrConnectionError, SolrNotFoundError,
+    SolrOverloadedError, SolrTimeoutError]
@@ -1,24 +1,108 @@
 # coding: utf-8
+import io
 import time
 import json
-from urllib.parse import urlencode
+import pickle
+import random
+import logging
+import functools
 from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
 import asyncio
 import aiohttp
-from .log import LOG
-from .exceptions import SolrError
+from concurrent.futures import ProcessPoolExecutor
+from .log import LOG, SLOW_LOG, BodyPreview
+from .exceptions import SolrConnectionError, SolrError, SolrTimeoutError, error_for_status
 from . import utils
 from .result_cls import Results
-from .error_extractor import extract_error, make_error_msg
+from .query import Query
+from .streams import FileReader, XMLAddStream, request_body
+from .json_stream import ResultsStream
+from .scan import ParallelScan
+from .error_extractor import read_error_body
+
+
+# aiohttp before 2.0 raises its own timeout error, later versions asyncio's.
+TIMEOUT_ERRORS = (asyncio.TimeoutError, getattr(aiohttp, 'ClientTimeoutError', asyncio.TimeoutError))
 
 
 class Solr(object):
 
-    def __init__(self, url, decoder=None, timeout=60, results_cls=Results, loop=None):
+    # Queries whose encoded parameters are at least this long are POSTed.
+    max_get_length = 1024
+    # Used to match docs up with their ids in ``get()`` and the doc cache.
+    unique_key = 'id'
+    # At most this many bytes of an error response are read.
+    max_error_body = 64 * 1024
+    # Request bodies are previewed in logs up to this many characters.
+    log_body_length = 10
+    # Streamed ``add()`` bodies are encoded and sent this many bytes at a time.
+    stream_chunk_size = 64 * 1024
+
+    def __init__(self, url, decoder=None, timeout=60, results_cls=Results, loop=None,
+                 executor=None, decode_threshold=None, convert_docs=False,
+                 serialize_threshold=None, serialize_chunk_size=1000,
+                 compress_requests=False, compression_level=6, compression_threshold=1024,
+                 accept_encoding=None, results_cache=None, json_requests=False,
+                 query_shaper=None, doc_cache=None, slow_threshold=None,
+                 slow_sample_rate=1.0, stream_adds=False, max_add_bytes=None):
         if loop is None:
             loop = asyncio.get_event_loop()
         self.loop = loop
-        self.decoder = decoder or json.JSONDecoder()
+        # The stock decoder can't be pickled, so it's never handed to the
+        # executor: ``json.loads`` is used on its side instead. Any other
+        # decoder, even one assigned later, is used everywhere.
+        self._stock_decoder = json.JSONDecoder()
+        self.decoder = decoder or self._stock_decoder
+        # Responses of at least ``decode_threshold`` characters are decoded in
+        # ``executor`` (the loop's default executor if ``None``) instead of
+        # blocking the event loop. ``None`` keeps decoding inline. Decoding
+        # holds the GIL, so threads only keep the loop responsive; it takes
+        # a ``ProcessPoolExecutor`` for decoding to run on other cores.
+        if decoder is not None and isinstance(executor, ProcessPoolExecutor):
+            try:
+                pickle.dumps(decoder)
+            except Exception as err:
+                raise ValueError(
+                    "A ProcessPoolExecutor needs a decoder it can pickle (%s)." % err)
+        self.executor = executor
+        self.decode_threshold = decode_threshold
+        self.convert_docs = convert_docs
+        # ``add()`` batches of at least ``serialize_threshold`` docs are
+        # serialized in ``executor``, split in ``serialize_chunk_size`` chunks.
+        # As with decoding, threads only keep the loop responsive; chunks
+        # are serialized in parallel with a ``ProcessPoolExecutor``.
+        self.serialize_threshold = serialize_threshold
+        self.serialize_chunk_size = serialize_chunk_size
+        # Update bodies of at least ``compression_threshold`` bytes are sent
+        # gzipped when ``compress_requests`` is on. ``accept_encoding``, if
+        # given, is sent as the ``Accept-Encoding`` of every request.
+        self.compress_requests = compress_requests
+        self.compression_level = compression_level
+        self.compression_threshold = compression_threshold
+        self.accept_encoding = accept_encoding
+        # Optional ``cache.SharedResultsCache`` (or anything with the same
+        # ``get``/``set``) for ``search()`` responses. Updates sent through
+        # this client invalidate it if it has ``invalidate()``.
+        self.results_cache = results_cache
+        # Send long queries as JSON Request API bodies rather than
+        # form-encoded POSTs. Requires Solr 5.1+.
+        self.json_requests = json_requests
+        # Optional ``query_shaper.QueryShaper`` applied to ``search()`` params.
+        self.query_shaper = query_shaper
+        # Optional ``cache.DocumentCache`` filled by ``get()`` and
+        # invalidated by writes made through this client.
+        self.doc_cache = doc_cache
+        # Requests taking at least ``slow_threshold`` seconds are logged to
+        # ``aiosolr.slow``, a ``slow_sample_rate`` fraction of them.
+        self.slow_threshold = slow_threshold
+        self.slow_sample_rate = slow_sample_rate
+        self.slow_log = SLOW_LOG
+        # Encode ``add()`` bodies while sending them rather than up front,
+        # starting a new request every ``max_add_bytes`` (which implies
+        # ``stream_adds``).
+        self.stream_adds = stream_adds or max_add_bytes is not None
+        self.max_add_bytes = max_add_bytes
         self.url = url
         self.timeout = timeout
         self.log = self._get_log()
@@ -38,88 +122,175 @@ class Solr(object):
         return self.url
 
     def get_multipart_form_data(self, params, files):
-        form_data = aiohttp.helpers.FormData()
-        for k, v in params.items():
-            form_data.add_field(k, v)
+        """
+        Builds the multipart body for ``params`` and ``files``, a list of
+        file objects with a ``name`` or of ``(name, file_obj)`` pairs. File
+        contents are streamed by aiohttp rather than read up front; readers
+        that aren't file objects (like ``mmap``) are wrapped so they can be.
+        """
+        form_data = aiohttp.FormData()
+        for k, v in (params or {}).items():
+            form_data.add_field(k, utils.force_unicode(v))
         for file_obj in files:
-            form_data.add_field(file_obj.name, file_obj)
+            if isinstance(file_obj, tuple):
+                name, file_obj = file_obj
+            else:
+                name = file_obj.name
+            if not isinstance(file_obj, io.IOBase):
+                file_obj = FileReader(file_obj)
+            # Tika may use the file name as a file type hint.
+            form_data.add_field(
+                name, file_obj, filename=name, content_type='application/octet-stream')
         return form_data
 
-    async def _send_request(self, method, path='', body=None, headers=None, files=None):
+    async def _send_request(self, method, path='', body=None, headers=None, files=None,
+                            idempotent=None, stream=False):
         url = self._create_full_url(path)
         method = method.lower()
-        log_body = body
+
+        # Whether sending the request twice does no harm; reported on errors
+        # so retry layers know.
+        if idempotent is None:
+            idempotent = method in ('get', 'head')
 
         if headers is None:
             headers = {}
 
-        if log_body is None:
-            log_body = ''
-        elif not isinstance(log_body, str):
-            log_body = repr(body)
+        if self.accept_encoding is not None and 'Accept-Encoding' not in headers:
+            headers = dict(headers)
+            headers['Accept-Encoding'] = self.accept_encoding
 
+        # Only formatted if a handler wants the record.
+        log_body = BodyPreview(body, self.log_body_length)
         self.log.debug("Starting request to '%s' (%s) with body '%s'...",
-                       url, method, log_body[:10])
+                       url, method, log_body)
         start_time = time.time()
 
-        # Everything except the body can be Unicode. The body must be
-        # encoded to bytes to work properly on Py3.
-        bytes_body = body
-
-        if bytes_body is not None:
-            bytes_body = utils.force_bytes(body)
-
         if files:
-            data = self.get_multipart_form_data(bytes_body, files)
+            # ``body`` is a dictionary of form fields here.
+            data = self.get_multipart_form_data(body, files)
+        elif hasattr(body, '__aiter__'):
+            # Streamed, chunks are already bytes.
+            data = request_body(body, self.loop)
+        elif body is not None:
+            # Everything except the body can be Unicode. The body must be
+            # encoded to bytes to work properly on Py3.
+            data = utils.force_bytes(body)
         else:
-            data = bytes_body
+            data = None
 
         try:
-            with aiohttp.Timeout(self.timeout, loop=self.loop):
-                resp = await self.session.request(
-                    method, url, data=data, headers=headers)
-        except aiohttp.errors.ClientTimeoutError as err:
+            resp = await asyncio.wait_for(
+                self.session.request(method, url, data=data, headers=headers), self.timeout)
+        except TIMEOUT_ERRORS as err:
             error_message = "Connection to server '%s' timed out: %s"
             self.log.error(error_message, url, err, exc_info=True)
-            raise SolrError(error_message % (url, err))
-        except aiohttp.errors.ClientConnectionError as err:
+            raise SolrTimeoutError(
+                error_message % (url, err), url=url,
+                elapsed=time.time() - start_time, idempotent=idempotent)
+        except aiohttp.ClientConnectionError as err:
             error_message = "Failed to connect to server at '%s', are you sure that URL is correct? Checking it in a browser might help: %s"
             params = (url, err)
             self.log.error(error_message, *params, exc_info=True)
-            raise SolrError(error_message % params)
-        except aiohttp.errors.ClientError as err:
+            raise SolrConnectionError(
+                error_message % params, url=url,
+                elapsed=time.time() - start_time, idempotent=idempotent)
+        except aiohttp.ClientError as err:
             error_message = "Unhandled error: %s %s: %s"
             self.log.error(error_message, method, url, err, exc_info=True)
-            raise SolrError(error_message % (method, url, err))
+            raise SolrError(
+                error_message % (method, url, err), url=url,
+                elapsed=time.time() - start_time, idempotent=idempotent)
 
         end_time = time.time()
-        self.log.info("Finished '%s' (%s) with body '%s' in %0.3f seconds.",
-                      url, method, log_body[:10], end_time - start_time)
+        self.log.debug("Finished '%s' (%s) with body '%s' in %0.3f seconds.",
+                       url, method, log_body, end_time - start_time)
+
+        if self.slow_threshold is not None and end_time - start_time >= self.slow_threshold:
+            self._log_slow(url, method, log_body, end_time - start_time)
 
         if int(resp.status) != 200:
-            error_message = "Solr responded with an error (HTTP %s): %s"
             reason = resp.headers.get('reason', None)
-            full_response = None
+            body = None
             if reason is None:
-                reason, full_response = await extract_error(resp)
-            solr_message = make_error_msg(reason, full_response)
-            self.log.error(error_message, resp.status, solr_message,
-                           extra={'data': {'headers': resp.headers,
-                                           'response': resp.content}})
-            raise SolrError(error_message % (resp.status, solr_message))
+                body = await read_error_body(resp, self.max_error_body)
+            else:
+                resp.close()
+            # The body is only parsed if someone formats the error, so the
+            # log line leaves it out.
+            self.log.error("Solr responded with HTTP %s to '%s' (%s) after %0.3f seconds.",
+                           resp.status, url, method, end_time - start_time,
+                           extra={'data': {'headers': resp.headers}})
+            raise error_for_status(resp.status)(
+                "Solr responded with an error (HTTP %s)" % resp.status,
+                status=int(resp.status), headers=resp.headers, body=body, reason=reason,
+                url=url, elapsed=end_time - start_time, idempotent=idempotent)
+
+        if stream:
+            # The caller reads (and closes) the body.
+            return resp
 
         content = await resp.text()
         return utils.force_unicode(content)
 
-    async def _select(self, params, search_handler='select'):
+    def _log_slow(self, url, method, log_body, elapsed):
+        if self.slow_sample_rate < 1 and random.random() >= self.slow_sample_rate:
+            return
+
+        self.slow_log.warning("Slow request to '%s' (%s) with body '%s' took %0.3f seconds.",
+                              url, method, log_body, elapsed)
+
+    def _response_decoder(self):
+        """
+        Returns ``self.decoder``, or ``None`` if it's the stock decoder so
+        ``json.loads`` is used and nothing unpicklable is sent to an executor.
+        """
+        if self.decoder is self._stock_decoder:
+            return None
+        return self.decoder
+
+    async def _decode(self, response):
+        """
+        Decodes a JSON response from Solr.
+
+        Small responses are decoded inline. Anything at or above
+        ``self.decode_threshold`` characters is handed off to
+        ``self.executor`` so a huge body doesn't stall the event loop. With
+        ``self.convert_docs`` set, document values are also run through
+        ``to_python``.
+
+        Decoding holds the GIL: in a thread pool it doesn't stall the loop
+        but doesn't run in parallel with it either. Pass a
+        ``ProcessPoolExecutor`` as ``executor`` for that; ``self.decoder``
+        then has to be picklable.
+        """
+        decoder = self._response_decoder()
+
+        if self.decode_threshold is None or len(response) < self.decode_threshold:
+            return utils.decode_response(response, decoder, self.convert_docs)
+
+        self.log.debug("Decoding %d characters of response in an executor.", len(response))
+        return await self.loop.run_in_executor(
+            self.executor, utils.decode_response, response, decoder, self.convert_docs)
+
+    async def _select(self, params, search_handler='select', stream=False):
         # specify json encoding of results
-        params['wt'] = 'json'
-        params_encoded = urlencode(params, doseq=True)
+        params = dict(params, wt='json')
+        canonical = utils.canonical_params(params)
+
+        if self.json_requests and utils.params_length(canonical) >= self.max_get_length:
+            # Too long for a GET either way, so skip URL encoding entirely
+            # and let Solr's JSON Request API take it.
+            response = await self._json_request(
+                {'params': utils.params_dict(canonical)}, search_handler, stream=stream)
+            return response
 
-        if len(params_encoded) < 1024:
+        params_encoded = utils.encode_canonical_params(canonical)
+
+        if len(params_encoded) < self.max_get_length:
             # Typical case.
             path = '%s/?%s' % (search_handler, params_encoded)
-            response = await self._send_request('get', path)
+            response = await self._send_request('get', path, stream=stream)
             return response
         else:
             # Handles very long queries by submitting as a POST.
@@ -128,9 +299,23 @@ class Solr(object):
                 'Content-type': 'application/x-www-form-urlencoded; charset=utf-8',
             }
             response = await self._send_request(
-                'post', path, body=params_encoded, headers=headers)
+                'post', path, body=params_encoded, headers=headers, idempotent=True,
+                stream=stream)
             return response
 
+    async def _json_request(self, body, search_handler='select', stream=False):
+        """
+        POSTs a JSON Request API body to ``search_handler``.
+        """
+        path = '%s/?wt=json' % search_handler
+        headers = {
+            'Content-type': 'application/json; charset=utf-8',
+        }
+        response = await self._send_request(
+            'post', path, body=utils.json_dumps(body), headers=headers, idempotent=True,
+            stream=stream)
+        return response
+
     def _is_null_value(self, value):
         return utils.is_null_value(value)
 
@@ -141,39 +326,40 @@ class Solr(object):
         return utils.to_python(value)
 
     def _build_doc(self, doc, boost=None, fieldUpdates=None):
-        doc_elem = ElementTree.Element('doc')
+        return utils.build_doc(
+            doc, boost=boost, fieldUpdates=fieldUpdates,
+            is_null=self._is_null_value, convert=self._from_python)
 
-        for key, value in doc.items():
-            if key == 'boost':
-                doc_elem.set('boost', utils.force_unicode(value))
-                continue
+    def _build_docs_xml(self, docs, boost=None, fieldUpdates=None):
+        return ''.join(
+            ElementTree.tostring(self._build_doc(doc, boost=boost, fieldUpdates=fieldUpdates), encoding='unicode')
+            for doc in docs)
 
-            # To avoid multiple code-paths we'd like to treat all of our values as iterables:
-            if isinstance(value, (list, tuple)):
-                values = value
-            else:
-                values = (value, )
-
-            for bit in values:
-                if self._is_null_value(bit):
-                    continue
-
-                attrs = {'name': key}
-
-                if fieldUpdates and key in fieldUpdates:
-                    attrs['update'] = fieldUpdates[key]
-
-                if boost and key in boost:
-                    attrs['boost'] = utils.force_unicode(boost[key])
-
-                field = ElementTree.Element('field', **attrs)
-                field.text = self._from_python(bit)
-
-                doc_elem.append(field)
-
-        return doc_elem
-
-    async def _update(self, message, clean_ctrl_chars=True, commit=True, softCommit=False, waitFlush=None, waitSearcher=None, overwrite=None):
+    async def _build_docs_xml_in_executor(self, docs, boost=None, fieldUpdates=None):
+        """
+        Serializes ``docs`` in ``self.executor``, ``self.serialize_chunk_size``
+        docs at a time, and glues the pieces back together in order. Control
+        characters are stripped in the workers as well, so nothing is left
+        to go over the whole body on the loop.
+
+        ElementTree holds the GIL: in a thread pool this keeps the loop
+        responsive, but the chunks aren't serialized any faster than
+        inline. Pass a ``ProcessPoolExecutor`` as ``executor`` to spread
+        them over several cores.
+
+        Note that the workers use ``utils.from_python`` & friends, so
+        overrides of ``_from_python``/``_is_null_value`` don't apply here.
+        """
+        size = self.serialize_chunk_size
+        chunks = [docs[i:i + size] for i in range(0, len(docs), size)]
+        pieces = await asyncio.gather(*[
+            self.loop.run_in_executor(
+                self.executor, utils.build_docs_xml, chunk, boost, fieldUpdates, True)
+            for chunk in chunks
+        ])
+        return ''.join(pieces)
+
+    async def _update(self, message, clean_ctrl_chars=True, commit=True, softCommit=False, waitFlush=None, waitSearcher=None, overwrite=None, commitWithin=None, content_type='text/xml; charset=utf-8', idempotent=True):
         """
         Posts the given xml message to http://<self.url>/update and
         returns the result.
@@ -182,6 +368,13 @@ class Solr(object):
         of control characters (default True). This is done by default because
         these characters would cause Solr to fail to parse the XML. Only pass
         False if you're positive your data is clean.
+
+        Pass a different `content_type` to post JSON (or any other format
+        Solr's update handler understands) instead of XML.
+
+        Pass `idempotent` as False if sending the message twice would do
+        something different than sending it once (default True: adds,
+        deletes and commits can safely be repeated).
         """
         path = 'update/'
 
@@ -204,27 +397,60 @@ class Solr(object):
         if waitSearcher is not None:
             query_vars.append('waitSearcher=%s' % str(bool(waitSearcher)).lower())
 
+        if commitWithin is not None:
+            query_vars.append('commitWithin=%d' % int(commitWithin))
+
         if query_vars:
             path = '%s?%s' % (path, '&'.join(query_vars))
 
-        # Clean the message of ctrl characters.
-        if clean_ctrl_chars:
-            message = utils.sanitize(message)
+        headers = {'Content-type': content_type}
 
-        response = await self._send_request('post', path, message, {'Content-type': 'text/xml; charset=utf-8'})
+        # Streamed messages clean themselves and go out as they are.
+        if not hasattr(message, '__aiter__'):
+            # Clean the message of ctrl characters.
+            if clean_ctrl_chars:
+                message = utils.sanitize(message)
+
+            message = await self._compress_body(message, headers)
+
+        try:
+            response = await self._send_request('post', path, message, headers, idempotent=idempotent)
+        finally:
+            # Even a failed update may have been applied.
+            self._invalidate_results()
         return response
 
+    async def _compress_body(self, body, headers):
+        """
+        Gzips ``body`` if request compression is enabled and it is at least
+        ``self.compression_threshold`` bytes long, adding the matching
+        ``Content-Encoding`` to ``headers``.
+
+        Returns the body as bytes, compressed or not.
+        """
+        body = utils.force_bytes(body)
+
+        if not self.compress_requests or len(body) < self.compression_threshold:
+            return body
+
+        # zlib releases the GIL, so this doesn't hold up the loop thread.
+        compressed = await self.loop.run_in_executor(
+            self.executor, utils.gzip_compress, body, self.compression_level)
+        headers['Content-Encoding'] = 'gzip'
+        self.log.debug("Compressed request body from %d to %d bytes.", len(body), len(compressed))
+        return compressed
+
     async def _suggest_terms(self, params):
         # specify json encoding of results
-        params['wt'] = 'json'
-        path = 'terms/?%s' % urlencode(params, doseq=True)
+        params = dict(params, wt='json')
+        path = 'terms/?%s' % utils.encode_params(params)
         response = await self._send_request('get', path)
         return response
 
     async def _mlt(self, params):
         # specify json encoding of results
-        params['wt'] = 'json'
-        path = 'mlt/?%s' % urlencode(params, doseq=True)
+        params = dict(params, wt='json')
+        path = 'mlt/?%s' % utils.encode_params(params)
         response = await self._send_request('get', path)
         return response
 
@@ -232,7 +458,8 @@ class Solr(object):
         """
         Performs a search and returns the results.
 
-        Requires a ``q`` for a string version of the query to run.
+        Requires a ``q`` for a string version of the query to run. ``q`` can
+        also be a ``query.Query``, whose parameters are then used.
 
         Optionally accepts ``**kwargs`` for additional options to be passed
         through the Solr URL.
@@ -252,10 +479,153 @@ class Solr(object):
             })
 
         """
-        params = {'q': q}
+        if isinstance(q, Query):
+            params = q.to_params()
+        else:
+            params = {'q': q}
         params.update(kwargs)
+
+        if self.query_shaper is not None:
+            params = self.query_shaper.shape(params)
+
+        cache_key = None
+        generation = None
+
+        if self.results_cache is not None:
+            cache_key = self._results_cache_key(search_handler, params)
+            # Read before the request, so results that raced a write aren't
+            # cached as current.
+            generation = getattr(self.results_cache, 'generation', None)
+            cached = self.results_cache.get(cache_key)
+
+            if cached is not None:
+                self.log.debug("Serving search results from cache.")
+                return self.results_cls(utils.unpack(cached))
+
         response = await self._select(params, search_handler)
-        decoded = self.decoder.decode(response)
+        decoded = await self._decode(response)
+
+        if cache_key is not None:
+            self._cache_results(cache_key, decoded, generation)
+
+        self.log.debug(
+            "Found '%s' search results.",
+            # cover both cases: there is no response key or value is None
+            (decoded.get('response', {}) or {}).get('numFound', 0)
+        )
+        return self.results_cls(decoded)
+
+    async def search_iter(self, q, search_handler='select', chunk_size=64 * 1024, **kwargs):
+        """
+        Performs a search and returns a ``json_stream.ResultsStream``, an
+        async iterator over the documents that parses each one as soon as it
+        has come in, instead of after the whole response.
+
+        Takes the same arguments as ``search()``, plus ``chunk_size``, the
+        number of bytes read off the connection at a time. Results are
+        never cached.
+
+        ``hits``, ``qtime`` and ``header`` are available as soon as this
+        returns; anything after the documents (facets, highlighting, ...)
+        is in ``response`` once they've all been read. Call ``close()`` on
+        the stream to stop early. ``self.timeout`` applies to each chunk
+        read as well, so a connection stalled halfway through raises a
+        ``SolrTimeoutError`` rather than hanging.
+
+        Usage::
+
+            stream = yield from solr.search_iter('*:*', rows=50000)
+            print(stream.hits)
+
+            async for doc in stream:
+                print(doc['id'])
+
+        """
+        if isinstance(q, Query):
+            params = q.to_params()
+        else:
+            params = {'q': q}
+        params.update(kwargs)
+
+        if self.query_shaper is not None:
+            params = self.query_shaper.shape(params)
+
+        resp = await self._select(params, search_handler, stream=True)
+        stream = ResultsStream(resp, self._response_decoder(), chunk_size=chunk_size,
+                               convert=self.convert_docs, timeout=self.timeout)
+
+        try:
+            await stream.start()
+        except Exception:
+            stream.close()
+            raise
+
+        self.log.debug("Streaming '%s' search results.", stream.hits)
+        return stream
+
+    async def parallel_scan(self, q='*:*', partitions=4, field='id', **kwargs):
+        """
+        Reads every document matching ``q`` through ``partitions``
+        concurrent cursors over disjoint slices of the index, for full
+        collection dumps. Returns a ``scan.ParallelScan``, an async iterator
+        over the documents in no particular order that also tracks the
+        progress of each partition.
+
+        By default the index is split on a hash of ``field``; see
+        ``ParallelScan`` for splitting by numeric ranges or by shard, for
+        reading from replicas, for ``/export`` and for how failed pages are
+        retried. Any other keyword
+        arguments are passed on as search parameters.
+
+        Usage::
+
+            scan = yield from solr.parallel_scan('*:*', partitions=8, fl='id,title')
+
+            async for doc in scan:
+                print(doc['id'])
+
+            print(scan.partitions)
+
+        """
+        scan = ParallelScan(self, q, partitions=partitions, field=field, **kwargs)
+        await scan.start()
+        return scan
+
+    async def search_json(self, query, search_handler='select', **kwargs):
+        """
+        Performs a search through Solr's JSON Request API and returns the
+        results.
+
+        Requires ``query``, either a ``query.Query`` or a JSON request body
+        as a dictionary (``query``, ``filter``, ``facet``, ``params``, ...).
+
+        Optionally accepts ``**kwargs``, which are added to the ``params``
+        block of the body.
+
+        Returns ``self.results_cls`` class object (defaults to
+        ``pysolr.Results``)
+
+        Requires Solr 5.1+.
+
+        Usage::
+
+            results = yield from solr.search_json({
+                'query': 'title:bananas',
+                'filter': [Terms('id', ids).to_string()],
+                'facet': {'categories': {'type': 'terms', 'field': 'cat'}},
+            }, rows=50)
+
+        """
+        if isinstance(query, Query):
+            body = query.to_json()
+        else:
+            body = dict(query)
+
+        if kwargs:
+            body['params'] = dict(body.get('params') or {}, **kwargs)
+
+        response = await self._json_request(body, search_handler)
+        decoded = await self._decode(response)
 
         self.log.debug(
             "Found '%s' search results.",
@@ -264,6 +634,27 @@ class Solr(object):
         )
         return self.results_cls(decoded)
 
+    def _results_cache_key(self, search_handler, params):
+        return '%s/%s?%s' % (self.url, search_handler, utils.params_key(params))
+
+    def _cache_results(self, cache_key, decoded, generation=None):
+        try:
+            packed = utils.pack(decoded)
+        except (TypeError, ValueError) as err:
+            # e.g. datetimes from ``convert_docs``.
+            self.log.debug("Not caching search results: %s", err)
+            return
+
+        if generation is None:
+            self.results_cache.set(cache_key, packed)
+        else:
+            self.results_cache.set(cache_key, packed, generation=generation)
+
+    def _invalidate_results(self):
+        invalidate = getattr(self.results_cache, 'invalidate', None)
+        if invalidate is not None:
+            invalidate()
+
     async def more_like_this(self, q, mltfl, **kwargs):
         """
         Finds and returns results similar to the provided query.
@@ -284,7 +675,7 @@ class Solr(object):
         }
         params.update(kwargs)
         response = await self._mlt(params)
-        decoded = self.decoder.decode(response)
+        decoded = await self._decode(response)
 
         self.log.debug(
             "Found '%s' MLT results.",
@@ -308,7 +699,7 @@ class Solr(object):
         }
         params.update(kwargs)
         response = await self._suggest_terms(params)
-        result = self.decoder.decode(response)
+        result = await self._decode(response)
         terms = result.get("terms", {})
         res = {}
 
@@ -328,7 +719,8 @@ class Solr(object):
 
             res[field] = tmp
 
-        self.log.debug("Found '%d' Term suggestions results.", sum(len(j) for i, j in res.items()))
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("Found '%d' Term suggestions results.", sum(len(j) for i, j in res.items()))
         return res
 
 
@@ -355,6 +747,10 @@ class Solr(object):
 
         Optionally accepts ``overwrite``. Default is ``None``.
 
+        With ``stream_adds`` (or ``max_add_bytes``) set on the client, the
+        body is encoded while it's sent, split into requests of about
+        ``max_add_bytes``, and any commit follows as its own request.
+
         Usage::
 
             yield from solr.add([
@@ -370,22 +766,151 @@ class Solr(object):
         """
         start_time = time.time()
         self.log.debug("Starting to build add request...")
-        message = ElementTree.Element('add')
 
-        if commitWithin:
-            message.set('commitWithin', commitWithin)
+        if not isinstance(docs, (list, tuple)):
+            docs = list(docs)
+
+        idempotent = utils.atomic_updates_idempotent(docs, fieldUpdates)
+
+        if self.stream_adds:
+            try:
+                return await self._add_streaming(
+                    docs, boost=boost, fieldUpdates=fieldUpdates, commit=commit, softCommit=softCommit,
+                    commitWithin=commitWithin, waitFlush=waitFlush, waitSearcher=waitSearcher,
+                    overwrite=overwrite, idempotent=idempotent)
+            finally:
+                # Some batches may have been applied even if it failed.
+                self._invalidate_docs(doc.get(self.unique_key) for doc in docs)
+
+        clean_ctrl_chars = True
 
-        for doc in docs:
-            message.append(self._build_doc(doc, boost=boost, fieldUpdates=fieldUpdates))
+        if self.serialize_threshold is not None and len(docs) >= self.serialize_threshold:
+            docs_xml = await self._build_docs_xml_in_executor(
+                docs, boost=boost, fieldUpdates=fieldUpdates)
+            # Cleaned by the workers already.
+            clean_ctrl_chars = False
+        else:
+            docs_xml = self._build_docs_xml(
+                docs, boost=boost, fieldUpdates=fieldUpdates)
+
+        attrs = ''
+        if commitWithin:
+            attrs = ' commitWithin=%s' % quoteattr(utils.force_unicode(commitWithin))
 
-        # This returns a bytestring. Ugh.
-        m = ElementTree.tostring(message, encoding='utf-8')
-        # Convert back to Unicode please.
-        m = utils.force_unicode(m)
+        m = '<add%s>%s</add>' % (utils.sanitize(attrs), docs_xml)
 
         end_time = time.time()
-        self.log.debug("Built add request of %s docs in %0.2f seconds.", len(message), end_time - start_time)
-        response = await self._update(m, commit=commit, softCommit=softCommit, waitFlush=waitFlush, waitSearcher=waitSearcher, overwrite=overwrite)
+        self.log.debug("Built add request of %s docs in %0.2f seconds.", len(docs), end_time - start_time)
+        try:
+            return await self._update(m, clean_ctrl_chars=clean_ctrl_chars, commit=commit, softCommit=softCommit, waitFlush=waitFlush, waitSearcher=waitSearcher, overwrite=overwrite, idempotent=idempotent)
+        finally:
+            # A failed request may have been applied all the same.
+            self._invalidate_docs(doc.get(self.unique_key) for doc in docs)
+
+
+    async def _add_streaming(self, docs, boost=None, fieldUpdates=None, commit=True, softCommit=False,
+                             commitWithin=None, waitFlush=None, waitSearcher=None, overwrite=None,
+                             idempotent=True):
+        """
+        Sends ``docs`` in one or more streamed ``<add>`` requests (see
+        ``streams.XMLAddStream``). Each value is escaped and encoded as the
+        body goes out, so memory use stays flat even for huge documents.
+
+        Whether a request is the last one is only known once its body has
+        been sent, so any commit is sent as a separate request at the end.
+        """
+        attrs = ''
+        if commitWithin:
+            attrs = ' commitWithin=%s' % quoteattr(utils.force_unicode(commitWithin))
+
+        encode = functools.partial(
+            utils.iter_doc_xml, boost=boost, fieldUpdates=fieldUpdates,
+            is_null=self._is_null_value, convert=self._from_python,
+            chunk_size=self.stream_chunk_size)
+        docs = iter(docs)
+        response = None
+        requests = 0
+
+        # Each body pulls documents off ``docs`` until it's full.
+        for first in docs:
+            body = XMLAddStream(
+                first, docs, encode, attrs=attrs, max_bytes=self.max_add_bytes,
+                buffer_size=self.stream_chunk_size)
+            response = await self._update(
+                body, commit=None, softCommit=None, overwrite=overwrite, idempotent=idempotent)
+            requests += 1
+            self.log.debug("Streamed %d docs in %d bytes.", body.count, body.bytes)
+
+        self.log.debug("Streamed add request in %d requests.", requests)
+
+        if commit or (commit is None and softCommit):
+            response = await self.commit(
+                softCommit=commit is None, waitFlush=waitFlush, waitSearcher=waitSearcher)
+
+        return response
+
+    async def update_fields(self, ops, batch_size=1000, unique_key='id', commit=True, softCommit=False, commitWithin=None, waitFlush=None, waitSearcher=None):
+        """
+        Applies atomic (partial) updates to existing documents.
+
+        Requires ``ops``, a list of dictionaries. Each one names the document
+        by its ``unique_key`` and maps any of ``set``, ``add``,
+        ``add-distinct``, ``inc``, ``remove`` & ``removeregex`` to a
+        dictionary of ``{field: value}``. Include ``_version_`` for
+        optimistic concurrency; Solr rejects the update if it doesn't match.
+
+        The updates are posted as compact JSON, ``batch_size`` documents per
+        request. Commit options only apply to the last batch.
+
+        Optionally accepts ``unique_key``. Default is ``'id'``.
+
+        Optionally accepts ``commit``. Default is ``True``.
+
+        Optionally accepts ``softCommit``. Default is ``False``.
+
+        Optionally accepts ``commitWithin``. Default is ``None``.
+
+        Optionally accepts ``waitFlush``. Default is ``None``.
+
+        Optionally accepts ``waitSearcher``. Default is ``None``.
+
+        Returns the response of the last batch, or ``None`` if ``ops`` is
+        empty.
+
+        Usage::
+
+            yield from solr.update_fields([
+                {'id': 'doc_1', 'inc': {'popularity': 1}},
+                {'id': 'doc_2', 'set': {'title': 'New title'}, 'add': {'tags': 'new'}},
+                {'id': 'doc_3', 'remove': {'tags': 'old'}, '_version_': 1234567890},
+            ])
+        """
+        updates = [utils.build_atomic_update(op, unique_key=unique_key) for op in ops]
+        idempotent = utils.atomic_updates_idempotent(updates)
+        response = None
+
+        for start in range(0, len(updates), batch_size):
+            batch = updates[start:start + batch_size]
+            message = utils.json_dumps(batch)
+            last = start + batch_size >= len(updates)
+            self.log.debug("Sending %d atomic updates.", len(batch))
+
+            try:
+                # JSON already escapes control characters, nothing to clean.
+                response = await self._update(
+                    message, clean_ctrl_chars=False,
+                    commit=commit if last else False,
+                    softCommit=softCommit if last else None,
+                    commitWithin=commitWithin if last else None,
+                    waitFlush=waitFlush if last else None,
+                    waitSearcher=waitSearcher if last else None,
+                    content_type='application/json; charset=utf-8',
+                    idempotent=idempotent)
+            finally:
+                # Even a failed batch may have been applied, and the ones
+                # before it were.
+                self._invalidate_docs(update[unique_key] for update in batch)
+
         return response
 
 
@@ -406,13 +931,25 @@ class Solr(object):
             yield from solr.commit()
 
         """
+        attrs = ''
+
         if expungeDeletes is not None:
-            msg = '<commit expungeDeletes="%s" />' % str(bool(expungeDeletes)).lower()
-        else:
-            msg = '<commit />'
+            attrs += ' expungeDeletes="%s"' % str(bool(expungeDeletes)).lower()
+
+        if softCommit:
+            # A bare ``<commit />`` is always a hard commit, whatever the URL
+            # says, so a soft commit has to be requested in the message.
+            attrs += ' softCommit="true"'
+            response = await self._update(
+                '<commit%s />' % attrs,
+                commit=None,
+                softCommit=None,
+                waitFlush=waitFlush,
+                waitSearcher=waitSearcher)
+            return response
 
         response = await self._update(
-            msg,
+            '<commit%s />' % attrs,
             softCommit=softCommit,
             waitFlush=waitFlush,
             waitSearcher=waitSearcher)
@@ -470,15 +1007,192 @@ class Solr(object):
         elif id is not None and q is not None:
             raise ValueError('You many only specify "id" OR "q", not both.')
         elif id is not None:
-            m = '<delete><id>%s</id></delete>' % id
+            m = utils.build_delete_xml(ids=[id])
         elif q is not None:
-            m = '<delete><query>%s</query></delete>' % q
+            m = utils.build_delete_xml(queries=[q])
 
-        response = await self._update(m, commit=commit, waitFlush=waitFlush, waitSearcher=waitSearcher)
-        return response
+        try:
+            return await self._update(m, commit=commit, waitFlush=waitFlush, waitSearcher=waitSearcher)
+        finally:
+            # A failed request may have been applied all the same.
+            if id is not None:
+                self._invalidate_docs([id])
+            else:
+                self._invalidate_docs(everything=True)
+
+
+    async def delete_many(self, ids=None, queries=None, chunk_size=1000, concurrency=4, commit=None, waitFlush=None, waitSearcher=None):
+        """
+        Deletes many documents with as few requests as possible.
+
+        Accepts ``ids``, an iterable of document ids, and/or ``queries``, an
+        iterable of Lucene-style queries. They're split into chunks of up to
+        ``chunk_size`` entries, each sent as one ``<delete>`` command, with at
+        most ``concurrency`` requests in flight.
+
+        Unlike ``delete()`` nothing is committed unless asked for: pass
+        ``commit=True`` to issue a single commit once every chunk is done.
+
+        Optionally accepts ``waitFlush``. Default is ``None``.
+
+        Optionally accepts ``waitSearcher``. Default is ``None``.
+
+        Returns a list of the responses for each chunk.
+
+        Usage::
+
+            yield from solr.delete_many(ids=expired_ids)
+            yield from solr.delete_many(queries=['expires:[* TO NOW]'], commit=True)
+
+        """
+        ids = list(ids or ())
+        queries = list(queries or ())
+
+        if not ids and not queries:
+            raise ValueError('You must specify "ids" or "queries".')
+
+        # ``(message, ids)``, with ``None`` for messages deleting by query.
+        messages = [
+            (utils.build_delete_xml(ids=ids[i:i + chunk_size]), ids[i:i + chunk_size])
+            for i in range(0, len(ids), chunk_size)
+        ] + [
+            (utils.build_delete_xml(queries=queries[i:i + chunk_size]), None)
+            for i in range(0, len(queries), chunk_size)
+        ]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(message, message_ids):
+            async with semaphore:
+                try:
+                    return await self._update(message, commit=None, softCommit=None)
+                finally:
+                    # Even a failed request may have been applied.
+                    if message_ids is None:
+                        self._invalidate_docs(everything=True)
+                    else:
+                        self._invalidate_docs(message_ids)
+
+        self.log.debug("Deleting %d ids and %d queries in %d requests.",
+                       len(ids), len(queries), len(messages))
+        responses = await asyncio.gather(*[
+            send(message, message_ids) for message, message_ids in messages])
+
+        if commit:
+            await self.commit(waitFlush=waitFlush, waitSearcher=waitSearcher)
+
+        return list(responses)
+
+
+    def _invalidate_docs(self, ids=(), everything=False):
+        if self.doc_cache is None:
+            return
+
+        if everything:
+            self.doc_cache.clear()
+            return
+
+        for id in ids:
+            if id is not None:
+                self.doc_cache.invalidate(id)
+
+    async def get(self, ids, fl=None, chunk_size=100, concurrency=4, **kwargs):
+        """
+        Fetches documents by id through the real-time get handler, which
+        sees the latest version of a document, committed or not, and skips
+        the query parser entirely.
+
+        Requires ``ids``, an iterable of document ids (or a single id). They
+        are fetched ``chunk_size`` at a time with at most ``concurrency``
+        requests in flight.
+
+        Optionally accepts ``fl``, the fields to return.
+
+        Optionally accepts ``**kwargs`` for additional options to be passed
+        through the Solr URL.
+
+        If the client has a ``doc_cache``, documents found there aren't
+        fetched again, and fetched ones are added to it.
+
+        Returns the list of documents found, in the order of ``ids``.
 
+        Requires Solr 4.0+.
+
+        Usage::
+
+            docs = yield from solr.get(['doc_1', 'doc_2'], fl='id,title')
 
-    async def extract(self, file_obj, extractOnly=True, **kwargs):
+        """
+        if isinstance(ids, (str, bytes, int)):
+            ids = [ids]
+
+        ids = [utils.force_unicode(id) for id in ids]
+        found = {}
+        missing = []
+
+        for id in ids:
+            doc = None
+            if self.doc_cache is not None:
+                doc = self.doc_cache.get(id, fl)
+
+            if doc is not None:
+                found[id] = doc
+            elif id not in found:
+                missing.append(id)
+
+        # Preserve order, drop duplicates.
+        missing = list(dict.fromkeys(missing))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        # Docs are matched up by id, so it's asked for even if ``fl`` leaves
+        # it out, and removed again afterwards.
+        request_fl = fl
+        strip_key = False
+        if fl is not None and not utils.fl_includes(fl, self.unique_key):
+            request_fl = '%s,%s' % (fl, self.unique_key)
+            strip_key = True
+
+        async def fetch(chunk):
+            params = {'ids': ','.join(utils.escape_ids(chunk))}
+            if request_fl is not None:
+                params['fl'] = request_fl
+            params.update(kwargs)
+
+            async with semaphore:
+                response = await self._select(params, 'get')
+
+            decoded = await self._decode(response)
+
+            # A single id may come back as ``doc`` rather than a doc list.
+            if 'doc' in decoded:
+                return [decoded['doc']] if decoded['doc'] is not None else []
+            return (decoded.get('response') or {}).get('docs', [])
+
+        chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+        generation = None
+        if self.doc_cache is not None and chunks:
+            generation = self.doc_cache.begin_fetch()
+
+        try:
+            fetched = await asyncio.gather(*[fetch(chunk) for chunk in chunks])
+
+            for docs in fetched:
+                for doc in docs:
+                    if strip_key:
+                        id = utils.force_unicode(doc.pop(self.unique_key, None))
+                    else:
+                        id = utils.force_unicode(doc.get(self.unique_key))
+                    found[id] = doc
+                    if self.doc_cache is not None:
+                        # Skipped if a write invalidated it meanwhile.
+                        self.doc_cache.set(id, fl, doc, generation)
+        finally:
+            if generation is not None:
+                self.doc_cache.end_fetch(generation)
+
+        self.log.debug("Got %d of %d docs, %d from cache.", len(found), len(ids), len(ids) - len(missing))
+        return [found[id] for id in ids if id in found]
+
+    async def extract(self, file_obj, extractOnly=True, name=None, **kwargs):
         """
         POSTs a file to the Solr ExtractingRequestHandler so rich content can
         be processed using Apache Tika. See the Solr wiki for details:
@@ -501,9 +1215,35 @@ class Solr(object):
                         Extracted full-text content, if applicable
             :metadata:
                         key:value pairs of text strings
+
+        ``file_obj`` may be a path, an open file, an ``mmap.mmap`` or any
+        other object with a ``read(size)`` method. Its contents are streamed
+        to Solr a chunk at a time, so even very large files are never read
+        into memory whole.
+
+        Optionally accepts ``name``, the file name sent to Solr. Default is
+        ``file_obj.name`` (required for objects without one, like ``mmap``).
+
+        Usage::
+
+            with open('report.pdf', 'rb') as pdf:
+                data = yield from solr.extract(pdf)
+
+            data = yield from solr.extract('/data/report.pdf', **{'literal.id': 'report'})
+
         """
-        if not hasattr(file_obj, "name"):
-            raise ValueError("extract() requires file-like objects which have a defined name property")
+        opened = None
+
+        if isinstance(file_obj, str):
+            opened = file_obj = await self.loop.run_in_executor(None, open, file_obj, 'rb')
+
+        if name is None:
+            name = getattr(file_obj, "name", None)
+
+        if not name:
+            if opened is not None:
+                opened.close()
+            raise ValueError("extract() requires file-like objects which have a defined name property, or a name")
 
         params = {
             "extractOnly": "true" if extractOnly else "false",
@@ -518,31 +1258,185 @@ class Solr(object):
             resp = await self._send_request(
                 'post', 'update/extract',
                 body=params,
-                files=[file_obj])
+                files=[(name, file_obj)])
         except (IOError, SolrError) as err:
             self.log.error("Failed to extract document metadata: %s", err,
                            exc_info=True)
             raise
+        finally:
+            if opened is not None:
+                opened.close()
+            if not extractOnly:
+                self._invalidate_results()
 
         try:
-            data = json.loads(resp)
+            data = await self._decode(resp)
         except ValueError as err:
             self.log.error("Failed to load JSON response: %s", err,
                            exc_info=True)
             raise
 
-        data['contents'] = data.pop(file_obj.name, None)
-        data['metadata'] = metadata = {}
+        data['contents'] = data.pop(name, None)
+        # The raw format is somewhat annoying: it's a flat list of
+        # alternating keys and value lists
+        data['metadata'] = utils.parse_extract_metadata(data.pop("%s_metadata" % name, None))
 
-        raw_metadata = data.pop("%s_metadata" % file_obj.name, None)
+        return data
 
-        if raw_metadata:
-            # The raw format is somewhat annoying: it's a flat list of
-            # alternating keys and value lists
-            while raw_metadata:
-                metadata[raw_metadata.pop()] = raw_metadata.pop()
+    def extract_many(self, files, concurrency=4, return_exceptions=False, **kwargs):
+        """
+        Extracts many files with at most ``concurrency`` uploads in flight.
 
-        return data
+        Requires ``files``, an iterable of anything ``extract()`` takes
+        (paths are best: each file is only opened when its turn comes).
+        It's consumed as results are handed out, never more than
+        ``concurrency`` files ahead, so it can be a long generator.
+
+        Any extra keyword arguments are passed on to ``extract()``.
+
+        Returns an iterator of futures in the order they complete, each
+        resolving to a ``(file, data)`` tuple, so results can be handled as
+        they come in. A failed extraction raises from its own future only or,
+        with ``return_exceptions=True``, resolves to ``(file, exception)``.
+        Closing the iterator, or dropping it before the end, cancels the
+        extractions still in flight.
+
+        Usage::
+
+            for future in solr.extract_many(paths, concurrency=8):
+                path, data = yield from future
+
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        files = iter(files)
+        running = set()
+        done = asyncio.Queue()
+
+        async def extract_one(file_obj):
+            async with semaphore:
+                try:
+                    data = await self.extract(file_obj, **kwargs)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as err:
+                    if not return_exceptions:
+                        raise
+                    data = err
+            return file_obj, data
+
+        def start_next():
+            try:
+                file_obj = next(files)
+            except StopIteration:
+                return False
+
+            task = self.loop.create_task(extract_one(file_obj))
+            task.add_done_callback(done.put_nowait)
+            running.add(task)
+            return True
+
+        async def next_result():
+            task = await done.get()
+            running.discard(task)
+            return task.result()
+
+        started = handed_out = 0
+
+        try:
+            while True:
+                # Keep up to ``concurrency`` extractions going that haven't
+                # been picked up yet, and at least one to hand out.
+                while len(running) < concurrency and start_next():
+                    started += 1
+
+                if handed_out == started:
+                    if not start_next():
+                        return
+                    started += 1
+
+                handed_out += 1
+                yield next_result()
+        except GeneratorExit:
+            for task in running:
+                task.cancel()
+            raise
+
+    async def extract_and_index(self, files, transform, concurrency=4, batch_size=100,
+                                extract_kwargs=None, **kwargs):
+        """
+        Extracts many files and indexes documents built from them, without
+        a second round trip per file.
+
+        Requires ``files``, as for ``extract_many()``, and ``transform``, a
+        function called as ``transform(file, data)`` with what ``extract()``
+        returned. It returns the document to index, or ``None`` to skip the
+        file. It runs in the loop's default executor, so it can chew on
+        large contents without stalling the loop.
+
+        Optionally accepts ``concurrency``, the number of uploads in flight.
+        Default is ``4``.
+
+        Optionally accepts ``batch_size``, the number of documents per
+        ``add()``. Default is ``100``.
+
+        Optionally accepts ``extract_kwargs``, a dictionary of options for
+        ``extract()``.
+
+        Any extra keyword arguments are passed on to ``add()``.
+
+        Files that fail to extract, for whatever reason, are logged and
+        skipped. Returns a tuple of the number of documents indexed and the
+        list of failed files. If ``transform`` or ``add()`` raise, the
+        extractions still in flight are cancelled.
+
+        Usage::
+
+            def to_doc(path, data):
+                return {'id': path, 'text': data['contents'], 'title': data['metadata'].get('title')}
+
+            indexed, failed = yield from solr.extract_and_index(paths, to_doc, commit=False)
+
+        """
+        extract_kwargs = dict(extract_kwargs or {}, extractOnly=True)
+        batch = []
+        indexed = 0
+        failed = []
+
+        results = self.extract_many(files, concurrency=concurrency,
+                                    return_exceptions=True, **extract_kwargs)
+
+        try:
+            for future in results:
+                file_obj, data = await future
+
+                if isinstance(data, Exception):
+                    self.log.warning("Skipping %r, which failed to extract: %s", file_obj, data)
+                    failed.append(file_obj)
+                    continue
+
+                doc = await self.loop.run_in_executor(None, transform, file_obj, data)
+
+                if doc is None:
+                    continue
+
+                batch.append(doc)
+
+                if len(batch) >= batch_size:
+                    await self.add(batch, **kwargs)
+                    indexed += len(batch)
+                    batch = []
+        finally:
+            # Stops the uploads still in flight if ``transform`` or ``add()``
+            # failed.
+            results.close()
+
+        if batch:
+            await self.add(batch, **kwargs)
+            indexed += len(batch)
+
+        self.log.debug("Extracted and indexed %d documents, %d files failed.", indexed, len(failed))
+        return indexed, failed
 
     def close(self):
-        self.session.close()
+        # A coroutine to wait for on aiohttp 2.0+.
+        return self.session.close()
@@ -0,0 +1,355 @@
+# coding: utf-8
+import asyncio
+from numbers import Number
+from . import utils
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _is_number(value):
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+def fold_operation(current, op, value):
+    """
+    Folds the atomic update ``op``/``value`` into the ``current``
+    ``[op, value]`` pending for the same field.
+
+    Returns the folded ``[op, value]`` or ``None`` if the two can't be
+    expressed as a single operation.
+    """
+    current_op, current_value = current
+
+    if op == 'set':
+        return ['set', value]
+
+    if current_op == 'set':
+        if op == 'inc' and _is_number(current_value) and _is_number(value):
+            return ['set', current_value + value]
+        if op == 'add' and current_value is not None:
+            return ['set', _as_list(current_value) + _as_list(value)]
+        return None
+
+    if current_op == op:
+        if op == 'inc':
+            return ['inc', current_value + value]
+        return [op, _as_list(current_value) + _as_list(value)]
+
+    return None
+
+
+def apply_operation(doc, op, field, value):
+    """
+    Applies an atomic update to a pending (not yet sent) document in place.
+
+    Returns ``False`` if it can't be done client-side, leaving ``doc``
+    untouched.
+    """
+    if op == 'set':
+        if value is None:
+            doc.pop(field, None)
+        else:
+            doc[field] = value
+        return True
+
+    if op == 'inc':
+        if field in doc and not _is_number(doc[field]):
+            return False
+        doc[field] = doc.get(field, 0) + value
+        return True
+
+    if op == 'add':
+        if field in doc:
+            doc[field] = _as_list(doc[field]) + _as_list(value)
+        else:
+            doc[field] = value
+        return True
+
+    return False
+
+
+class _Pending(object):
+
+    __slots__ = ('key', 'doc', 'fields', 'raw', 'live')
+
+    def __init__(self, key, doc=None, fields=None, raw=None):
+        self.key = key
+        # One of: a full ``doc`` to add, atomic updates as
+        # ``{field: [op, value]}``, or an update that must be sent as-is.
+        self.doc = doc
+        self.fields = fields
+        self.raw = raw
+        self.live = True
+
+    def to_update(self, unique_key):
+        if self.raw is not None:
+            return self.raw
+
+        update = {unique_key: self.key}
+
+        for field, (op, value) in self.fields.items():
+            update.setdefault(op, {})[field] = value
+
+        return update
+
+
+class BufferedWriter(object):
+
+    """
+    Buffers writes and collapses the ones that hit the same document before
+    they're sent to Solr.
+
+    Documents passed to ``add()`` replace any pending document with the same
+    ``unique_key`` (last write wins) or, with ``merge=True``, have their
+    fields merged into it. Atomic updates passed to ``update_fields()`` are
+    folded together where possible (``inc`` + ``inc``, ``set`` then
+    ``inc``, ...) or applied straight to a pending document. Writes that
+    can't be collapsed, including any carrying a ``_version_``, are kept in
+    order.
+
+    Pending writes are flushed once there are ``max_pending`` of them, or
+    on ``flush()``, one flush at a time so writes to a document reach Solr
+    in the order they were made. ``received``, ``sent`` and ``eliminated`` count the
+    writes that came in, went out and were collapsed away.
+
+    Any extra keyword arguments are passed on to ``Solr.add()``.
+
+    Example::
+
+        writer = BufferedWriter(solr, max_pending=5000)
+
+        yield from writer.add([{'id': 'doc_1', 'title': 'First'}])
+        yield from writer.add([{'id': 'doc_1', 'title': 'Second'}])
+        yield from writer.update_fields([{'id': 'doc_2', 'inc': {'views': 1}}])
+        yield from writer.update_fields([{'id': 'doc_2', 'inc': {'views': 1}}])
+
+        # One doc and one ``inc`` of 2 go out.
+        yield from writer.flush()
+
+    """
+
+    def __init__(self, solr, unique_key='id', merge=False, max_pending=1000, **add_kwargs):
+        self.solr = solr
+        self.log = solr.log
+        self.unique_key = unique_key
+        self.merge = merge
+        self.max_pending = max_pending
+        self.add_kwargs = add_kwargs
+
+        self.received = 0
+        self.sent = 0
+        self.eliminated = 0
+
+        self._pending = []
+        self._by_key = {}
+        self._dropped = 0
+        self._flushing = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._pending) - self._dropped
+
+    def _key(self, item):
+        key = item.get(self.unique_key)
+        if key is None:
+            raise ValueError('Buffered writes require the "%s" field.' % self.unique_key)
+        return key
+
+    def _append(self, entry):
+        self._pending.append(entry)
+        self._by_key.setdefault(entry.key, []).append(entry)
+
+    def _drop(self, entry):
+        self.eliminated += 1
+        entry.live = False
+        self._dropped += 1
+
+    def _add_doc(self, doc):
+        key = self._key(doc)
+        entries = self._by_key.get(key)
+
+        if entries and self.merge and entries[-1].doc is not None:
+            # ``update()`` is fine, the pending doc is our own copy.
+            entries[-1].doc.update(doc)
+            self.eliminated += 1
+            return
+
+        if entries and not self.merge:
+            # A full document makes everything pending before it moot,
+            # except updates carrying a ``_version_``: those still have to
+            # reach Solr, after whatever they were based on.
+            kept = 0
+            for index, entry in enumerate(entries):
+                if entry.raw is not None and '_version_' in entry.raw:
+                    kept = index + 1
+
+            for entry in entries[kept:]:
+                self._drop(entry)
+            del entries[kept:]
+
+        self._append(_Pending(key, doc=dict(doc)))
+
+    def _update_fields(self, op):
+        key = self._key(op)
+        fields = [
+            (field, operation, value)
+            for operation, field_values in op.items()
+            if operation not in (self.unique_key, '_version_')
+            for field, value in field_values.items()
+        ]
+        entries = self._by_key.get(key)
+        last = entries[-1] if entries else None
+
+        # Anything carrying a ``_version_`` has to reach Solr untouched.
+        if '_version_' in op:
+            self._append(_Pending(key, raw=op))
+            return
+
+        if last is not None and last.raw is None:
+            if last.doc is not None:
+                folded = self._fold_into_doc(last.doc, fields)
+            else:
+                folded = self._fold_into_fields(last.fields, fields)
+
+            if folded:
+                self.eliminated += 1
+                return
+
+        pending = {}
+        if not self._fold_into_fields(pending, fields):
+            # Several operations on one field, e.g. ``add`` and ``remove``.
+            self._append(_Pending(key, raw=op))
+            return
+
+        self._append(_Pending(key, fields=pending))
+
+    def _fold_into_doc(self, doc, fields):
+        scratch = dict(doc)
+
+        for field, operation, value in fields:
+            if not apply_operation(scratch, operation, field, value):
+                return False
+
+        doc.clear()
+        doc.update(scratch)
+        return True
+
+    def _fold_into_fields(self, pending, fields):
+        scratch = dict(pending)
+
+        for field, operation, value in fields:
+            if field in scratch:
+                folded = fold_operation(scratch[field], operation, value)
+                if folded is None:
+                    return False
+                scratch[field] = folded
+            else:
+                scratch[field] = [operation, value]
+
+        pending.clear()
+        pending.update(scratch)
+        return True
+
+    async def add(self, docs):
+        """
+        Buffers documents to be added.
+        """
+        for doc in docs:
+            self.received += 1
+            self._add_doc(doc)
+
+        await self._maybe_flush()
+
+    async def update_fields(self, ops):
+        """
+        Buffers atomic updates, in the format ``Solr.update_fields()`` takes.
+        """
+        for op in ops:
+            self.received += 1
+            self._update_fields(op)
+
+        await self._maybe_flush()
+
+    async def _maybe_flush(self):
+        if len(self) >= self.max_pending:
+            await self.flush()
+
+    async def flush(self):
+        """
+        Sends every pending write, in order. Consecutive documents go out as
+        one ``add()`` and consecutive updates as one ``update_fields()``.
+
+        If sending fails, the writes that didn't go out are buffered again,
+        ahead of any that came in meanwhile, and the error is raised. The
+        run that failed may have been applied in part or in full, so it's
+        only buffered again if sending it twice is harmless (no ``inc``,
+        ``add`` or ``_version_``, see ``utils.atomic_updates_idempotent``).
+        """
+        async with self._flushing:
+            await self._flush()
+
+    async def _flush(self):
+        pending = [entry for entry in self._pending if entry.live]
+        self._pending = []
+        self._by_key = {}
+        self._dropped = 0
+
+        if not pending:
+            return
+
+        self.log.debug("Flushing %d buffered writes, %d eliminated so far.",
+                       len(pending), self.eliminated)
+        start = end = 0
+
+        try:
+            while start < len(pending):
+                end = start + 1
+                while end < len(pending) and (pending[end].doc is None) == (pending[start].doc is None):
+                    end += 1
+
+                await self._send(pending[start:end])
+                start = end
+        except BaseException as err:
+            if not self._resendable(pending[start:end], err):
+                self.log.error("Dropping %d buffered writes that may have been applied already and "
+                               "can't safely be sent again.", end - start)
+                start = end
+            self._restore(pending[start:])
+            raise
+
+    def _resendable(self, run, error):
+        if getattr(error, 'idempotent', False):
+            return True
+
+        docs = [
+            entry.doc if entry.doc is not None else
+            utils.build_atomic_update(entry.to_update(self.unique_key), unique_key=self.unique_key)
+            for entry in run
+        ]
+        return utils.atomic_updates_idempotent(docs)
+
+    def _restore(self, entries):
+        self.log.debug("Buffering %d writes that failed to send again.", len(entries))
+        newer = [entry for entry in self._pending if entry.live]
+        self._pending = []
+        self._by_key = {}
+        self._dropped = 0
+
+        for entry in entries + newer:
+            self._append(entry)
+
+    async def _send(self, run):
+        if run[0].doc is not None:
+            await self.solr.add([entry.doc for entry in run], **self.add_kwargs)
+        else:
+            kwargs = dict(
+                (name, value) for name, value in self.add_kwargs.items()
+                if name in ('commit', 'softCommit', 'commitWithin', 'waitFlush', 'waitSearcher'))
+            await self.solr.update_fields(
+                [entry.to_update(self.unique_key) for entry in run],
+                unique_key=self.unique_key, **kwargs)
+
+        self.sent += len(run)
@@ -0,0 +1,328 @@
+# coding: utf-8
+import os
+import mmap
+import time
+import struct
+from collections import Counter, OrderedDict
+from .utils import digest, force_unicode
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+MAGIC = b'AIOSOLRC'
+# magic, number of slots, slot size
+FILE_HEADER = struct.Struct('<8sII')
+# Bumped by ``invalidate()``; follows the file header.
+GENERATION = struct.Struct('<Q')
+SLOTS_OFFSET = FILE_HEADER.size + GENERATION.size
+# sequence number, key digest, expiry timestamp, data length, generation
+SLOT_HEADER = struct.Struct('<Q16sdIQ')
+
+
+def key_digest(key):
+    """
+    Hashes a cache key (``str`` or ``bytes``) to the 16 byte digest the cache
+    stores.
+    """
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return digest(key)
+
+
+class SharedResultsCache(object):
+
+    """
+    Fixed-size cache in a memory-mapped file, shared by every process that
+    opens the same ``path``.
+
+    The file holds ``slots`` slots of ``slot_size`` bytes; each key maps to
+    exactly one slot and newer entries simply overwrite older ones. Values
+    that don't fit in a slot aren't cached. Reads take no lock: every slot
+    carries a sequence number that writers make odd while they're writing
+    and bump again when done, so a reader that raced a writer notices and
+    treats it as a miss. Writers lock their slot with ``fcntl`` where it's
+    available.
+
+    Values are bytes; ``Solr`` stores responses packed with ``utils.pack``.
+
+    ``invalidate()`` bumps a generation shared through the file, and entries
+    cached under an older generation are misses from then on. ``Solr``
+    invalidates after every update it sends, commits included, so writes
+    made through a client that uses the cache are never masked by results
+    cached before them. Writes the cache doesn't hear about (other clients,
+    ``autoCommit``, ``commitWithin``) can still leave results up to ``ttl``
+    seconds stale.
+
+    Example::
+
+        cache = SharedResultsCache('/dev/shm/solr-results', ttl=30)
+        solr = Solr('http://localhost:8983/solr/core0', results_cache=cache)
+
+    """
+
+    def __init__(self, path, slots=4096, slot_size=64 * 1024, ttl=60):
+        if slot_size <= SLOT_HEADER.size:
+            raise ValueError('slot_size must be larger than %d bytes.' % SLOT_HEADER.size)
+
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        size = SLOTS_OFFSET + slots * slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        try:
+            self._lock(0, FILE_HEADER.size)
+            try:
+                if os.fstat(self._fd).st_size == 0:
+                    os.ftruncate(self._fd, size)
+                    os.pwrite(self._fd, FILE_HEADER.pack(MAGIC, slots, slot_size), 0)
+                else:
+                    header = os.pread(self._fd, FILE_HEADER.size, 0)
+                    if header != FILE_HEADER.pack(MAGIC, slots, slot_size):
+                        raise ValueError("'%s' is not a results cache with %d slots of %d bytes." % (path, slots, slot_size))
+            finally:
+                self._unlock(0, FILE_HEADER.size)
+
+            self._map = mmap.mmap(self._fd, size)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def _lock(self, offset, length):
+        if fcntl is not None:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, offset)
+
+    def _unlock(self, offset, length):
+        if fcntl is not None:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, length, offset)
+
+    def _slot(self, digest):
+        index = int.from_bytes(digest[:8], 'little') % self.slots
+        return SLOTS_OFFSET + index * self.slot_size
+
+    @property
+    def generation(self):
+        """
+        The current generation. Pass it to ``set()`` to have results fetched
+        before an ``invalidate()`` turned away.
+        """
+        return GENERATION.unpack_from(self._map, FILE_HEADER.size)[0]
+
+    def invalidate(self):
+        """
+        Makes everything cached so far a miss, in every process sharing the
+        file.
+        """
+        self._lock(FILE_HEADER.size, GENERATION.size)
+        try:
+            GENERATION.pack_into(self._map, FILE_HEADER.size, self.generation + 1)
+        finally:
+            self._unlock(FILE_HEADER.size, GENERATION.size)
+
+    def get(self, key):
+        """
+        Returns the bytes cached under ``key``, or ``None``.
+        """
+        digest = key_digest(key)
+        offset = self._slot(digest)
+        sequence, stored_digest, expires, length, generation = SLOT_HEADER.unpack_from(self._map, offset)
+
+        if (sequence % 2 or stored_digest != digest or expires < time.time()
+                or generation != self.generation
+                or length > self.slot_size - SLOT_HEADER.size):
+            self.misses += 1
+            return None
+
+        start = offset + SLOT_HEADER.size
+        data = self._map[start:start + length]
+
+        # A writer got in while we were reading.
+        if struct.unpack_from('<Q', self._map, offset)[0] != sequence:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return data
+
+    def set(self, key, data, ttl=None, generation=None):
+        """
+        Caches ``data`` under ``key`` for ``ttl`` seconds (``self.ttl`` by
+        default). Returns ``False`` if it's too big for a slot.
+
+        Optionally accepts ``generation``, read from ``self.generation``
+        before fetching ``data``. Default is the current generation. Returns
+        ``False`` as well if the cache was invalidated since.
+        """
+        if len(data) > self.slot_size - SLOT_HEADER.size:
+            return False
+
+        if ttl is None:
+            ttl = self.ttl
+
+        if generation is None:
+            generation = self.generation
+        elif generation != self.generation:
+            return False
+
+        digest = key_digest(key)
+        offset = self._slot(digest)
+        self._lock(offset, self.slot_size)
+
+        try:
+            sequence = struct.unpack_from('<Q', self._map, offset)[0]
+            # Round up to odd: "being written".
+            sequence += 1 if sequence % 2 == 0 else 2
+            struct.pack_into('<Q', self._map, offset, sequence)
+            start = offset + SLOT_HEADER.size
+            self._map[start:start + len(data)] = data
+            SLOT_HEADER.pack_into(self._map, offset, sequence + 1, digest, time.time() + ttl, len(data), generation)
+        finally:
+            self._unlock(offset, self.slot_size)
+
+        return True
+
+    def delete(self, key):
+        """
+        Drops ``key`` from the cache if it's there.
+        """
+        digest = key_digest(key)
+        offset = self._slot(digest)
+        self._lock(offset, self.slot_size)
+
+        try:
+            sequence, stored_digest = SLOT_HEADER.unpack_from(self._map, offset)[:2]
+            if stored_digest == digest:
+                SLOT_HEADER.pack_into(self._map, offset, sequence + 2 - sequence % 2, b'\0' * 16, 0, 0, 0)
+        finally:
+            self._unlock(offset, self.slot_size)
+
+    def clear(self):
+        """
+        Empties every slot.
+        """
+        for index in range(self.slots):
+            offset = SLOTS_OFFSET + index * self.slot_size
+            self._lock(offset, self.slot_size)
+            try:
+                sequence = struct.unpack_from('<Q', self._map, offset)[0]
+                SLOT_HEADER.pack_into(self._map, offset, sequence + 2 - sequence % 2, b'\0' * 16, 0, 0, 0)
+            finally:
+                self._unlock(offset, self.slot_size)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class DocumentCache(object):
+
+    """
+    In-process LRU cache of documents keyed by id, used by ``Solr.get()``.
+
+    Documents fetched with different ``fl`` are cached separately, and
+    ``invalidate()`` drops all of them. ``maxsize`` counts ids.
+
+    A fetch that started before an id was invalidated may come back with
+    the old document. Fetches call ``begin_fetch()`` first and pass the
+    generation it returns to ``set()``, which then refuses documents
+    invalidated in the meantime; ``end_fetch()`` lets go of the bookkeeping.
+
+    Example::
+
+        solr = Solr('http://localhost:8983/solr/core0', doc_cache=DocumentCache(50000))
+
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._docs = OrderedDict()
+        # Bumped by every invalidation.
+        self._generation = 0
+        self._cleared = 0
+        # Generation each id was last invalidated at, kept only as long as
+        # a fetch that started before it is in flight.
+        self._invalidated = {}
+        # Fetches in flight, by the generation they started at.
+        self._fetches = Counter()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def get(self, id, fl=None):
+        by_fl = self._docs.get(id)
+
+        if by_fl is None or fl not in by_fl:
+            self.misses += 1
+            return None
+
+        self._docs.move_to_end(id)
+        self.hits += 1
+        return by_fl[fl]
+
+    def set(self, id, fl, doc, generation=None):
+        """
+        Caches ``doc`` as fetched with ``fl``. With ``generation`` (from
+        ``begin_fetch()``), returns ``False`` without caching it if ``id``
+        was invalidated since.
+        """
+        if generation is not None and (
+                self._cleared > generation or self._invalidated.get(id, 0) > generation):
+            return False
+
+        by_fl = self._docs.get(id)
+
+        if by_fl is None:
+            self._docs[id] = by_fl = {}
+            if len(self._docs) > self.maxsize:
+                self._docs.popitem(last=False)
+        else:
+            self._docs.move_to_end(id)
+
+        by_fl[fl] = doc
+        return True
+
+    def begin_fetch(self):
+        """
+        Registers a fetch about to go out. Returns its generation.
+        """
+        self._fetches[self._generation] += 1
+        return self._generation
+
+    def end_fetch(self, generation):
+        self._fetches[generation] -= 1
+
+        if self._fetches[generation] > 0:
+            return
+
+        del self._fetches[generation]
+
+        if not self._fetches:
+            self._invalidated.clear()
+        elif generation < min(self._fetches):
+            # Invalidations no fetch in flight predates are moot.
+            oldest = min(self._fetches)
+            self._invalidated = dict(
+                (id, invalidated) for id, invalidated in self._invalidated.items()
+                if invalidated > oldest)
+
+    def invalidate(self, id):
+        id = force_unicode(id)
+        self._docs.pop(id, None)
+        self._generation += 1
+
+        if self._fetches:
+            self._invalidated[id] = self._generation
+
+    def clear(self):
+        self._docs.clear()
+        self._generation += 1
+        self._cleared = self._generation
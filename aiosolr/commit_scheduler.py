@@ -0,0 +1,225 @@
+# coding: utf-8
+import asyncio
+from .exceptions import SolrError
+
+
+class CommitScheduler(object):
+
+    """
+    Coalesces the commits of any number of concurrent writers.
+
+    Writes made through the scheduler never commit on their own. They mark
+    the index dirty instead, and the scheduler issues at most one commit
+    (soft by default) per ``interval`` seconds covering everything written
+    so far. Callers that need read-after-write consistency can await
+    ``wait_visible()``.
+
+    With ``commitWithin=True`` the scheduler doesn't commit at all for adds
+    and atomic updates: they're sent with a ``commitWithin`` of ``interval``
+    and Solr takes care of it. Deletes still go through scheduled commits,
+    since ``<delete>`` has no ``commitWithin``.
+
+    Example::
+
+        scheduler = CommitScheduler(solr, interval=1.0)
+
+        yield from scheduler.add(docs)
+        yield from scheduler.delete(id='doc_1')
+
+        # Only needed if the caller must see its own writes.
+        yield from scheduler.wait_visible()
+
+        yield from scheduler.close()
+
+    """
+
+    def __init__(self, solr, interval=1.0, softCommit=True, commitWithin=False):
+        self.solr = solr
+        self.loop = solr.loop
+        self.log = solr.log
+        self.interval = interval
+        self.softCommit = softCommit
+        self.commitWithin = commitWithin
+
+        # Stats, mostly to see how much was saved.
+        self.writes = 0
+        self.commits = 0
+
+        # Every write bumps ``_dirty``; ``_committed`` is the last write
+        # known to be covered by a commit.
+        self._dirty = 0
+        self._committed = 0
+        self._waiters = []
+        self._task = None
+        # Whether ``_task`` is past its delay and committing.
+        self._committing = False
+        self._last_commit = None
+        self._visible_at = None
+        self._closed = False
+
+    def mark_dirty(self):
+        """
+        Records a write that needs committing and makes sure a commit is
+        scheduled. Returns the write's generation.
+        """
+        self.writes += 1
+        self._dirty += 1
+        self._schedule()
+        return self._dirty
+
+    def mark_commit_within(self):
+        """
+        Records a write that was sent with ``commitWithin``, which Solr will
+        make visible on its own within ``interval`` seconds.
+        """
+        self.writes += 1
+        self._visible_at = self.loop.time() + self.interval
+
+    def _schedule(self):
+        if self._task is not None or self._closed:
+            return
+
+        delay = 0
+        if self._last_commit is not None:
+            delay = max(0, self._last_commit + self.interval - self.loop.time())
+
+        self._task = self.loop.create_task(self._commit_later(delay))
+
+    async def _commit_later(self, delay):
+        try:
+            await asyncio.sleep(delay)
+            # ``flush()`` may have beaten us to it.
+            if self._dirty > self._committed:
+                self._committing = True
+                await self._commit()
+        finally:
+            self._committing = False
+            self._task = None
+
+        if self._dirty > self._committed:
+            self._schedule()
+
+    async def _commit(self):
+        target = self._dirty
+        self._last_commit = self.loop.time()
+
+        try:
+            await self.solr.commit(softCommit=self.softCommit)
+        except SolrError as err:
+            # Waiters get the error; the writes stay dirty and the next
+            # interval will try again.
+            self.log.error("Scheduled commit failed: %s", err)
+            self._release(target, err)
+            return
+
+        self.commits += 1
+        self._committed = max(self._committed, target)
+        self._release(target)
+
+    def _release(self, target, error=None):
+        pending = []
+
+        for generation, future in self._waiters:
+            if generation > target:
+                pending.append((generation, future))
+            elif not future.done():
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+        self._waiters = pending
+
+    async def wait_visible(self):
+        """
+        Waits until every write made through the scheduler so far is
+        visible to searches. Once the scheduler is closed nothing gets
+        scheduled any more, so this commits right away instead.
+        """
+        generation = self._dirty
+
+        if generation > self._committed:
+            future = self.loop.create_future()
+            self._waiters.append((generation, future))
+
+            if self._closed:
+                await self._commit()
+            else:
+                self._schedule()
+
+            await future
+
+        if self._visible_at is not None:
+            delay = self._visible_at - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def flush(self):
+        """
+        Commits right away if anything is pending, ignoring the interval.
+        """
+        if self._dirty > self._committed:
+            await self._commit()
+
+    async def close(self):
+        """
+        Commits anything pending and stops scheduling new commits. A
+        scheduled commit already under way is waited for rather than
+        cancelled, so its waiters learn how it went.
+        """
+        self._closed = True
+        task = self._task
+
+        if task is not None:
+            if not self._committing:
+                task.cancel()
+            await asyncio.wait([task])
+
+        await self.flush()
+
+    def _commit_within_ms(self):
+        return int(self.interval * 1000)
+
+    async def add(self, docs, **kwargs):
+        """
+        Same as ``Solr.add()``, with the commit left to the scheduler.
+        """
+        if self.commitWithin:
+            response = await self.solr.add(
+                docs, commit=False, commitWithin=self._commit_within_ms(), **kwargs)
+            self.mark_commit_within()
+        else:
+            response = await self.solr.add(docs, commit=False, **kwargs)
+            self.mark_dirty()
+        return response
+
+    async def update_fields(self, ops, **kwargs):
+        """
+        Same as ``Solr.update_fields()``, with the commit left to the
+        scheduler.
+        """
+        if self.commitWithin:
+            response = await self.solr.update_fields(
+                ops, commit=None, softCommit=None, commitWithin=self._commit_within_ms(), **kwargs)
+            self.mark_commit_within()
+        else:
+            response = await self.solr.update_fields(ops, commit=False, **kwargs)
+            self.mark_dirty()
+        return response
+
+    async def delete(self, **kwargs):
+        """
+        Same as ``Solr.delete()``, with the commit left to the scheduler.
+        """
+        response = await self.solr.delete(commit=False, **kwargs)
+        self.mark_dirty()
+        return response
+
+    async def delete_many(self, **kwargs):
+        """
+        Same as ``Solr.delete_many()``, with the commit left to the
+        scheduler.
+        """
+        response = await self.solr.delete_many(commit=False, **kwargs)
+        self.mark_dirty()
+        return response
@@ -1,6 +1,8 @@
 # coding: utf-8
 import re
+import json
 import asyncio
+import inspect
 from xml.etree import ElementTree
 from .log import LOG
 from .utils import force_unicode, unescape_html
@@ -108,3 +110,56 @@ async def extract_error(resp):
         reason, full_html = scrape_response(resp.headers, response_text)
         full_response = unescape_html(full_html)
     return reason, full_response
+
+
+async def read_error_body(resp, max_bytes=64 * 1024):
+    """
+    Reads at most ``max_bytes`` of an error response's body, rather than
+    pulling in a multi-megabyte error page. A body read to the end is
+    released so its connection can be reused; otherwise the connection is
+    closed, and whatever is left goes away with it.
+    """
+    chunks = []
+    remaining = max_bytes
+    eof = False
+
+    try:
+        while remaining > 0:
+            chunk = await resp.content.read(remaining)
+            if not chunk:
+                eof = True
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        else:
+            eof = resp.content.at_eof()
+    finally:
+        if not eof:
+            resp.close()
+
+    if eof:
+        released = resp.release()
+        if inspect.isawaitable(released):
+            await released
+
+    return b''.join(chunks)
+
+
+def parse_error_body(headers, body):
+    """
+    Like ``extract_error`` but for a body that has already been read.
+    """
+    text = force_unicode(body)
+    reason = full_response = None
+
+    try:
+        reason = json.loads(text)['error']['msg']
+    except (KeyError, TypeError):
+        # if json response has unexpected structure
+        full_response = text
+    except ValueError:
+        # otherwise we assume it's html
+        reason, full_html = scrape_response(headers, text)
+        full_response = unescape_html(full_html)
+
+    return reason, full_response
@@ -1,2 +1,165 @@
+import re
+import time
+from email.utils import parsedate_to_datetime
+from .error_extractor import make_error_msg, parse_error_body
+
+
+# Solr turned the request away without processing it.
+REJECTED_STATUSES = (429, 503)
+# The request may or may not have been processed.
+TRANSIENT_STATUSES = (408, 502, 504)
+ERROR_CODE_REGEX = re.compile(br'"code"\s*:\s*(\d+)|<int name="code">(\d+)</int>')
+
+
 class SolrError(Exception):
-    pass
+
+    """
+    Base class of every error raised by aiosolr.
+
+    Errors built from a Solr response keep its ``status``, ``headers`` and
+    (at most ``Solr.max_error_body`` bytes of) ``body``. The body is only
+    parsed when ``reason``, ``details`` or ``str()`` are asked for, so a
+    storm of failing requests doesn't spend its CPU scraping error pages
+    nobody reads.
+
+    Errors raised by a request also carry the ``url`` it went to, the
+    seconds ``elapsed`` before it failed and whether the operation was
+    ``idempotent``, so retry layers can decide from ``retryable`` and
+    ``retry_after`` instead of matching messages.
+    """
+
+    # Failed before Solr gave an answer: timeouts, refused connections...
+    transient = False
+
+    def __init__(self, message, status=None, headers=None, body=None, reason=None,
+                 url=None, elapsed=None, idempotent=False):
+        super(SolrError, self).__init__(message)
+        self.message = message
+        self.status = status
+        self.headers = headers or {}
+        self.body = body
+        self.url = url
+        self.elapsed = elapsed
+        self.idempotent = idempotent
+        self._details = (reason, None) if reason is not None else None
+
+    @property
+    def details(self):
+        """
+        ``(reason, full_response)`` as scraped from the response body.
+        """
+        if self._details is None:
+            if self.body is None:
+                self._details = (None, None)
+            else:
+                self._details = parse_error_body(self.headers, self.body)
+        return self._details
+
+    @property
+    def reason(self):
+        return self.details[0]
+
+    @property
+    def solr_code(self):
+        """
+        The error code in Solr's response body, or ``None``. Found without
+        parsing the whole body.
+        """
+        if not self.body:
+            return None
+
+        match = ERROR_CODE_REGEX.search(self.body)
+        if match is None:
+            return None
+        return int(match.group(1) or match.group(2))
+
+    @property
+    def retry_after(self):
+        """
+        Seconds to wait before retrying, from the ``Retry-After`` header,
+        or ``None``.
+        """
+        value = self.headers.get('Retry-After')
+
+        if value is None:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError, IndexError):
+            return None
+
+    @property
+    def retryable(self):
+        """
+        Whether sending the same request again may succeed and is safe.
+        """
+        if self.status in REJECTED_STATUSES:
+            return True
+        return self.idempotent and (self.transient or self.status in TRANSIENT_STATUSES)
+
+    def __str__(self):
+        if self.body is None and self._details is None:
+            return self.message
+        return '%s: %s' % (self.message, make_error_msg(*self.details))
+
+
+class SolrTimeoutError(SolrError):
+
+    """
+    The request timed out, on our side or Solr's (HTTP 408 and 504).
+    """
+
+    transient = True
+
+
+class SolrConnectionError(SolrError):
+
+    """
+    Couldn't connect to Solr.
+    """
+
+    transient = True
+
+
+class SolrOverloadedError(SolrError):
+
+    """
+    Solr is overloaded or unavailable (HTTP 429 and 503).
+    """
+
+
+class SolrBadRequestError(SolrError):
+
+    """
+    Solr rejected the request (HTTP 400): bad syntax, unknown field, ...
+    """
+
+
+class SolrNotFoundError(SolrError):
+
+    """
+    No such core, collection or handler (HTTP 404).
+    """
+
+
+STATUS_ERRORS = {
+    400: SolrBadRequestError,
+    404: SolrNotFoundError,
+    408: SolrTimeoutError,
+    429: SolrOverloadedError,
+    503: SolrOverloadedError,
+    504: SolrTimeoutError,
+}
+
+
+def error_for_status(status):
+    """
+    Returns the exception class for an HTTP error status.
+    """
+    return STATUS_ERRORS.get(int(status), SolrError)
@@ -0,0 +1,345 @@
+# coding: utf-8
+import os
+import json
+import asyncio
+from collections import deque
+from .exceptions import SolrError
+from . import utils
+
+
+def estimate_doc_size(doc):
+    """
+    Roughly estimates how many bytes a document takes up, counting the
+    length of its keys and string values. Cheap enough to run on every
+    document put on the queue.
+    """
+    size = 0
+
+    for key, value in doc.items():
+        size += len(key)
+
+        if not isinstance(value, (list, tuple)):
+            value = (value, )
+
+        for bit in value:
+            if isinstance(bit, (str, bytes)):
+                size += len(bit)
+            else:
+                size += 16
+
+    return size
+
+
+class IndexingQueue(object):
+
+    """
+    Write-behind queue in front of ``Solr.add()``.
+
+    Producers ``put()`` documents and move on; a background task drains
+    them in batches of ``batch_size`` documents, sending partial batches
+    after ``flush_interval`` seconds. Documents waiting to be sent are
+    limited to roughly ``max_bytes`` (see ``estimate_doc_size``); once the
+    budget is used up ``put()`` waits for room and ``put_nowait()`` raises
+    ``asyncio.QueueFull``.
+
+    If Solr fails with a retryable error (see ``SolrError.retryable``)
+    while ``spill_path`` is set, batches are appended to that file (one JSON document per line) instead of being held in memory.
+    Every ``retry_interval`` seconds the file is replayed, reading one batch
+    at a time and picking up after the last batch that went through, and
+    once that succeeds it's deleted. A file left over from a previous run
+    is replayed on ``start()``. Replays may resend documents, which is
+    harmless for plain adds. Without ``spill_path`` (or if spilling fails)
+    a failed batch is retried until it goes through, so backpressure
+    reaches the producers.
+
+    Batches that fail with an error that isn't retryable (a bad request,
+    a value that can't be serialized...) can't go through however often
+    they're retried; they're logged, counted in ``failed`` and dropped,
+    whether they're sent from memory or replayed from the spill file.
+
+    Any extra keyword arguments are passed on to ``Solr.add()``.
+
+    Example::
+
+        queue = IndexingQueue(solr, spill_path='/var/spool/solr.jsonl')
+        yield from queue.start()
+
+        for doc in docs:
+            yield from queue.put(doc)
+
+        yield from queue.close()
+
+    """
+
+    def __init__(self, solr, batch_size=500, max_bytes=64 * 1024 * 1024, flush_interval=1.0,
+                 spill_path=None, retry_interval=5.0, **add_kwargs):
+        self.solr = solr
+        self.loop = solr.loop
+        self.log = solr.log
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.retry_interval = retry_interval
+        self.add_kwargs = add_kwargs
+
+        # Stats.
+        self.sent = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.failed = 0
+
+        self._docs = deque()
+        self._bytes = 0
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._empty = asyncio.Event()
+        self._empty.set()
+        self._task = None
+        self._closing = False
+        self._has_spill = False
+        self._retry_at = 0
+        # Where in the spill file the next replay starts.
+        self._replay_offset = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    @property
+    def pending_bytes(self):
+        return self._bytes
+
+    async def start(self):
+        """
+        Starts the background task that drains the queue.
+        """
+        if self.spill_path is not None and os.path.exists(self.spill_path):
+            self.log.info("Found spilled documents in '%s', replaying them first.", self.spill_path)
+            self._has_spill = True
+
+        self._task = self.loop.create_task(self._drain())
+
+    def _is_full(self, size):
+        # A single document bigger than the budget is let through on an
+        # empty queue rather than blocking forever.
+        return self._docs and self._bytes + size > self.max_bytes
+
+    def _append(self, doc, size):
+        self._docs.append((doc, size))
+        self._bytes += size
+        self._empty.clear()
+
+        if len(self._docs) >= self.batch_size:
+            self._ready.set()
+
+    async def put(self, doc):
+        """
+        Queues a document, waiting for room if the memory budget is used up.
+        """
+        if self._closing:
+            raise RuntimeError('The indexing queue is closed.')
+
+        size = estimate_doc_size(doc)
+
+        while self._is_full(size):
+            self._space.clear()
+            await self._space.wait()
+
+        self._append(doc, size)
+
+    def put_nowait(self, doc):
+        """
+        Queues a document, raising ``asyncio.QueueFull`` if there's no room.
+        """
+        if self._closing:
+            raise RuntimeError('The indexing queue is closed.')
+
+        size = estimate_doc_size(doc)
+
+        if self._is_full(size):
+            raise asyncio.QueueFull()
+
+        self._append(doc, size)
+
+    async def flush(self):
+        """
+        Waits until everything queued so far has been sent (or spilled).
+        """
+        self._ready.set()
+        await self._empty.wait()
+
+    async def close(self):
+        """
+        Sends whatever is left and stops the background task. A queue that
+        was never started is started to send what was put on it.
+        """
+        if self._task is None and self._docs:
+            await self.start()
+
+        self._closing = True
+        self._ready.set()
+
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _drain(self):
+        while True:
+            if len(self._docs) < self.batch_size and not self._closing:
+                try:
+                    await asyncio.wait_for(self._ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._ready.clear()
+
+            if self._has_spill and not self._docs:
+                await self._try_replay()
+
+            if not self._docs:
+                self._empty.set()
+                if self._closing:
+                    return
+                continue
+
+            batch = [self._docs.popleft() for _ in range(min(self.batch_size, len(self._docs)))]
+
+            try:
+                await self._send([doc for doc, size in batch])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Dying here would leave flush() and put() waiting forever.
+                self.log.exception("Failed to index %d documents, dropping them.", len(batch))
+                self.failed += len(batch)
+            finally:
+                self._bytes -= sum(size for doc, size in batch)
+                self._space.set()
+
+            if not self._docs:
+                self._empty.set()
+
+    async def _send(self, docs):
+        if self._has_spill:
+            await self._try_replay()
+
+            # Still down: keep the order by appending behind the rest.
+            if self._has_spill and await self._spill(docs):
+                return
+
+        while True:
+            try:
+                await self.solr.add(docs, **self.add_kwargs)
+            except SolrError as err:
+                if not err.retryable:
+                    self.log.error("Solr rejected %d documents, dropping them: %s", len(docs), err)
+                    self.failed += len(docs)
+                    return
+
+                if self.spill_path is not None:
+                    self.log.error("Failed to index %d documents, spilling them to '%s': %s",
+                                   len(docs), self.spill_path, err)
+                    self._retry_at = self.loop.time() + self.retry_interval
+                    if await self._spill(docs):
+                        return
+
+                self.log.error("Failed to index %d documents, retrying in %s seconds: %s",
+                               len(docs), self.retry_interval, err)
+                await asyncio.sleep(self.retry_interval)
+                continue
+
+            self.sent += len(docs)
+            return
+
+    async def _spill(self, docs):
+        """
+        Appends ``docs`` to the spill file. Returns ``False`` if that failed
+        and they have to stay in memory.
+        """
+        try:
+            await self.loop.run_in_executor(None, self._write_spill, docs)
+        except Exception:
+            self.log.exception("Failed to spill %d documents to '%s', keeping them in memory.",
+                               len(docs), self.spill_path)
+            return False
+
+        self._has_spill = True
+        self.spilled += len(docs)
+        return True
+
+    def _write_spill(self, docs):
+        with open(self.spill_path, 'a', encoding='utf-8') as spill_file:
+            spill_file.write(''.join(utils.json_dumps(doc) + '\n' for doc in docs))
+
+    def _open_spill(self):
+        spill_file = open(self.spill_path, 'r', encoding='utf-8')
+        spill_file.seek(self._replay_offset)
+        return spill_file
+
+    def _read_spill_batch(self, spill_file):
+        docs = []
+
+        while len(docs) < self.batch_size:
+            line = spill_file.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+
+            try:
+                docs.append(json.loads(line))
+            except ValueError:
+                # A write cut short by a full disk, for example.
+                self.log.error("Skipping unreadable line in '%s': %r", self.spill_path, line[:100])
+                self.failed += 1
+
+        return docs, spill_file.tell()
+
+    async def _try_replay(self):
+        if self.loop.time() < self._retry_at:
+            return
+
+        # The file is read a batch at a time, however long the outage was.
+        try:
+            spill_file = await self.loop.run_in_executor(None, self._open_spill)
+        except OSError as err:
+            self.log.error("Failed to open '%s', retrying in %s seconds: %s",
+                           self.spill_path, self.retry_interval, err)
+            self._retry_at = self.loop.time() + self.retry_interval
+            return
+
+        replayed = 0
+
+        try:
+            while True:
+                docs, offset = await self.loop.run_in_executor(None, self._read_spill_batch, spill_file)
+                if not docs:
+                    break
+
+                try:
+                    await self.solr.add(docs, **self.add_kwargs)
+                except SolrError as err:
+                    if err.retryable:
+                        raise
+                    # Retrying it would hold up everything spilled behind it.
+                    self.log.error("Solr rejected %d spilled documents, dropping them: %s",
+                                   len(docs), err)
+                    self.failed += len(docs)
+                else:
+                    replayed += len(docs)
+                    self.replayed += len(docs)
+                    self.sent += len(docs)
+
+                # Picked up from here if a later batch fails.
+                self._replay_offset = offset
+        except (SolrError, OSError) as err:
+            self.log.error("Failed to replay spilled documents, retrying in %s seconds: %s",
+                           self.retry_interval, err)
+            self._retry_at = self.loop.time() + self.retry_interval
+            return
+        finally:
+            spill_file.close()
+
+        os.remove(self.spill_path)
+        self._has_spill = False
+        self._replay_offset = 0
+        self.log.info("Replayed %d spilled documents.", replayed)
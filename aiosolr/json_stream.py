@@ -0,0 +1,355 @@
+# coding: utf-8
+"""
+Incremental parsing of Solr's JSON search responses, so documents can be
+handed out while the rest of a large page is still on the wire.
+"""
+import re
+import json
+import codecs
+import asyncio
+from collections import deque
+import aiohttp
+from .exceptions import SolrConnectionError, SolrTimeoutError
+from . import utils
+
+
+PREFIX, DOCS, TAIL = range(3)
+# Whitespace and the commas between documents.
+SEPARATORS_REGEX = re.compile(r'[\s,]*')
+# The rest of a JSON string, up to its closing quote or a backslash the
+# chunk ends on.
+STRING_REGEX = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+# What matters to the scanners outside of strings.
+PREFIX_REGEX = re.compile(r'[\[\]{}":,]')
+DOC_REGEX = re.compile(r'[\[\]{}"]')
+# Where the docs array lives: ``{"response": {"docs": [``.
+DOCS_PATH = [None, 'response']
+CLOSERS = {'{': '}', '[': ']'}
+
+
+class DocsParser(object):
+
+    """
+    Parses a JSON search response fed to it in pieces, returning the
+    documents of ``response.docs`` as soon as each one is complete.
+
+    Documents that are whole in a piece are parsed straight away with
+    ``decoder.raw_decode``, if it has one (decoders with only a ``decode``
+    method get every document scanned as below). The one a piece ends in the middle of is
+    scanned instead, hopping from one bracket or quote to the next, with
+    the scanner's state carried over to the next pieces; they're only
+    joined and decoded once its closing brace has come in. The prefix
+    before the documents is scanned the same way. Each piece is only gone
+    over a bounded number of times, so large documents split in many
+    pieces don't make parsing quadratic.
+
+    ``header`` is the response up to the documents (``responseHeader``,
+    ``numFound``, ...) with ``docs`` empty, available as soon as they
+    start. ``response`` is the whole response with ``docs`` empty, once
+    ``close()`` has been called.
+
+    Responses without a ``response.docs`` (grouped ones, for example) are
+    simply parsed whole on ``close()``.
+    """
+
+    def __init__(self, decoder=None):
+        self.decoder = decoder or json.JSONDecoder()
+        self._raw_decode = getattr(self.decoder, 'raw_decode', None)
+        self.header = None
+        self.response = None
+        self.docs_parsed = 0
+
+        self._state = PREFIX
+        self._prefix = []
+        self._tail = []
+        # Pieces of the document being read.
+        self._doc = []
+
+        # Scanner state.
+        self._in_string = False
+        self._escaped = False
+        self._depth = 0
+        # Prefix only: open containers, the pieces of the string being read
+        # and the last complete one, which is a key if a ``:`` follows.
+        self._stack = []
+        self._string = []
+        self._last_string = None
+        self._key = None
+
+    def feed(self, text):
+        """
+        Adds the next piece of the response. Returns the documents it
+        completed.
+        """
+        if self._state == TAIL:
+            self._tail.append(text)
+            return []
+
+        position = 0
+
+        if self._state == PREFIX:
+            position = self._scan_prefix(text)
+            if position is None:
+                self._prefix.append(text)
+                return []
+
+            self._start_docs(text[:position])
+
+        return self._parse_docs(text, position)
+
+    def _skip_string(self, text, position, collect=False):
+        """
+        Moves past the string being read in ``text``. Returns where the
+        scan resumes.
+        """
+        start = position
+
+        if self._escaped:
+            self._escaped = False
+            position += 1
+
+        if position < len(text):
+            position = STRING_REGEX.match(text, position).end()
+
+        if position >= len(text):
+            if collect:
+                self._string.append(text[start:])
+            return len(text)
+
+        if text[position] == '\\':
+            # The chunk ends on a backslash; what it escapes comes next.
+            self._escaped = True
+            if collect:
+                self._string.append(text[start:])
+            return len(text)
+
+        # The closing quote.
+        self._in_string = False
+        if collect:
+            self._string.append(text[start:position])
+            self._last_string = ''.join(self._string)
+            self._string = []
+        return position + 1
+
+    def _scan_prefix(self, text):
+        """
+        Returns the position right after the ``[`` opening the documents,
+        or ``None`` if they don't start in ``text``.
+        """
+        position = 0
+
+        while position < len(text):
+            if self._in_string:
+                position = self._skip_string(text, position, collect=True)
+                continue
+
+            match = PREFIX_REGEX.search(text, position)
+            if match is None:
+                break
+
+            char = match.group()
+            position = match.end()
+
+            if char == '"':
+                self._in_string = True
+            elif char == ':':
+                self._key = self._last_string
+            elif char == ',':
+                self._key = None
+            elif char in '{[':
+                if (char == '[' and self._key == 'docs'
+                        and [key for _, key in self._stack] == DOCS_PATH):
+                    return position
+                self._stack.append((char, self._key))
+                self._key = None
+            elif self._stack:
+                self._stack.pop()
+
+        return None
+
+    def _start_docs(self, text):
+        self._prefix.append(text)
+        self._prefix = ''.join(self._prefix)
+        self._state = DOCS
+        closers = ''.join(CLOSERS[char] for char, _ in reversed(self._stack))
+        self.header = json.loads(self._prefix + ']' + closers)
+
+    def _scan_doc(self, text, position):
+        """
+        Scans the document being read. Returns the position right after its
+        closing brace, or ``None`` if it doesn't end in ``text``.
+        """
+        while position < len(text):
+            if self._in_string:
+                position = self._skip_string(text, position)
+                continue
+
+            match = DOC_REGEX.search(text, position)
+            if match is None:
+                break
+
+            char = match.group()
+            position = match.end()
+
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return position
+
+        return None
+
+    def _parse_docs(self, text, position):
+        docs = []
+
+        while position < len(text):
+            start = position
+
+            if not self._doc:
+                # Between documents.
+                position = start = SEPARATORS_REGEX.match(text, position).end()
+
+                if position >= len(text):
+                    break
+
+                if text[position] == ']':
+                    self._state = TAIL
+                    self._tail.append(text[position:])
+                    break
+
+                if self._raw_decode is not None:
+                    try:
+                        doc, position = self._raw_decode(text, position)
+                    except ValueError:
+                        # Not all there yet: scanned from here on, once.
+                        pass
+                    else:
+                        docs.append(doc)
+                        continue
+
+            end = self._scan_doc(text, position)
+
+            if end is None:
+                self._doc.append(text[start:])
+                break
+
+            self._doc.append(text[start:end])
+            docs.append(self.decoder.decode(''.join(self._doc)))
+            self._doc = []
+            position = end
+
+        self.docs_parsed += len(docs)
+        return docs
+
+    def close(self):
+        """
+        Finishes parsing. Raises ``ValueError`` if the response was cut short
+        or isn't valid JSON.
+        """
+        if self._state == PREFIX:
+            self.response = json.loads(''.join(self._prefix))
+            self.header = self.response
+        elif self._state == DOCS:
+            raise ValueError('The response ended in the middle of its documents.')
+        else:
+            self.response = json.loads(self._prefix + ''.join(self._tail))
+
+        self._prefix = []
+        self._tail = []
+        return self.response
+
+
+class ResultsStream(object):
+
+    """
+    Async iterator over the documents of a search response, as returned by
+    ``Solr.search_iter()``. Documents come out as they are read off the
+    connection, ``chunk_size`` bytes at a time.
+
+    ``header``, ``hits`` and ``qtime`` are available right away; the rest
+    of the response (facets, highlighting, ...) is in ``response`` once
+    every document has been read. Documents of grouped responses aren't
+    streamed; use ``response`` for those.
+
+    Optionally accepts ``timeout``, the seconds to wait for each chunk
+    before giving up with a ``SolrTimeoutError``. Default is ``None``
+    (wait forever). A connection that fails halfway through raises a
+    ``SolrConnectionError``.
+    """
+
+    def __init__(self, resp, decoder=None, chunk_size=64 * 1024, convert=False, timeout=None):
+        self.resp = resp
+        self.chunk_size = chunk_size
+        self.convert = convert
+        self.timeout = timeout
+        self.parser = DocsParser(decoder)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._docs = deque()
+        self._done = False
+
+    async def _read(self):
+        try:
+            chunk = await asyncio.wait_for(self.resp.content.read(self.chunk_size), self.timeout)
+        except asyncio.TimeoutError:
+            self.close()
+            raise SolrTimeoutError(
+                "Timed out reading the response after %s seconds" % self.timeout, idempotent=True)
+        except aiohttp.ClientError as err:
+            self.close()
+            raise SolrConnectionError("Failed to read the response: %s" % err, idempotent=True)
+
+        if chunk:
+            docs = self.parser.feed(self._text_decoder.decode(chunk))
+        else:
+            docs = self.parser.feed(self._text_decoder.decode(b'', True))
+            self._done = True
+            self.close()
+            self.parser.close()
+
+        if self.convert:
+            docs = [utils.convert_doc(doc) for doc in docs]
+
+        self._docs.extend(docs)
+
+    async def start(self):
+        """
+        Reads up to the first document, so the header is available.
+        """
+        while self.parser.header is None and not self._done:
+            await self._read()
+
+    @property
+    def header(self):
+        return self.parser.header
+
+    @property
+    def response(self):
+        return self.parser.response
+
+    @property
+    def hits(self):
+        return ((self.header or {}).get('response') or {}).get('numFound', 0)
+
+    @property
+    def qtime(self):
+        return ((self.header or {}).get('responseHeader') or {}).get('QTime')
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._docs:
+            if self._done:
+                raise StopAsyncIteration()
+            await self._read()
+
+        return self._docs.popleft()
+
+    def close(self):
+        """
+        Closes the connection, e.g. when stopping before the last document.
+        """
+        self.resp.close()
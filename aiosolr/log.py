@@ -8,8 +8,36 @@ class NullHandler(logging.Handler):
         pass
 
 
+class BodyPreview(object):
+
+    """
+    The first ``length`` characters of a request body, for log messages.
+    Nothing is sliced or ``repr``'d unless a handler actually formats the
+    record.
+    """
+
+    __slots__ = ('body', 'length')
+
+    def __init__(self, body, length=10):
+        self.body = body
+        self.length = length
+
+    def __str__(self):
+        body = self.body
+
+        if body is None:
+            return ''
+        if isinstance(body, str):
+            return body[:self.length]
+        if isinstance(body, (bytes, bytearray)):
+            return repr(bytes(body[:self.length]))
+        return repr(body)[:self.length]
+
+
 LOG = logging.getLogger(__package__)
 LOG.addHandler(NullHandler())
+# Sampled requests slower than ``Solr.slow_threshold``.
+SLOW_LOG = logging.getLogger('%s.slow' % __package__)
 if os.environ.get('DEBUG_PYSOLR', '').lower() in ('true', '1'):
     LOG.setLevel(logging.DEBUG)
     LOG.addHandler(logging.StreamHandler())
@@ -0,0 +1,327 @@
+# coding: utf-8
+"""
+Small DSL for building Lucene/Solr queries with correct escaping.
+
+Example::
+
+    from aiosolr.query import And, Not, Phrase, Query, Range, Term, Template
+
+    q = And(Phrase('title', 'banana split'), Not(Term('status', 'deleted')))
+    query = Query(q, fq=[Range('price', 0, 10)], rows=20)
+    results = yield from solr.search(query)
+
+    # Hot query shapes can be compiled once and bound many times:
+    by_title = Template('title:{title:phrase} AND type:{type}', fq=['lang:{lang}'], rows=10)
+    results = yield from solr.search(by_title.bind(title='a "b"', type='book', lang='en'))
+
+"""
+import re
+from . import utils
+
+
+# Lucene query syntax special characters, plus whitespace.
+SPECIAL_CHARS = '\\+-&|!(){}[]^"~*?:/ \t\n'
+ESCAPE_TABLE = dict((ord(char), '\\' + char) for char in SPECIAL_CHARS)
+PHRASE_ESCAPE_TABLE = {ord('\\'): '\\\\', ord('"'): '\\"'}
+PLACEHOLDER_REGEX = re.compile(r'\{([A-Za-z_]\w*)(?::(term|phrase|raw))?\}')
+
+
+def _value(value):
+    if isinstance(value, bool) or hasattr(value, 'strftime'):
+        return utils.normalize_param_value(value)
+    return utils.force_unicode(value)
+
+
+def escape(value):
+    """
+    Escapes a value for use as a single term.
+    """
+    return _value(value).translate(ESCAPE_TABLE)
+
+
+def phrase(value):
+    """
+    Quotes a value as a phrase.
+    """
+    return '"%s"' % _value(value).translate(PHRASE_ESCAPE_TABLE)
+
+
+ESCAPERS = {
+    'term': escape,
+    'phrase': phrase,
+    'raw': _value,
+}
+
+
+class Clause(object):
+
+    """
+    Base class of query clauses. ``str()`` gives the query string.
+    """
+
+    def __str__(self):
+        return self.to_string()
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.to_string())
+
+    def to_string(self):
+        raise NotImplementedError()
+
+
+class Raw(Clause):
+
+    """
+    A piece of query syntax used as-is.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+    def to_string(self):
+        return self.text
+
+
+def _field(field, text):
+    if field is None:
+        return text
+    return '%s:%s' % (field, text)
+
+
+class Term(Clause):
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def to_string(self):
+        return _field(self.field, escape(self.value))
+
+
+class Phrase(Clause):
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def to_string(self):
+        return _field(self.field, phrase(self.value))
+
+
+class Range(Clause):
+
+    """
+    ``field:[start TO end]``; ``None`` leaves that end open.
+    """
+
+    def __init__(self, field, start=None, end=None, include_start=True, include_end=True):
+        self.field = field
+        self.start = start
+        self.end = end
+        self.include_start = include_start
+        self.include_end = include_end
+
+    def to_string(self):
+        return _field(self.field, '%s%s TO %s%s' % (
+            '[' if self.include_start else '{',
+            '*' if self.start is None else escape(self.start),
+            '*' if self.end is None else escape(self.end),
+            ']' if self.include_end else '}',
+        ))
+
+
+def _clause(clause):
+    if isinstance(clause, Clause):
+        return clause
+    return Raw(utils.force_unicode(clause))
+
+
+class _Boolean(Clause):
+
+    operator = None
+
+    def __init__(self, *clauses):
+        self.clauses = [_clause(clause) for clause in clauses]
+
+    def to_string(self):
+        if len(self.clauses) == 1:
+            return self.clauses[0].to_string()
+        return '(%s)' % (' %s ' % self.operator).join(clause.to_string() for clause in self.clauses)
+
+
+class And(_Boolean):
+    operator = 'AND'
+
+
+class Or(_Boolean):
+    operator = 'OR'
+
+
+class Not(Clause):
+
+    def __init__(self, clause):
+        self.clause = _clause(clause)
+
+    def to_string(self):
+        return '-%s' % self.clause.to_string()
+
+
+class LocalParams(Clause):
+
+    """
+    Local params prefix, e.g. ``LocalParams('terms', 'a,b', f='id')`` gives
+    ``{!terms f=id}a,b``.
+    """
+
+    def __init__(self, type_=None, value=None, **params):
+        self.type = type_
+        self.value = value
+        self.params = params
+
+    def to_string(self):
+        bits = []
+
+        if self.type is not None:
+            bits.append(self.type)
+
+        for key, value in sorted(self.params.items()):
+            value = _value(value)
+            if not value or re.search(r'[\s}\'"]', value):
+                value = "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+            bits.append('%s=%s' % (key, value))
+
+        value = '' if self.value is None else _clause(self.value).to_string()
+        return '{!%s}%s' % (' '.join(bits), value)
+
+
+class Terms(Clause):
+
+    """
+    Filter on a (possibly huge) set of values with the ``terms`` query
+    parser, which is much cheaper for Solr than a long ``OR``.
+
+    Values are joined with ``,`` unless one of them contains a comma, in
+    which case another separator is picked.
+    """
+
+    separators = (',', '|', ';', '\t', '\x1f')
+
+    def __init__(self, field, values, method=None):
+        self.field = field
+        self.values = values
+        self.method = method
+
+    def to_string(self):
+        values = [_value(value) for value in self.values]
+        joined = None
+
+        for separator in self.separators:
+            joined = separator.join(values)
+            # No value contains the separator if splitting gives them back.
+            if len(values) == 0 or joined.count(separator) == len(values) - 1:
+                break
+        else:
+            raise ValueError('Could not find a separator for the terms of "%s".' % self.field)
+
+        params = {'f': self.field}
+        if self.method is not None:
+            params['method'] = self.method
+        if separator != ',':
+            params['separator'] = separator
+
+        return LocalParams('terms', Raw(joined), **params).to_string()
+
+
+class Query(object):
+
+    """
+    A complete query: the main ``q``, any number of filter queries and other
+    request parameters.
+
+    ``to_params()`` gives what ``Solr.search()`` sends in the URL;
+    ``to_json()`` the body for Solr's JSON Request API.
+    """
+
+    def __init__(self, q='*:*', fq=(), **params):
+        self.q = q
+        self.fq = list(fq)
+        self.params = params
+
+    def __repr__(self):
+        return '<Query %r>' % self.to_params()
+
+    def to_params(self):
+        params = dict(self.params)
+        params['q'] = utils.force_unicode(self.q)
+
+        if self.fq:
+            params['fq'] = [utils.force_unicode(fq) for fq in self.fq]
+
+        return params
+
+    def to_json(self):
+        body = {'query': utils.force_unicode(self.q)}
+
+        if self.fq:
+            body['filter'] = [utils.force_unicode(fq) for fq in self.fq]
+
+        if self.params:
+            body['params'] = dict(self.params)
+
+        return body
+
+
+class Pattern(object):
+
+    """
+    A query string with ``{name}`` placeholders, split up front so binding
+    values is just escaping and joining.
+
+    Placeholders are escaped as terms by default; use ``{name:phrase}`` to
+    quote the value as a phrase or ``{name:raw}`` to insert it untouched.
+    Lucene's own braces (``{a TO b}``, ``{!...}``) are left alone.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.parts = []
+        position = 0
+
+        for match in PLACEHOLDER_REGEX.finditer(pattern):
+            if match.start() > position:
+                self.parts.append(pattern[position:match.start()])
+            self.parts.append((match.group(1), ESCAPERS[match.group(2) or 'term']))
+            position = match.end()
+
+        if position < len(pattern):
+            self.parts.append(pattern[position:])
+
+        self.names = set(part[0] for part in self.parts if isinstance(part, tuple))
+
+    def bind(self, values):
+        try:
+            return ''.join(
+                part if isinstance(part, str) else part[1](values[part[0]])
+                for part in self.parts)
+        except KeyError as err:
+            raise ValueError('Missing value for placeholder %s in %r.' % (err, self.pattern))
+
+
+class Template(object):
+
+    """
+    A precompiled query shape. ``q`` and every ``fq`` may contain
+    placeholders (see ``Pattern``); other parameters are used as-is.
+    ``bind()`` returns a ``Query``.
+    """
+
+    def __init__(self, q, fq=(), **params):
+        self.q = Pattern(q)
+        self.fq = [Pattern(pattern) for pattern in fq]
+        self.params = params
+
+    def bind(self, **values):
+        return Query(
+            self.q.bind(values),
+            fq=[pattern.bind(values) for pattern in self.fq],
+            **self.params)
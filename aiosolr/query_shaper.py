@@ -0,0 +1,211 @@
+# coding: utf-8
+import re
+from collections import Counter
+
+
+FIELD_REGEX = re.compile(r'^[+-]?([\w.]+):')
+CONJUNCTIONS = ('AND', '&&')
+DISJUNCTIONS = ('OR', '||')
+BRACKETS = {'(': ')', '[': ']', '{': '}'}
+
+
+def tokenize(q):
+    """
+    Splits a Lucene query string on whitespace outside of quotes, brackets
+    and parentheses. Returns ``None`` if the query is unbalanced.
+    """
+    tokens = []
+    current = []
+    closers = []
+    in_quotes = False
+    escaped = False
+
+    for char in q:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif in_quotes:
+            if char == '"':
+                in_quotes = False
+        elif char == '"':
+            in_quotes = True
+        elif char in BRACKETS:
+            closers.append(BRACKETS[char])
+        elif closers and char in (']', '}') and closers[-1] in (']', '}'):
+            # Ranges may be closed by either bracket: ``[a TO b}``.
+            closers.pop()
+        elif closers and char == closers[-1]:
+            closers.pop()
+        elif char.isspace() and not closers:
+            if current:
+                tokens.append(''.join(current))
+                current = []
+            continue
+
+        current.append(char)
+
+    if in_quotes or closers or escaped:
+        return None
+
+    if current:
+        tokens.append(''.join(current))
+
+    return tokens
+
+
+def split_conjunction(q, default_and=False):
+    """
+    Splits ``q`` into clauses that must all match, or returns ``None`` if it
+    isn't a plain conjunction (has ``OR``, relies on the default operator
+    being ``OR``, ...). ``NOT x`` comes back as ``-x``.
+    """
+    tokens = tokenize(q)
+
+    if not tokens:
+        return None
+
+    clauses = []
+    # Whether every clause so far was joined to the previous one with AND.
+    joined = True
+    pending_and = False
+    negate = False
+
+    for token in tokens:
+        if token in DISJUNCTIONS:
+            return None
+
+        if token in CONJUNCTIONS:
+            if not clauses or pending_and:
+                return None
+            pending_and = True
+            continue
+
+        if token in ('NOT', '!'):
+            if negate:
+                return None
+            negate = True
+            continue
+
+        if negate:
+            token = '-' + token
+            negate = False
+
+        if clauses and not pending_and:
+            joined = False
+
+        clauses.append(token)
+        pending_and = False
+
+    if negate or pending_and:
+        return None
+
+    if not joined and not default_and and not all(clause[0] in '+-' for clause in clauses):
+        return None
+
+    return clauses
+
+
+def clause_field(clause):
+    """
+    Returns the field a clause queries, or ``None``.
+    """
+    match = FIELD_REGEX.match(clause)
+    return match.group(1) if match else None
+
+
+class QueryShaper(object):
+
+    """
+    Rewrites search parameters so Solr's filterCache gets a chance to help.
+
+    Top-level clauses of ``q`` on any of ``filter_fields`` (fields that
+    should never affect scoring: type, status, ACLs, ...) are moved into
+    their own ``fq`` parameters, so each one is cached and reused
+    independently. Only plain conjunctions are touched (``a AND b``,
+    ``+a +b``, or anything with ``q.op=AND``); queries with ``OR``, local
+    params or a ``defType`` are sent as they are.
+
+    Filters on ``uncached_fields``, a dictionary of field name to cost, get
+    ``{!cache=false cost=N}`` so one-off expensive filters don't evict the
+    useful ones and run after the cheap ones.
+
+    ``shapes`` counts how often each resulting ``fq`` was seen, which is
+    handy for sizing Solr's caches. Only the first ``max_tracked``
+    distinct filters are counted.
+
+    Example::
+
+        shaper = QueryShaper(filter_fields=['type', 'status'],
+                             uncached_fields={'geo': 200})
+        solr = Solr('http://localhost:8983/solr/core0', query_shaper=shaper)
+
+        # q=title:bananas, fq=[type:fruit, -status:deleted]
+        yield from solr.search('title:bananas AND type:fruit AND NOT status:deleted')
+
+        shaper.shapes.most_common(10)
+
+    """
+
+    def __init__(self, filter_fields=(), uncached_fields=None, max_tracked=10000):
+        self.filter_fields = frozenset(filter_fields)
+        self.uncached_fields = dict(uncached_fields or {})
+        self.max_tracked = max_tracked
+        self.shapes = Counter()
+
+    def _filter(self, clause):
+        if clause.startswith('+'):
+            clause = clause[1:]
+
+        field = clause_field(clause)
+
+        if field in self.uncached_fields and not clause.startswith('{!'):
+            clause = '{!cache=false cost=%d}%s' % (self.uncached_fields[field], clause)
+
+        return clause
+
+    def _track(self, fq):
+        if fq in self.shapes or len(self.shapes) < self.max_tracked:
+            self.shapes[fq] += 1
+
+    def shape(self, params):
+        """
+        Returns a reshaped copy of the search ``params``.
+        """
+        params = dict(params)
+        fq = params.get('fq') or []
+
+        if not isinstance(fq, (list, tuple)):
+            fq = [fq]
+
+        fq = [self._filter(clause) for clause in fq]
+        q = params.get('q')
+
+        if (isinstance(q, str) and self.filter_fields and 'defType' not in params
+                and '{!' not in q):
+            clauses = split_conjunction(q, default_and=params.get('q.op') == 'AND')
+
+            if clauses:
+                scoring = []
+
+                for clause in clauses:
+                    if clause_field(clause) in self.filter_fields:
+                        fq.append(self._filter(clause))
+                    else:
+                        scoring.append(clause)
+
+                if len(scoring) < len(clauses):
+                    if not scoring:
+                        params['q'] = '*:*'
+                    elif all(clause[0] in '+-' for clause in scoring):
+                        params['q'] = ' '.join(scoring)
+                    else:
+                        params['q'] = ' AND '.join(scoring)
+
+        for clause in fq:
+            self._track(clause)
+
+        if fq:
+            params['fq'] = fq
+
+        return params
@@ -1,3 +1,82 @@
+from . import utils
+
+
+class Group(object):
+
+    """
+    A single group of a grouped response: ``value`` is the group value
+    (``None`` for docs missing the field), ``hits`` the number of docs in
+    the group. ``docs`` is only built when first accessed.
+    """
+
+    def __init__(self, value, doclist):
+        self.value = value
+        self.hits = doclist.get('numFound', 0)
+        self.start = doclist.get('start', 0)
+        self._doclist = doclist
+
+    def __repr__(self):
+        return '<Group %r (%d hits)>' % (self.value, self.hits)
+
+    @property
+    def docs(self):
+        return self._doclist.get('docs', [])
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class GroupedField(object):
+
+    """
+    Grouping results for one ``group.field`` or ``group.query``.
+
+    ``matches`` is the number of docs that matched the query, ``ngroups``
+    the number of groups (only with ``group.ngroups=true``). Iterating
+    gives ``Group`` objects, built on first use; ``get()`` looks one up by
+    value. With ``group.format=simple`` or for a ``group.query`` there are
+    no groups, just the flat ``docs`` (and ``hits``).
+    """
+
+    def __init__(self, name, raw):
+        self.name = name
+        self.matches = raw.get('matches', 0)
+        self.ngroups = raw.get('ngroups', None)
+        self._raw = raw
+        self._groups = None
+        self._by_value = None
+
+        doclist = raw.get('doclist') or {}
+        self.hits = doclist.get('numFound', 0)
+        self.docs = doclist.get('docs', [])
+
+    def __repr__(self):
+        return '<GroupedField %r (%d matches)>' % (self.name, self.matches)
+
+    @property
+    def groups(self):
+        if self._groups is None:
+            self._groups = [
+                Group(group.get('groupValue'), group.get('doclist') or {})
+                for group in self._raw.get('groups', ())
+            ]
+        return self._groups
+
+    def get(self, value, default=None):
+        if self._by_value is None:
+            self._by_value = dict((group.value, group) for group in self.groups)
+        return self._by_value.get(value, default)
+
+    def __len__(self):
+        return len(self._raw.get('groups', ()))
+
+    def __iter__(self):
+        return iter(self.groups)
+
+
 class Results(object):
 
     """
@@ -47,9 +126,27 @@ class Results(object):
 
         solr = Solr('<solr url>', response_cls=CustomResults)
 
+    Results can be turned into compact bytes, e.g. to share them between
+    processes, and back::
+
+        data = results.to_bytes()
+        results = Results.from_bytes(data)
+
+    Grouped responses are parsed on demand through ``groups``, and the
+    ``expanded`` docs of the Collapse/Expand parsers can be matched back to
+    their collapsed heads::
+
+        for group in results.groups['manu_exact']:
+            print(group.value, group.hits, group.docs)
+
+        for head, expanded in results.with_expanded('manu_exact'):
+            print(head['id'], [doc['id'] for doc in expanded])
+
     """
 
     def __init__(self, decoded):
+        self.raw_response = decoded
+
         # main response part of decoded Solr response
         response_part = decoded.get('response') or {}
         self.docs = response_part.get('docs', ())
@@ -63,7 +160,53 @@ class Results(object):
         self.stats = decoded.get('stats', {})
         self.qtime = decoded.get('responseHeader', {}).get('QTime', None)
         self.grouped = decoded.get('grouped', {})
+        self.expanded = decoded.get('expanded', {})
         self.nextCursorMark = decoded.get('nextCursorMark', None)
+        self._groups = None
+
+    @property
+    def groups(self):
+        """
+        ``grouped`` parsed into a dictionary of ``GroupedField`` objects,
+        keyed on the ``group.field``/``group.query``.
+        """
+        if self._groups is None:
+            self._groups = dict(
+                (name, GroupedField(name, raw)) for name, raw in self.grouped.items())
+        return self._groups
+
+    def expanded_for(self, doc, field):
+        """
+        Returns the docs expanded under a collapsed head ``doc``, collapsed
+        on ``field``.
+        """
+        value = doc.get(field)
+
+        if value is None:
+            return []
+
+        expanded = self.expanded.get(utils.normalize_param_value(value)) or {}
+        return expanded.get('docs', [])
+
+    def with_expanded(self, field):
+        """
+        Yields ``(head, expanded_docs)`` for every doc of the results.
+        """
+        for doc in self.docs:
+            yield doc, self.expanded_for(doc, field)
+
+    def to_bytes(self):
+        """
+        Packs the underlying Solr response with ``utils.pack``.
+        """
+        return utils.pack(self.raw_response)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Builds results from the output of ``to_bytes``.
+        """
+        return cls(utils.unpack(data))
 
     def __len__(self):
         return len(self.docs)
@@ -0,0 +1,387 @@
+# coding: utf-8
+import asyncio
+from .exceptions import SolrError
+
+
+# Put on the queue by a partition once it's finished (or failed).
+_DONE = object()
+
+
+def range_bounds(low, high, partitions):
+    """
+    Splits ``[low, high]`` into ``partitions`` ranges of (nearly) equal
+    width. Returns the ``partitions + 1`` boundaries. Whole numbers stay
+    whole, so the ranges work on integer fields too.
+    """
+    if low == int(low) and high == int(high):
+        low, high = int(low), int(high)
+        width = high - low + 1
+        bounds = [low + width * i // partitions for i in range(partitions)]
+    else:
+        bounds = [low + (high - low) * i / partitions for i in range(partitions)]
+
+    return bounds + [high]
+
+
+def range_filters(field, bounds):
+    """
+    Builds one filter query per range between consecutive ``bounds``: each
+    range includes its lower bound, the last one its upper bound too.
+    """
+    filters = []
+
+    for i in range(len(bounds) - 1):
+        closing = ']' if i == len(bounds) - 2 else '}'
+        filters.append('%s:[%s TO %s%s' % (field, bounds[i], bounds[i + 1], closing))
+
+    return filters
+
+
+def with_tiebreak(sort, unique_key):
+    """
+    Cursors need the unique key in the sort to break ties; appends it if
+    it's missing.
+    """
+    if not sort:
+        return '%s asc' % unique_key
+
+    fields = [clause.split()[0] for clause in sort.split(',') if clause.strip()]
+
+    if unique_key in fields:
+        return sort
+
+    return '%s,%s asc' % (sort, unique_key)
+
+
+class Partition(object):
+
+    """
+    Progress of one partition of a ``ParallelScan``.
+
+    ``hits`` is the number of documents in the partition, known once its
+    first page has started coming in; ``docs`` counts those handed out so
+    far. ``retries`` counts the requests that were retried and ``error``
+    holds the exception that stopped it, if any.
+    """
+
+    def __init__(self, index, solr, params):
+        self.index = index
+        self.solr = solr
+        self.params = params
+        self.hits = None
+        self.docs = 0
+        self.requests = 0
+        self.retries = 0
+        self.done = False
+        self.error = None
+
+    @property
+    def progress(self):
+        """
+        Fraction of the partition read so far, between 0 and 1.
+        """
+        if self.done:
+            return 1.0
+        if not self.hits:
+            return 0.0
+        return min(1.0, self.docs / self.hits)
+
+    def __repr__(self):
+        return '<Partition %d: %s/%s docs%s>' % (
+            self.index, self.docs, '?' if self.hits is None else self.hits,
+            ' (done)' if self.done else '')
+
+
+class ParallelScan(object):
+
+    """
+    Reads every document matching ``q`` through ``partitions`` concurrent
+    streams, each over a disjoint slice of the index, and hands them out
+    through a single async iterator. Documents come out in no particular
+    order.
+
+    ``method`` decides how the index is sliced:
+
+    * ``'hash'`` (the default) filters on ``{!hash workers=N worker=i}``
+      with ``partitionKeys=field``, which splits on a hash of ``field``.
+    * ``'range'`` splits the values of the numeric ``field`` into ranges.
+      Optionally accepts ``bounds``, the ``partitions + 1`` boundaries;
+      otherwise they're spread evenly between the field's minimum and
+      maximum, fetched with the stats component.
+    * ``'shard'`` sends each partition to one of ``shards`` (shard names or
+      URLs, as Solr's ``shards`` parameter takes them). There are as many
+      partitions as shards.
+
+    Each partition pages through its slice with a cursor, ``rows``
+    documents at a time, parsing documents as they arrive (see
+    ``Solr.search_iter()``). With ``export=True`` it uses a single
+    ``/export`` request instead, which needs ``fl`` and a ``sort`` on
+    docValues fields.
+
+    A page that fails with a retryable error (see ``SolrError.retryable``)
+    is requested again from the same cursor, skipping the documents of it
+    already handed out, up to ``retries`` times in a row per partition,
+    ``retry_delay`` seconds apart (or as long as Solr's ``Retry-After``
+    asks). Other errors, or one too many, stop the scan.
+
+    Optionally accepts ``replicas``, more ``Solr`` clients for copies of
+    the same index; partitions are spread round-robin over ``solr`` and
+    them. ``queue_size`` bounds how many read documents wait for the
+    consumer before the partitions stop reading. Any extra keyword
+    arguments are passed on as search parameters.
+
+    ``partitions`` holds a ``Partition`` per slice with its progress;
+    ``docs``, ``hits`` and ``progress`` sum them up.
+
+    Example::
+
+        scan = yield from solr.parallel_scan('*:*', partitions=8, fl='id,title')
+
+        async for doc in scan:
+            dump(doc)
+
+            if scan.docs % 100000 == 0:
+                print('%d%%' % (scan.progress * 100), scan.partitions)
+
+    """
+
+    def __init__(self, solr, q='*:*', partitions=4, field='id', method='hash', bounds=None,
+                 shards=None, replicas=None, rows=1000, export=False, sort=None,
+                 queue_size=10000, retries=3, retry_delay=1.0, **kwargs):
+        if method not in ('hash', 'range', 'shard'):
+            raise ValueError("method must be 'hash', 'range' or 'shard', not %r." % method)
+        if method == 'shard' and not shards:
+            raise ValueError("method='shard' needs a list of shards.")
+        if bounds is not None and len(bounds) != partitions + 1:
+            raise ValueError('bounds needs %d values for %d partitions.' % (partitions + 1, partitions))
+
+        self.solr = solr
+        self.loop = solr.loop
+        self.log = solr.log
+        self.q = q
+        self.num_partitions = len(shards) if method == 'shard' else partitions
+        self.field = field
+        self.method = method
+        self.bounds = bounds
+        self.shards = shards
+        self.clients = [solr] + list(replicas or ())
+        self.rows = rows
+        self.export = export
+        self.sort = sort
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.params = kwargs
+        self.partitions = []
+        self.docs = 0
+
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self._running = 0
+
+    @property
+    def hits(self):
+        """
+        Documents in all partitions, or ``None`` until every partition knows
+        its count.
+        """
+        if not self.partitions or any(partition.hits is None for partition in self.partitions):
+            return None
+        return sum(partition.hits for partition in self.partitions)
+
+    @property
+    def progress(self):
+        """
+        Fraction of the whole scan handed out so far, between 0 and 1.
+        """
+        hits = self.hits
+
+        if self.partitions and all(partition.done for partition in self.partitions):
+            return 1.0
+        if not hits:
+            return 0.0
+        return min(1.0, self.docs / hits)
+
+    async def _fetch_bounds(self):
+        params = {'rows': 0, 'stats': 'true', 'stats.field': self.field}
+
+        if self.params.get('fq'):
+            params['fq'] = self.params['fq']
+
+        results = await self.solr.search(self.q, **params)
+        stats = results.stats.get('stats_fields', {}).get(self.field) or {}
+
+        if stats.get('min') is None:
+            # Nothing matches; one empty range is as good as any.
+            return [0] * (self.num_partitions + 1)
+
+        return range_bounds(stats['min'], stats['max'], self.num_partitions)
+
+    async def _partition_params(self):
+        fq = self.params.get('fq') or []
+
+        if not isinstance(fq, (list, tuple)):
+            fq = [fq]
+
+        if self.method == 'hash':
+            extra = [
+                ({'fq': list(fq) + ['{!hash workers=%d worker=%d}' % (self.num_partitions, i)],
+                  'partitionKeys': self.field})
+                for i in range(self.num_partitions)
+            ]
+        elif self.method == 'range':
+            bounds = self.bounds
+
+            if bounds is None:
+                bounds = await self._fetch_bounds()
+
+            extra = [{'fq': list(fq) + [clause]} for clause in range_filters(self.field, bounds)]
+        else:
+            extra = [{'fq': list(fq), 'shards': shard} for shard in self.shards]
+
+        params = []
+
+        for partition_extra in extra:
+            partition_params = dict(self.params)
+            partition_params.update(partition_extra)
+            params.append(partition_params)
+
+        return params
+
+    async def start(self):
+        """
+        Works out the partitions and starts reading them.
+        """
+        for i, params in enumerate(await self._partition_params()):
+            client = self.clients[i % len(self.clients)]
+            self.partitions.append(Partition(i, client, params))
+
+        self.log.debug("Scanning '%s' in %d partitions by %s.", self.q, len(self.partitions), self.method)
+        self._running = len(self.partitions)
+        self._tasks = [self.loop.create_task(self._scan(partition)) for partition in self.partitions]
+
+    async def _read(self, partition, stream, progress):
+        """
+        Hands out the documents of ``stream``, skipping the first
+        ``progress[0]`` (already handed out by a failed attempt) and
+        counting the others in it.
+        """
+        skip = progress[0]
+
+        try:
+            if partition.hits is None:
+                partition.hits = stream.hits
+
+            async for doc in stream:
+                if skip:
+                    skip -= 1
+                    continue
+
+                await self._queue.put(doc)
+                partition.docs += 1
+                progress[0] += 1
+        finally:
+            stream.close()
+
+    async def _retry(self, partition, err, failures):
+        """
+        Waits before retrying after ``err``, or raises it if it isn't
+        retryable or there have been too many ``failures`` in a row.
+        """
+        if not isinstance(err, SolrError) or not err.retryable or failures > self.retries:
+            raise err
+
+        delay = err.retry_after
+        if delay is None:
+            delay = self.retry_delay
+
+        partition.retries += 1
+        self.log.warning("Partition %d of the scan failed, retrying in %s seconds: %s",
+                         partition.index, delay, err)
+        await asyncio.sleep(delay)
+
+    async def _scan(self, partition):
+        solr = partition.solr
+        unique_key = getattr(solr, 'unique_key', 'id')
+
+        try:
+            if self.export:
+                params = dict(partition.params, search_handler='export',
+                              sort=self.sort or '%s asc' % unique_key)
+            else:
+                params = dict(partition.params, rows=self.rows,
+                              sort=with_tiebreak(self.sort, unique_key))
+
+            cursor = '*'
+            # Documents of the current page handed out so far.
+            progress = [0]
+            failures = 0
+
+            while True:
+                if not self.export:
+                    params['cursorMark'] = cursor
+
+                partition.requests += 1
+
+                try:
+                    stream = await solr.search_iter(self.q, **params)
+                    await self._read(partition, stream, progress)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as err:
+                    failures += 1
+                    await self._retry(partition, err, failures)
+                    continue
+
+                failures = 0
+                progress = [0]
+
+                if self.export:
+                    break
+
+                next_cursor = stream.response.get('nextCursorMark')
+
+                if next_cursor is None or next_cursor == cursor:
+                    break
+                cursor = next_cursor
+
+            partition.done = True
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            partition.error = err
+            self.log.error("Partition %d of the scan failed: %s", partition.index, err)
+
+        await self._queue.put(_DONE)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while self._running:
+            doc = await self._queue.get()
+
+            if doc is not _DONE:
+                self.docs += 1
+                return doc
+
+            self._running -= 1
+
+            for partition in self.partitions:
+                if partition.error is not None:
+                    await self.close()
+                    raise partition.error
+
+        raise StopAsyncIteration()
+
+    async def close(self):
+        """
+        Stops reading, e.g. when stopping before the last document.
+        """
+        self._running = 0
+
+        for task in self._tasks:
+            task.cancel()
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
@@ -0,0 +1,131 @@
+# coding: utf-8
+import io
+import asyncio
+import aiohttp
+
+
+# Marks the end of the documents.
+_DONE = object()
+
+
+class FileReader(io.RawIOBase):
+
+    """
+    Read-only file object over anything with a ``read(size)`` method, such
+    as an ``mmap.mmap``. aiohttp streams file objects into multipart bodies
+    a chunk at a time; wrapping other readers in this lets them be sent the
+    same way instead of being read into memory whole.
+
+    Example::
+
+        with open('/data/huge.pdf', 'rb') as pdf:
+            mapped = mmap.mmap(pdf.fileno(), 0, access=mmap.ACCESS_READ)
+            form_data.add_field('huge.pdf', FileReader(mapped), filename='huge.pdf')
+
+    """
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.file_obj.read(len(buffer))
+        buffer[:len(data)] = data
+        self.bytes_read += len(data)
+        return len(data)
+
+
+def request_body(chunks, loop=None):
+    """
+    Wraps the async iterator ``chunks`` (of bytes) in something the
+    installed aiohttp sends as a chunked request body: the iterator itself
+    from aiohttp 3.1, a ``streamer`` on 2.x and a generator before that.
+    """
+    if hasattr(getattr(aiohttp, 'payload', None), 'AsyncIterablePayload'):
+        return chunks
+
+    if hasattr(aiohttp, 'streamer'):
+        @aiohttp.streamer
+        async def write(writer):
+            async for chunk in chunks:
+                await writer.write(chunk)
+
+        return write()
+
+    return _generator_body(chunks, loop)
+
+
+def _generator_body(chunks, loop):
+    # Old aiohttp writes the bytes a generator body yields, and waits for
+    # the futures it yields, sending their results (or errors) back in.
+    while True:
+        try:
+            chunk = yield asyncio.ensure_future(chunks.__anext__(), loop=loop)
+        except StopAsyncIteration:
+            return
+        yield chunk
+
+
+class XMLAddStream(object):
+
+    """
+    Async iterator over the body of an ``<add>`` request, encoding
+    documents only as the body is sent, so memory use doesn't grow with the
+    size of the batch or of its documents.
+
+    Starts with the document ``first``, then takes more from the ``docs``
+    iterator. ``encode`` turns one document into an iterable of byte pieces
+    (see ``utils.iter_doc_xml``); they go out in chunks of about
+    ``buffer_size`` bytes. With ``max_bytes`` set, the request ends at the
+    first document boundary past that many bytes and the rest of ``docs``
+    is left for the next one. A single document bigger than that still
+    goes out whole.
+    """
+
+    def __init__(self, first, docs, encode, attrs='', max_bytes=None, buffer_size=64 * 1024):
+        self.docs = docs
+        self.encode = encode
+        self.attrs = attrs
+        self.max_bytes = max_bytes
+        self.buffer_size = buffer_size
+        self.count = 0
+        self.bytes = 0
+        self._pieces = self._iter_pieces(first)
+
+    def _iter_pieces(self, doc):
+        yield ('<add%s>' % self.attrs).encode('utf-8')
+
+        while doc is not _DONE:
+            self.count += 1
+
+            for piece in self.encode(doc):
+                self.bytes += len(piece)
+                yield piece
+
+            if self.max_bytes is not None and self.bytes >= self.max_bytes:
+                break
+
+            doc = next(self.docs, _DONE)
+
+        yield b'</add>'
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        buffer = []
+        size = 0
+
+        for piece in self._pieces:
+            buffer.append(piece)
+            size += len(piece)
+            if size >= self.buffer_size:
+                break
+
+        if not buffer:
+            raise StopAsyncIteration()
+
+        return b''.join(buffer)
@@ -1,9 +1,24 @@
 # coding: utf-8
 import re
 import ast
+import json
+import zlib
+import binascii
+import marshal
+import hashlib
+import fnmatch
 import datetime
+import functools
+from urllib.parse import urlencode
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
 import html.entities as htmlentities
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 
 DATETIME_REGEX = re.compile('^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})T(?P<hour>\d{2}):(?P<minute>\d{2}):(?P<second>\d{2})(\.\d+)?Z$')
 
@@ -212,3 +227,432 @@ def to_python(value):
         pass
 
     return value
+
+
+def convert_docs(decoded):
+    """
+    Runs every field value of the documents in a decoded Solr response
+    through ``to_python``. Multi-valued fields are converted item by item.
+
+    The response is modified in place and returned.
+    """
+    response_part = decoded.get('response') or {}
+
+    for doc in response_part.get('docs', ()):
+        convert_doc(doc)
+
+    return decoded
+
+
+def convert_doc(doc):
+    """
+    Runs every field value of a single document through ``to_python``, in
+    place.
+    """
+    for key, value in doc.items():
+        if isinstance(value, list):
+            doc[key] = [to_python(bit) for bit in value]
+        else:
+            doc[key] = to_python(value)
+
+    return doc
+
+
+def decode_response(content, decoder=None, convert=False):
+    """
+    Decodes a JSON response body from Solr.
+
+    ``decoder`` is any object with a ``decode`` method; ``json.loads`` is
+    used if it's ``None``. Lives at module level so it can be shipped to a
+    ``ProcessPoolExecutor``.
+    """
+    if decoder is None:
+        decoded = json.loads(content)
+    else:
+        decoded = decoder.decode(content)
+
+    if convert:
+        decoded = convert_docs(decoded)
+
+    return decoded
+
+
+def parse_extract_metadata(raw_metadata):
+    """
+    Turns the flat ``[key, values, key, values, ...]`` list Solr's
+    ExtractingRequestHandler returns for metadata into a dictionary.
+    """
+    if not raw_metadata:
+        return {}
+    return dict(zip(raw_metadata[0::2], raw_metadata[1::2]))
+
+
+ATOMIC_UPDATE_OPERATIONS = ('set', 'add', 'add-distinct', 'inc', 'remove', 'removeregex')
+# Applying these twice isn't the same as applying them once.
+CUMULATIVE_OPERATIONS = frozenset(['inc', 'add'])
+
+
+def build_atomic_update(op, unique_key='id'):
+    """
+    Turns a ``{unique_key: ..., '<operation>': {field: value}}`` dictionary
+    into the document Solr expects for an atomic update, e.g.
+    ``{'id': 'doc_1', 'popularity': {'inc': 1}}``.
+
+    ``_version_`` is passed through as-is.
+    """
+    if op.get(unique_key) is None:
+        raise ValueError('Atomic updates require the "%s" field.' % unique_key)
+
+    update = {unique_key: op[unique_key]}
+
+    for operation, fields in op.items():
+        if operation in (unique_key, '_version_'):
+            continue
+
+        if operation not in ATOMIC_UPDATE_OPERATIONS:
+            raise ValueError('Unknown atomic update operation "%s".' % operation)
+
+        for field, value in fields.items():
+            update.setdefault(field, {})[operation] = value
+
+    if '_version_' in op:
+        update['_version_'] = op['_version_']
+
+    return update
+
+
+def atomic_updates_idempotent(docs, fieldUpdates=None):
+    """
+    Whether sending ``docs`` twice has the same result as sending them
+    once: no ``inc`` or ``add`` operation, and no ``_version_`` that the
+    first attempt would have made stale.
+
+    ``docs`` are atomic updates as built by ``build_atomic_update`` (e.g.
+    ``{'id': 'doc_1', 'popularity': {'inc': 1}}``) or plain documents, with
+    ``fieldUpdates`` mapping field names to operations as ``Solr.add()``
+    takes them.
+    """
+    if fieldUpdates and CUMULATIVE_OPERATIONS.intersection(fieldUpdates.values()):
+        return False
+
+    for doc in docs:
+        if '_version_' in doc:
+            return False
+
+        for value in doc.values():
+            if isinstance(value, dict) and CUMULATIVE_OPERATIONS.intersection(value):
+                return False
+
+    return True
+
+
+def _json_default(value):
+    if hasattr(value, 'strftime'):
+        return from_python(value)
+    raise TypeError('%r is not JSON serializable' % (value, ))
+
+
+def json_dumps(value):
+    """
+    Serializes ``value`` to compact JSON for Solr. Dates & datetimes are
+    converted the same way ``from_python`` does it.
+    """
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+
+def build_delete_xml(ids=(), queries=()):
+    """
+    Builds a single ``<delete>`` command for any number of ids and queries,
+    escaping each of them.
+    """
+    parts = ['<delete>']
+    parts.extend('<id>%s</id>' % escape(force_unicode(id)) for id in ids)
+    parts.extend('<query>%s</query>' % escape(force_unicode(q)) for q in queries)
+    parts.append('</delete>')
+    return ''.join(parts)
+
+
+def build_doc(doc, boost=None, fieldUpdates=None, is_null=is_null_value, convert=from_python):
+    """
+    Builds the ``<doc>`` element of an ``<add>`` message for a single
+    document.
+
+    ``is_null`` and ``convert`` decide which values are skipped and how the
+    rest are turned into strings.
+    """
+    doc_elem = ElementTree.Element('doc')
+
+    for key, value in doc.items():
+        if key == 'boost':
+            doc_elem.set('boost', force_unicode(value))
+            continue
+
+        # To avoid multiple code-paths we'd like to treat all of our values as iterables:
+        if isinstance(value, (list, tuple)):
+            values = value
+        else:
+            values = (value, )
+
+        for bit in values:
+            if is_null(bit):
+                continue
+
+            attrs = {'name': key}
+
+            if fieldUpdates and key in fieldUpdates:
+                attrs['update'] = fieldUpdates[key]
+
+            if boost and key in boost:
+                attrs['boost'] = force_unicode(boost[key])
+
+            field = ElementTree.Element('field', **attrs)
+            field.text = convert(bit)
+
+            doc_elem.append(field)
+
+    return doc_elem
+
+
+def build_docs_xml(docs, boost=None, fieldUpdates=None, clean=False):
+    """
+    Serializes a list of documents to a string of concatenated ``<doc>``
+    elements, ready to be wrapped in an ``<add>``. With ``clean``, control
+    characters are stripped with ``sanitize`` too.
+    """
+    docs_xml = ''.join(
+        ElementTree.tostring(build_doc(doc, boost=boost, fieldUpdates=fieldUpdates), encoding='unicode')
+        for doc in docs)
+
+    if clean:
+        docs_xml = sanitize(docs_xml)
+
+    return docs_xml
+
+
+def iter_doc_xml(doc, boost=None, fieldUpdates=None, is_null=is_null_value, convert=from_python,
+                 chunk_size=64 * 1024):
+    """
+    Serializes a single document to the same ``<doc>`` element as
+    ``build_doc``, as a series of UTF-8 encoded pieces.
+
+    String values longer than ``chunk_size`` characters skip ``convert``
+    and are cleaned, escaped and encoded a chunk at a time, so no full copy
+    of them is made along the way.
+    """
+    doc_attrs = ''
+    if 'boost' in doc:
+        doc_attrs = ' boost=%s' % quoteattr(force_unicode(doc['boost']))
+
+    yield ('<doc%s>' % doc_attrs).encode('utf-8')
+
+    for key, value in doc.items():
+        if key == 'boost':
+            continue
+
+        if isinstance(value, (list, tuple)):
+            values = value
+        else:
+            values = (value, )
+
+        for bit in values:
+            if is_null(bit):
+                continue
+
+            attrs = ' name=%s' % quoteattr(key)
+
+            if fieldUpdates and key in fieldUpdates:
+                attrs += ' update=%s' % quoteattr(fieldUpdates[key])
+
+            if boost and key in boost:
+                attrs += ' boost=%s' % quoteattr(force_unicode(boost[key]))
+
+            yield ('<field%s>' % attrs).encode('utf-8')
+
+            if isinstance(bit, str) and len(bit) > chunk_size:
+                for start in range(0, len(bit), chunk_size):
+                    yield escape(clean_xml_string(bit[start:start + chunk_size])).encode('utf-8')
+            else:
+                yield escape(convert(bit)).encode('utf-8')
+
+            yield b'</field>'
+
+    yield b'</doc>'
+
+
+def gzip_compress(data, level=6, chunk_size=64 * 1024):
+    """
+    Gzips a bytestring, feeding it to the compressor ``chunk_size`` bytes at
+    a time so no extra full-size copy of the input is made.
+    """
+    # ``wbits`` of 16 + MAX_WBITS gets us a gzip header and trailer.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    view = memoryview(data)
+    pieces = []
+
+    for offset in range(0, len(view), chunk_size):
+        pieces.append(compressor.compress(view[offset:offset + chunk_size]))
+
+    pieces.append(compressor.flush())
+    return b''.join(pieces)
+
+
+# First byte of packed data, telling which codec wrote it.
+PACK_MSGPACK = b'M'
+PACK_MARSHAL = b'S'
+
+
+def pack(value):
+    """
+    Serializes a decoded Solr response (or any other JSON-like value) to a
+    compact binary form.
+
+    Uses MessagePack if ``msgpack`` is installed and ``marshal`` otherwise.
+    Note ``marshal`` data is only readable by the same Python version.
+    """
+    if msgpack is not None:
+        return PACK_MSGPACK + msgpack.packb(value, use_bin_type=True)
+    return PACK_MARSHAL + marshal.dumps(value)
+
+
+def unpack(data):
+    """
+    Reverses ``pack``.
+    """
+    codec, body = data[:1], memoryview(data)[1:]
+
+    if codec == PACK_MSGPACK:
+        if msgpack is None:
+            raise ValueError('Data was packed with msgpack, which is not installed.')
+        return msgpack.unpackb(body, raw=False)
+
+    if codec == PACK_MARSHAL:
+        return marshal.loads(body)
+
+    raise ValueError('Unknown packed data format %r.' % codec)
+
+
+def normalize_param_value(value):
+    """
+    Turns a query parameter value into the string Solr should see, the same
+    way whatever its Python type: booleans become ``true``/``false`` and
+    dates are formatted like ``from_python`` does.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if hasattr(value, 'strftime'):
+        return from_python(value)
+    return force_unicode(value)
+
+
+def canonical_params(params):
+    """
+    Builds a canonical, hashable form of query parameters: a sorted tuple of
+    ``(name, (value, ...))`` pairs with every value normalized by
+    ``normalize_param_value``.
+
+    The order of multiple values for one parameter is kept (it can matter
+    to Solr), except for sets, which are sorted. ``None`` values are dropped.
+    """
+    items = []
+
+    for key, value in params.items():
+        if value is None:
+            continue
+
+        if isinstance(value, (set, frozenset)):
+            values = tuple(sorted(normalize_param_value(bit) for bit in value))
+        elif isinstance(value, (list, tuple)):
+            values = tuple(normalize_param_value(bit) for bit in value if bit is not None)
+        else:
+            values = (normalize_param_value(value), )
+
+        items.append((force_unicode(key), values))
+
+    return tuple(sorted(items))
+
+
+# Parameters whose ``params_length`` is over this aren't cached by
+# ``encode_canonical_params``: a long ``ids`` or ``{!terms}`` list would
+# otherwise stay in memory twice, as the key and as its encoding.
+MAX_CACHED_PARAMS_LENGTH = 4096
+
+
+def _encode_canonical_params(canonical):
+    return urlencode([(key, value) for key, values in canonical for value in values])
+
+
+_cached_encode_canonical_params = functools.lru_cache(maxsize=1024)(_encode_canonical_params)
+
+
+def encode_canonical_params(canonical):
+    """
+    URL-encodes the output of ``canonical_params``. Cached, so identical
+    queries are only encoded once, unless they're longer than
+    ``MAX_CACHED_PARAMS_LENGTH``.
+    """
+    if params_length(canonical) > MAX_CACHED_PARAMS_LENGTH:
+        return _encode_canonical_params(canonical)
+
+    return _cached_encode_canonical_params(canonical)
+
+
+def encode_params(params):
+    """
+    URL-encodes query parameters in canonical form.
+    """
+    return encode_canonical_params(canonical_params(params))
+
+
+def fl_includes(fl, field):
+    """
+    Whether the field list ``fl`` (comma or space separated, globs allowed)
+    returns ``field``.
+    """
+    return any(fnmatch.fnmatchcase(field, name) for name in re.split(r'[\s,]+', fl) if name)
+
+
+def escape_ids(ids):
+    """
+    Escapes ids for the comma-separated ``ids`` parameter of the real-time
+    get handler.
+    """
+    return [force_unicode(id).replace('\\', '\\\\').replace(',', '\\,') for id in ids]
+
+
+def params_length(canonical):
+    """
+    Cheaply estimates the length of the output of ``canonical_params`` once
+    URL-encoded, without encoding it. This is a lower bound, as escaping
+    only makes things longer.
+    """
+    return sum(len(key) + len(value) + 2 for key, values in canonical for value in values)
+
+
+def params_dict(canonical):
+    """
+    Turns the output of ``canonical_params`` back into a dictionary, with
+    lists for parameters that have several values. Handy for the ``params``
+    block of a JSON Request API body.
+    """
+    return dict(
+        (key, list(values) if len(values) > 1 else values[0])
+        for key, values in canonical if values)
+
+
+def digest(data):
+    """
+    Returns a 16 byte hash of ``data`` (bytes). Uses BLAKE2 where ``hashlib``
+    has it (Python 3.6+) and truncated SHA-256 before that.
+    """
+    if hasattr(hashlib, 'blake2b'):
+        return hashlib.blake2b(data, digest_size=16).digest()
+    return hashlib.sha256(data).digest()[:16]
+
+
+def params_key(params):
+    """
+    Returns a short, stable hash of query parameters, suitable as a cache
+    or grouping key. Equivalent parameters give the same key regardless of
+    dict order or value types.
+    """
+    return binascii.hexlify(digest(encode_params(params).encode('utf-8'))).decode('ascii')
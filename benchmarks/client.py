@@ -0,0 +1,243 @@
+# coding: utf-8
+"""
+Measures ``Solr`` client throughput and latency against ``MockSolr``.
+
+Every operation runs ``--requests`` times at each concurrency level and
+payload size. Results are written as JSON and, given a baseline from an
+earlier run, compared against it; the exit status is 1 if anything got
+slower than ``--tolerance`` allows.
+
+Usage::
+
+    python -m benchmarks.client --output before.json
+    # ... change things ...
+    python -m benchmarks.client --output after.json --baseline before.json
+
+"""
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import platform
+from io import BytesIO
+import aiohttp
+from aiosolr import Solr
+from .mock_solr import MockSolr
+
+
+def make_docs(count, offset=0):
+    return [
+        {'id': 'doc_%d' % (offset + i), 'title': 'Benchmark doc %d' % i,
+         'text': 'lorem ipsum dolor sit amet ' * 10, 'price': i * 1.5,
+         'popularity': i % 10, 'tags': ['a', 'b', 'c']}
+        for i in range(count)
+    ]
+
+
+async def run_search(solr, i, size):
+    await solr.search('title:benchmark', rows=size)
+
+
+async def run_add(solr, i, size):
+    await solr.add(make_docs(size, i * size), commit=False)
+
+
+async def run_delete(solr, i, size):
+    ids = ' OR '.join('doc_%d' % (i * size + n) for n in range(size))
+    await solr.delete(q='id:(%s)' % ids, commit=False)
+
+
+async def run_suggest_terms(solr, i, size):
+    await solr.suggest_terms('title', 'ter')
+
+
+async def run_extract(solr, i, size):
+    file_obj = BytesIO(b'x' * size)
+    file_obj.name = 'bench_%d.html' % i
+    await solr.extract(file_obj)
+
+
+# Operation name: (coroutine, what ``size`` means for it).
+OPERATIONS = {
+    'search': (run_search, 'rows'),
+    'add': (run_add, 'docs'),
+    'delete': (run_delete, 'ids'),
+    'suggest_terms': (run_suggest_terms, None),
+    'extract': (run_extract, 'bytes'),
+}
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of ``values``, which must be sorted.
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summarize(latencies, wall_time):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / wall_time if wall_time else None,
+        'mean': sum(latencies) / len(latencies) if latencies else None,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+    }
+
+
+async def measure(solr, operation, requests, concurrency, size):
+    """
+    Runs ``operation`` ``requests`` times, ``concurrency`` at a time, and
+    returns its summary.
+    """
+    run = OPERATIONS[operation][0]
+    latencies = []
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            await run(solr, i, size)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def _key(result):
+    return (result['operation'], result['concurrency'], result['size'])
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Compares two runs' ``results`` lists. Returns a list of
+    ``(result, baseline_result, regressed)`` for the cases found in both.
+    """
+    previous = dict((_key(result), result) for result in baseline)
+    comparison = []
+
+    for result in results:
+        before = previous.get(_key(result))
+
+        if before is None:
+            continue
+
+        regressed = (
+            result['throughput'] < before['throughput'] * (1 - tolerance)
+            or result['p99'] > before['p99'] * (1 + tolerance))
+        comparison.append((result, before, regressed))
+
+    return comparison
+
+
+def _ms(seconds):
+    return '%8.2f' % (seconds * 1000)
+
+
+def print_results(results, comparison=None, out=sys.stdout):
+    changes = dict((_key(result), (before, regressed)) for result, before, regressed in comparison or ())
+    out.write('%-14s %5s %7s %10s %8s %8s\n' % ('operation', 'conc', 'size', 'req/s', 'p50 ms', 'p99 ms'))
+
+    for result in results:
+        line = '%-14s %5d %7s %10.1f %s %s' % (
+            result['operation'], result['concurrency'], result['size'],
+            result['throughput'], _ms(result['p50']), _ms(result['p99']))
+
+        if _key(result) in changes:
+            before, regressed = changes[_key(result)]
+            line += '  %+6.1f%% req/s%s' % (
+                (result['throughput'] / before['throughput'] - 1) * 100,
+                '  REGRESSION' if regressed else '')
+
+        out.write(line + '\n')
+
+
+def _ints(value):
+    return [int(bit) for bit in value.split(',') if bit]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--operations', default=','.join(sorted(OPERATIONS)),
+                        help='Comma-separated operations to run.')
+    parser.add_argument('--concurrency', type=_ints, default=[1, 10, 50])
+    parser.add_argument('--sizes', type=_ints, default=[10, 100],
+                        help='Payload sizes: rows, docs or ids per request (x1024 bytes for extract).')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per case.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Server-side latency in seconds.')
+    parser.add_argument('--doc-size', type=int, default=256, help='Characters of text per returned doc.')
+    parser.add_argument('--output', help='Where to write the JSON results.')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed fraction of slowdown before flagging a regression.')
+    return parser.parse_args(argv)
+
+
+async def run_all(args, loop):
+    server = MockSolr(latency=args.latency, doc_size=args.doc_size, loop=loop)
+    await server.start()
+    solr = Solr(server.url, loop=loop)
+    results = []
+
+    try:
+        for operation in args.operations.split(','):
+            sizes = args.sizes if OPERATIONS[operation][1] else [1]
+
+            for size in sizes:
+                payload = size * 1024 if operation == 'extract' else size
+
+                for concurrency in args.concurrency:
+                    # Warm up connections and caches.
+                    await measure(solr, operation, concurrency, concurrency, payload)
+                    summary = await measure(solr, operation, args.requests, concurrency, payload)
+                    summary.update(operation=operation, concurrency=concurrency, size=size)
+                    results.append(summary)
+    finally:
+        closing = solr.close()
+        # A coroutine from aiohttp 2.0 on.
+        if asyncio.iscoroutine(closing):
+            await closing
+        await server.stop()
+
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run_all(args, loop))
+
+    comparison = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        comparison = compare(results, baseline['results'], args.tolerance)
+
+    print_results(results, comparison)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({
+                'meta': {
+                    'time': time.time(),
+                    'python': platform.python_version(),
+                    'aiohttp': aiohttp.__version__,
+                    'latency': args.latency,
+                    'doc_size': args.doc_size,
+                    'requests': args.requests,
+                },
+                'results': results,
+            }, output_file, indent=2, sort_keys=True)
+
+    if comparison and any(regressed for _, _, regressed in comparison):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
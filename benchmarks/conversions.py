@@ -0,0 +1,315 @@
+# coding: utf-8
+"""
+Micro-benchmarks for the per-field conversion functions in ``aiosolr.utils``.
+
+Each function runs over the values of generated corpora that look like
+real documents: plain ASCII text, multilingual text, numeric-heavy and
+datetime-heavy documents, and deeply multi-valued fields. For every pair
+we report ops/sec and, measured separately with ``tracemalloc``, the
+bytes and blocks allocated per call and the peak memory of a pass.
+
+Usage::
+
+    python -m benchmarks.conversions --output before.json
+    python -m benchmarks.conversions --output after.json --baseline before.json
+
+"""
+import sys
+import json
+import time
+import random
+import datetime
+import argparse
+import platform
+import tracemalloc
+from aiosolr import utils
+
+
+WORDS = (
+    'solr', 'lucene', 'index', 'query', 'banana', 'document', 'field', 'facet',
+    'shard', 'replica', 'commit', 'segment', 'merge', 'token', 'analyzer', 'score',
+)
+MULTILINGUAL_WORDS = (
+    'café', 'naïve', 'straße', 'größe', 'ελληνικά', 'русский', '日本語', '中文',
+    '한국어', 'עברית', 'العربية', 'हिन्दी', 'ไทย', '☃', '🍌', 'Zürich',
+)
+# A few control characters, as found in scraped or OCR'd text.
+DIRT = ('\x00', '\x08', '\x0b', '\x1f', '￾')
+ENTITIES = ('&amp;', '&lt;', '&gt;', '&quot;', '&#39;', '&#x2603;', '&eacute;', '&nbsp;')
+
+
+def _text(rnd, words, count, dirt=0.0, entities=0.0):
+    bits = []
+
+    for _ in range(count):
+        bits.append(rnd.choice(words))
+        if dirt and rnd.random() < dirt:
+            bits.append(rnd.choice(DIRT))
+        if entities and rnd.random() < entities:
+            bits.append(rnd.choice(ENTITIES))
+
+    return ' '.join(bits)
+
+
+def _date(rnd):
+    return datetime.datetime(2000, 1, 1) + datetime.timedelta(seconds=rnd.randrange(10 ** 9))
+
+
+def ascii_docs(rnd, count):
+    return [
+        {'id': 'doc_%d' % i, 'title': _text(rnd, WORDS, 8),
+         'body': _text(rnd, WORDS, 200, dirt=0.01, entities=0.02)}
+        for i in range(count)
+    ]
+
+
+def multilingual_docs(rnd, count):
+    return [
+        {'id': 'doc_%d' % i, 'title': _text(rnd, MULTILINGUAL_WORDS, 8),
+         'body': _text(rnd, MULTILINGUAL_WORDS + WORDS, 200, dirt=0.01, entities=0.02)}
+        for i in range(count)
+    ]
+
+
+def numeric_docs(rnd, count):
+    return [
+        dict([('id', 'doc_%d' % i), ('in_stock', rnd.random() < 0.5)] + [
+            ('price_%d' % n, round(rnd.uniform(0, 1000), 2)) for n in range(10)
+        ] + [
+            ('count_%d' % n, rnd.randrange(10 ** 6)) for n in range(10)
+        ])
+        for i in range(count)
+    ]
+
+
+def datetime_docs(rnd, count):
+    return [
+        dict([('id', 'doc_%d' % i), ('day', _date(rnd).date())] + [
+            ('date_%d' % n, _date(rnd)) for n in range(10)
+        ])
+        for i in range(count)
+    ]
+
+
+def multivalued_docs(rnd, count):
+    return [
+        {'id': 'doc_%d' % i,
+         'tags': [rnd.choice(WORDS) for _ in range(100)],
+         'scores': [rnd.randrange(1000) for _ in range(100)],
+         'dates': [_date(rnd) for _ in range(20)]}
+        for i in range(count)
+    ]
+
+
+CORPORA = {
+    'ascii': ascii_docs,
+    'multilingual': multilingual_docs,
+    'numeric': numeric_docs,
+    'datetime': datetime_docs,
+    'multivalued': multivalued_docs,
+}
+
+
+def field_values(docs):
+    """
+    Every value of every document, multi-valued fields flattened.
+    """
+    values = []
+
+    for doc in docs:
+        for value in doc.values():
+            if isinstance(value, (list, tuple)):
+                values.extend(value)
+            else:
+                values.append(value)
+
+    return values
+
+
+def inputs(function, docs):
+    """
+    What ``function`` would see for ``docs``: Python values going in,
+    Solr's strings coming back, text for the cleaning functions.
+    """
+    values = field_values(docs)
+
+    if function == 'from_python':
+        return values
+
+    strings = [utils.from_python(value) for value in values]
+
+    if function == 'to_python':
+        return strings
+
+    if function == 'unescape_html':
+        return [value for value in strings if '&' in value] or strings
+
+    return strings
+
+
+FUNCTIONS = {
+    'from_python': utils.from_python,
+    'to_python': utils.to_python,
+    'sanitize': utils.sanitize,
+    'clean_xml_string': utils.clean_xml_string,
+    'unescape_html': utils.unescape_html,
+}
+
+
+def measure_speed(function, values, min_time=0.2):
+    """
+    Calls ``function`` on every value until ``min_time`` seconds have gone
+    by. Returns calls per second.
+    """
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0
+
+    while elapsed < min_time:
+        for value in values:
+            function(value)
+        calls += len(values)
+        elapsed = time.perf_counter() - start
+
+    return calls / elapsed
+
+
+def measure_allocations(function, values):
+    """
+    Calls ``function`` on every value once under ``tracemalloc``. Returns
+    the bytes and blocks still allocated per call (results are kept alive)
+    and the peak bytes traced during the pass.
+    """
+    tracemalloc.start()
+
+    try:
+        before = tracemalloc.take_snapshot()
+        # ``reset_peak()`` is Python 3.9+. Without it the peak also counts
+        # the first snapshot, which is next to empty this soon after
+        # ``start()``.
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        results = [function(value) for value in values]
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    del results
+
+    return {
+        'bytes_per_op': size / len(values),
+        'blocks_per_op': blocks / len(values),
+        'peak_bytes': peak,
+    }
+
+
+def run(functions, corpora, docs=200, min_time=0.2, seed=42):
+    results = []
+
+    for corpus in corpora:
+        corpus_docs = CORPORA[corpus](random.Random(seed), docs)
+
+        for name in functions:
+            values = inputs(name, corpus_docs)
+            result = {
+                'function': name,
+                'corpus': corpus,
+                'values': len(values),
+                'ops_per_sec': measure_speed(FUNCTIONS[name], values, min_time),
+            }
+            result.update(measure_allocations(FUNCTIONS[name], values))
+            results.append(result)
+
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Returns ``(result, baseline_result, regressed)`` for every case found in
+    both runs; slower by more than ``tolerance`` is a regression.
+    """
+    previous = dict(((result['function'], result['corpus']), result) for result in baseline)
+    comparison = []
+
+    for result in results:
+        before = previous.get((result['function'], result['corpus']))
+
+        if before is not None:
+            regressed = result['ops_per_sec'] < before['ops_per_sec'] * (1 - tolerance)
+            comparison.append((result, before, regressed))
+
+    return comparison
+
+
+def print_results(results, comparison=None, out=sys.stdout):
+    changes = dict(
+        ((result['function'], result['corpus']), (before, regressed))
+        for result, before, regressed in comparison or ())
+    out.write('%-17s %-13s %12s %10s %10s %12s\n' % (
+        'function', 'corpus', 'ops/s', 'B/op', 'blocks/op', 'peak B'))
+
+    for result in results:
+        line = '%-17s %-13s %12.0f %10.1f %10.2f %12d' % (
+            result['function'], result['corpus'], result['ops_per_sec'],
+            result['bytes_per_op'], result['blocks_per_op'], result['peak_bytes'])
+        key = (result['function'], result['corpus'])
+
+        if key in changes:
+            before, regressed = changes[key]
+            line += '  %+6.1f%%%s' % (
+                (result['ops_per_sec'] / before['ops_per_sec'] - 1) * 100,
+                '  REGRESSION' if regressed else '')
+
+        out.write(line + '\n')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--functions', default=','.join(sorted(FUNCTIONS)))
+    parser.add_argument('--corpora', default=','.join(sorted(CORPORA)))
+    parser.add_argument('--docs', type=int, default=200, help='Documents per corpus.')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='Seconds to spend timing each function on each corpus.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Where to write the JSON results.')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args.functions.split(','), args.corpora.split(','),
+                  docs=args.docs, min_time=args.min_time, seed=args.seed)
+
+    comparison = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            comparison = compare(results, json.load(baseline_file)['results'], args.tolerance)
+
+    print_results(results, comparison)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({
+                'meta': {
+                    'time': time.time(),
+                    'python': platform.python_version(),
+                    'docs': args.docs,
+                    'seed': args.seed,
+                },
+                'results': results,
+            }, output_file, indent=2, sort_keys=True)
+
+    if comparison and any(regressed for _, _, regressed in comparison):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+# coding: utf-8
+"""
+A stand-in for Solr, good enough to benchmark the client against.
+
+It answers the handlers ``Solr`` talks to with canned responses, after an
+optional artificial ``latency``. Select, get and export responses carry as
+many documents as ``rows`` asks for, each with a ``doc_size`` characters
+text field; update bodies are read in full and acknowledged.
+
+Example::
+
+    server = MockSolr(latency=0.002, doc_size=512)
+    yield from server.start()
+    solr = Solr(server.url)
+    ...
+    yield from server.stop()
+
+"""
+import json
+import asyncio
+from collections import Counter
+from aiohttp import web
+
+
+UPDATE_RESPONSE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n<response>\n'
+    '<lst name="responseHeader"><int name="status">0</int><int name="QTime">1</int></lst>\n'
+    '</response>\n')
+
+
+def _query(request):
+    # ``query`` is ``GET`` before aiohttp 2.0.
+    return request.query if hasattr(request, 'query') else request.GET
+
+
+class MockSolr(object):
+
+    def __init__(self, host='127.0.0.1', port=0, core='core0', latency=0.0, doc_size=256,
+                 terms=10, record=False, loop=None):
+        self.host = host
+        self.port = port
+        self.core = core
+        self.latency = latency
+        self.doc_size = doc_size
+        self.terms = terms
+        self.loop = loop
+        # Requests seen, by handler.
+        self.requests = Counter()
+        # With ``record``, the path and body of every update request.
+        self.record = record
+        self.updates = []
+
+        self._bodies = {}
+        self._runner = None
+        self._server = None
+        self._handler = None
+        self.app = None
+
+    def _make_app(self):
+        # Made once the loop runs: aiohttp before 2.0 binds the
+        # application to the current loop.
+        app = web.Application()
+        prefix = '/solr/%s/' % self.core
+        for handler in ('select', 'get', 'export'):
+            app.router.add_route('*', prefix + handler + '/', self.handle_search)
+        app.router.add_route('*', prefix + 'terms/', self.handle_terms)
+        app.router.add_route('POST', prefix + 'update/extract', self.handle_extract)
+        app.router.add_route('POST', prefix + 'update/', self.handle_update)
+        return app
+
+    @property
+    def url(self):
+        return 'http://%s:%d/solr/%s' % (self.host, self.port, self.core)
+
+    async def start(self):
+        self.app = self._make_app()
+        # ``AppRunner`` and its ``addresses`` are aiohttp 3.3+; older
+        # versions only have the since deprecated ``make_handler()``.
+        if hasattr(web, 'AppRunner') and hasattr(web.AppRunner, 'addresses'):
+            self._runner = web.AppRunner(self.app, access_log=None)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, self.host, self.port)
+            await site.start()
+            self.port = self._runner.addresses[0][1]
+            return
+        loop = self.loop or asyncio.get_event_loop()
+        self._handler = self.app.make_handler(access_log=None)
+        self._server = await loop.create_server(self._handler, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        # Called ``finish_connections()`` before aiohttp 1.2.
+        shutdown = getattr(self._handler, 'shutdown', None) or self._handler.finish_connections
+        await shutdown()
+
+    async def _wait(self, handler):
+        self.requests[handler] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _search_body(self, rows):
+        # Canned per ``rows``: the point is to measure the client.
+        body = self._bodies.get(rows)
+
+        if body is None:
+            text = ('lorem ipsum dolor sit amet ' * (self.doc_size // 27 + 1))[:self.doc_size]
+            docs = [
+                {'id': 'doc_%d' % i, 'title': 'Document %d' % i, 'text': text,
+                 'price': i * 1.5, 'popularity': i % 10, 'tags': ['a', 'b', 'c']}
+                for i in range(rows)
+            ]
+            body = self._bodies[rows] = json.dumps({
+                'responseHeader': {'status': 0, 'QTime': 1},
+                'response': {'numFound': rows * 10, 'start': 0, 'docs': docs},
+            })
+
+        return body
+
+    async def handle_search(self, request):
+        handler = request.path.rstrip('/').rsplit('/', 1)[-1]
+        params = _query(request)
+
+        if request.method == 'POST':
+            params = await request.post()
+
+        await self._wait(handler)
+        rows = int(params.get('rows', 10))
+        return web.Response(text=self._search_body(rows), content_type='application/json')
+
+    async def handle_terms(self, request):
+        await self._wait('terms')
+        fields = _query(request).getall('terms.fl', ['title'])
+        values = []
+
+        for i in range(self.terms):
+            values.extend(['term%d' % i, self.terms - i])
+
+        body = json.dumps({
+            'responseHeader': {'status': 0, 'QTime': 1},
+            'terms': dict((field, values) for field in fields),
+        })
+        return web.Response(text=body, content_type='application/json')
+
+    async def handle_update(self, request):
+        body = await request.read()
+        if self.record:
+            self.updates.append((request.path_qs, body))
+        await self._wait('update')
+        return web.Response(text=UPDATE_RESPONSE, content_type='application/xml')
+
+    async def handle_extract(self, request):
+        size = 0
+        name = None
+        reader = request.multipart()
+        # A coroutine from aiohttp 2.0 on.
+        if asyncio.iscoroutine(reader):
+            reader = await reader
+
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+            if part.filename is None:
+                await part.release()
+                continue
+            name = part.filename
+            while True:
+                chunk = await part.read_chunk()
+                if not chunk:
+                    break
+                size += len(chunk)
+
+        await self._wait('extract')
+        body = json.dumps({
+            'responseHeader': {'status': 0, 'QTime': 1},
+            name: '<html><body>Extracted %d bytes.</body></html>' % size,
+            '%s_metadata' % name: ['stream_name', [name], 'stream_size', [str(size)],
+                                   'Content-Type', ['text/html']],
+        })
+        return web.Response(text=body, content_type='application/json')
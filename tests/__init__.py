@@ -1,2 +1,14 @@
 # coding: utf-8
 from .test_client import *
+from .test_commit_scheduler import *
+from .test_indexing_queue import *
+from .test_buffered_writer import *
+from .test_cache import *
+from .test_query import *
+from .test_query_shaper import *
+from .test_streams import *
+from .test_exceptions import *
+from .test_log import *
+from .test_benchmarks import *
+from .test_json_stream import *
+from .test_scan import *
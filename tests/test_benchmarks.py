@@ -0,0 +1,78 @@
+# coding: utf-8
+import random
+import asyncio
+import unittest
+from benchmarks import conversions
+from benchmarks.client import OPERATIONS, compare, parse_args, percentile, run_all, summarize
+
+
+class BenchmarkStatsTestCase(unittest.TestCase):
+
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 0.5))
+        self.assertEqual(percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 0.5), 5)
+        self.assertEqual(percentile(list(range(1, 101)), 0.99), 99)
+        self.assertEqual(percentile([7], 0.99), 7)
+
+    def test_summarize(self):
+        summary = summarize([0.3, 0.1, 0.2, 0.4], 2.0)
+        self.assertEqual(summary['requests'], 4)
+        self.assertEqual(summary['throughput'], 2.0)
+        self.assertEqual(summary['p50'], 0.2)
+        self.assertEqual(summary['p99'], 0.4)
+
+    def test_compare(self):
+        def result(concurrency, throughput, p99):
+            return {'operation': 'search', 'concurrency': concurrency, 'size': 10,
+                    'throughput': throughput, 'p99': p99}
+
+        baseline = [result(1, 100.0, 0.010), result(10, 500.0, 0.030)]
+        comparison = compare(
+            [result(1, 95.0, 0.0105), result(10, 400.0, 0.030), result(50, 900.0, 0.1)],
+            baseline, tolerance=0.1)
+        self.assertEqual([regressed for _, _, regressed in comparison], [False, True])
+        self.assertEqual(comparison[1][1], baseline[1])
+
+
+class ConversionCorporaTestCase(unittest.TestCase):
+
+    def test_corpora(self):
+        for name, build in conversions.CORPORA.items():
+            docs = build(random.Random(1), 3)
+            self.assertEqual(len(docs), 3)
+            # Same seed, same corpus.
+            self.assertEqual(docs, build(random.Random(1), 3))
+
+    def test_inputs(self):
+        docs = conversions.multivalued_docs(random.Random(1), 2)
+        values = conversions.inputs('from_python', docs)
+        self.assertEqual(len(values), 2 * (1 + 100 + 100 + 20))
+        self.assertTrue(all(isinstance(value, str) for value in conversions.inputs('to_python', docs)))
+
+    def test_run(self):
+        results = conversions.run(['sanitize'], ['ascii'], docs=2, min_time=0.001)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(
+            sorted(results[0]),
+            ['blocks_per_op', 'bytes_per_op', 'corpus', 'function', 'ops_per_sec', 'peak_bytes', 'values'])
+
+
+class ClientBenchmarkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_smoke(self):
+        # Every operation, once, against the mock server.
+        args = parse_args(['--concurrency', '1', '--sizes', '2', '--requests', '2'])
+        results = self.loop.run_until_complete(run_all(args, self.loop))
+
+        self.assertEqual(sorted(result['operation'] for result in results), sorted(OPERATIONS))
+        for result in results:
+            self.assertEqual(result['requests'], 2)
+            self.assertTrue(result['throughput'] > 0)
+
@@ -0,0 +1,207 @@
+# coding: utf-8
+import asyncio
+import unittest
+from aiosolr import SolrError
+from aiosolr.buffered_writer import BufferedWriter, apply_operation, fold_operation
+from aiosolr.log import LOG
+
+
+class FakeSolr(object):
+
+    def __init__(self):
+        self.log = LOG
+        self.calls = []
+
+        # Methods whose next call fails.
+        self.failing = set()
+        # How long the next calls take.
+        self.delays = []
+
+    async def _call(self, name, items, kwargs):
+        await asyncio.sleep(self.delays.pop(0) if self.delays else 0)
+        if name in self.failing:
+            self.failing.discard(name)
+            raise SolrError('Solr is down.')
+        self.calls.append((name, items, kwargs))
+
+    async def add(self, docs, **kwargs):
+        await self._call('add', docs, kwargs)
+
+    async def update_fields(self, ops, **kwargs):
+        await self._call('update_fields', ops, kwargs)
+
+
+class BufferedWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.solr = FakeSolr()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_fold_operation(self):
+        self.assertEqual(fold_operation(['inc', 1], 'inc', 2), ['inc', 3])
+        self.assertEqual(fold_operation(['set', 1], 'inc', 2), ['set', 3])
+        self.assertEqual(fold_operation(['inc', 1], 'set', 5), ['set', 5])
+        self.assertEqual(fold_operation(['add', 'a'], 'add', ['b', 'c']), ['add', ['a', 'b', 'c']])
+        self.assertEqual(fold_operation(['set', ['a']], 'add', 'b'), ['set', ['a', 'b']])
+        self.assertEqual(fold_operation(['add', 'a'], 'remove', 'a'), None)
+        self.assertEqual(fold_operation(['set', 'x'], 'inc', 1), None)
+
+    def test_apply_operation(self):
+        doc = {'id': '1', 'views': 1, 'tags': 'a', 'title': 'x'}
+        self.assertTrue(apply_operation(doc, 'inc', 'views', 2))
+        self.assertTrue(apply_operation(doc, 'add', 'tags', 'b'))
+        self.assertTrue(apply_operation(doc, 'set', 'title', None))
+        self.assertFalse(apply_operation(doc, 'removeregex', 'tags', 'a.*'))
+        self.assertEqual(doc, {'id': '1', 'views': 3, 'tags': ['a', 'b']})
+
+    def test_last_write_wins(self):
+        writer = BufferedWriter(self.solr, commit=False)
+        original = {'id': '1', 'title': 'First'}
+
+        async def run():
+            await writer.add([original, {'id': '2', 'title': 'Other'}])
+            await writer.update_fields([{'id': '1', 'inc': {'views': 1}}])
+            await writer.add([{'id': '1', 'title': 'Second'}])
+            await writer.flush()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(self.solr.calls, [
+            ('add', [{'id': '2', 'title': 'Other'}, {'id': '1', 'title': 'Second'}], {'commit': False}),
+        ])
+        self.assertEqual((writer.received, writer.sent, writer.eliminated), (4, 2, 2))
+        self.assertEqual(original, {'id': '1', 'title': 'First'})
+
+    def test_merge(self):
+        writer = BufferedWriter(self.solr, merge=True)
+
+        async def run():
+            await writer.add([{'id': '1', 'title': 'First', 'views': 1}])
+            await writer.add([{'id': '1', 'title': 'Second'}])
+            await writer.update_fields([{'id': '1', 'inc': {'views': 2}}])
+            await writer.flush()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(self.solr.calls, [('add', [{'id': '1', 'title': 'Second', 'views': 3}], {})])
+        self.assertEqual(writer.eliminated, 2)
+
+    def test_update_folding(self):
+        writer = BufferedWriter(self.solr, max_pending=3, commit=True)
+
+        async def run():
+            for i in range(100):
+                await writer.update_fields([{'id': '1', 'inc': {'views': 1}}])
+            await writer.update_fields([
+                {'id': '1', 'add': {'tags': 'a'}},
+                {'id': '1', 'remove': {'tags': 'b'}},
+                {'id': '2', 'set': {'title': 'x'}, '_version_': 7},
+                {'id': '2', 'set': {'title': 'y'}},
+            ])
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(len(self.solr.calls), 1)
+        kind, ops, kwargs = self.solr.calls[0]
+        self.assertEqual(kind, 'update_fields')
+        self.assertEqual(ops, [
+            {'id': '1', 'inc': {'views': 100}, 'add': {'tags': 'a'}},
+            {'id': '1', 'remove': {'tags': 'b'}},
+            {'id': '2', 'set': {'title': 'x'}, '_version_': 7},
+            {'id': '2', 'set': {'title': 'y'}},
+        ])
+        self.assertEqual(kwargs, {'unique_key': 'id', 'commit': True})
+        self.assertEqual((writer.received, writer.sent, writer.eliminated), (104, 4, 100))
+
+    def test_requires_unique_key(self):
+        writer = BufferedWriter(self.solr)
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(writer.add([{'title': 'No id'}]))
+
+    def test_flush_failure(self):
+        writer = BufferedWriter(self.solr)
+
+        async def run():
+            await writer.add([{'id': '1', 'title': 'First'}])
+            await writer.update_fields([{'id': '2', 'set': {'title': 'A'}}])
+
+            # The add goes through, the updates don't.
+            self.solr.failing.add('update_fields')
+            with self.assertRaises(SolrError):
+                await writer.flush()
+
+            self.assertEqual(len(writer), 1)
+            # Still folded with what comes in later.
+            await writer.update_fields([{'id': '2', 'inc': {'views': 2}}])
+            await writer.flush()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(self.solr.calls, [
+            ('add', [{'id': '1', 'title': 'First'}], {}),
+            ('update_fields', [{'id': '2', 'set': {'title': 'A'}, 'inc': {'views': 2}}], {'unique_key': 'id'}),
+        ])
+
+    def test_flush_failure_drops_cumulative(self):
+        writer = BufferedWriter(self.solr)
+
+        async def run():
+            await writer.update_fields([{'id': '1', 'inc': {'views': 1}}])
+            await writer.add([{'id': '2'}])
+
+            # Solr may have counted the inc already: it isn't sent again,
+            # but the add that never went out is.
+            self.solr.failing.add('update_fields')
+            with self.assertRaises(SolrError):
+                await writer.flush()
+
+            self.assertEqual(len(writer), 1)
+            await writer.flush()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(self.solr.calls, [('add', [{'id': '2'}], {})])
+
+    def test_concurrent_flushes(self):
+        writer = BufferedWriter(self.solr, max_pending=1)
+        # Without waiting for the first flush, the second would overtake it.
+        self.solr.delays = [0.02, 0]
+
+        async def run():
+            await asyncio.gather(writer.add([{'id': 'a', 'v': 1}]), writer.add([{'id': 'a', 'v': 2}]))
+
+        self.loop.run_until_complete(run())
+        self.assertEqual([items for name, items, kwargs in self.solr.calls],
+                         [[{'id': 'a', 'v': 1}], [{'id': 'a', 'v': 2}]])
+
+    def test_flush_failure_keeps_everything(self):
+        writer = BufferedWriter(self.solr)
+        self.solr.failing.add('add')
+
+        async def run():
+            await writer.add([{'id': '1'}, {'id': '2'}])
+            with self.assertRaises(SolrError):
+                await writer.flush()
+            await writer.add([{'id': '3'}])
+            await writer.flush()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(self.solr.calls, [('add', [{'id': '1'}, {'id': '2'}, {'id': '3'}], {})])
+
+    def test_add_keeps_versioned_updates(self):
+        writer = BufferedWriter(self.solr)
+
+        async def run():
+            await writer.add([{'id': '1', 'title': 'First'}])
+            await writer.update_fields([{'id': '1', 'set': {'title': 'Checked'}, '_version_': 5}])
+            await writer.update_fields([{'id': '1', 'inc': {'views': 1}}])
+            await writer.add([{'id': '1', 'title': 'Second'}])
+            await writer.flush()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(self.solr.calls, [
+            ('add', [{'id': '1', 'title': 'First'}], {}),
+            ('update_fields', [{'id': '1', 'set': {'title': 'Checked'}, '_version_': 5}], {'unique_key': 'id'}),
+            ('add', [{'id': '1', 'title': 'Second'}], {}),
+        ])
+        self.assertEqual(writer.eliminated, 1)
+
@@ -0,0 +1,166 @@
+# coding: utf-8
+import os
+import hashlib
+import time
+import tempfile
+import unittest
+from aiosolr import utils
+from aiosolr.cache import DocumentCache, SharedResultsCache
+from aiosolr.result_cls import Results
+
+
+class PackTestCase(unittest.TestCase):
+
+    def test_pack(self):
+        decoded = {
+            'responseHeader': {'QTime': 3},
+            'response': {'numFound': 2, 'docs': [{'id': '1', 'price': 1.5, 'tags': ['a', 'b']}, {'id': '☃', 'ok': True}]},
+        }
+        self.assertEqual(utils.unpack(utils.pack(decoded)), decoded)
+
+        with self.assertRaises(ValueError):
+            utils.unpack(b'?nope')
+
+    def test_digest(self):
+        self.assertEqual(len(utils.digest(b'q=*:*')), 16)
+        self.assertEqual(utils.digest(b'q=*:*'), utils.digest(b'q=*:*'))
+        self.assertNotEqual(utils.digest(b'q=*:*'), utils.digest(b'q=other'))
+
+        # Pythons before 3.6 have no BLAKE2.
+        blake2b = hashlib.blake2b
+        del hashlib.blake2b
+        try:
+            self.assertEqual(utils.digest(b'q=*:*'), hashlib.sha256(b'q=*:*').digest()[:16])
+        finally:
+            hashlib.blake2b = blake2b
+
+    def test_results_to_bytes(self):
+        results = Results({'response': {'docs': [{'id': 1}], 'numFound': 10}, 'responseHeader': {'QTime': 5}})
+        restored = Results.from_bytes(results.to_bytes())
+        self.assertEqual(restored.docs, [{'id': 1}])
+        self.assertEqual(restored.hits, 10)
+        self.assertEqual(restored.qtime, 5)
+
+
+class SharedResultsCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'cache')
+        self.cache = SharedResultsCache(self.path, slots=8, slot_size=256)
+
+    def tearDown(self):
+        self.cache.close()
+        os.remove(self.path)
+        os.rmdir(os.path.dirname(self.path))
+
+    def test_get_set(self):
+        self.assertEqual(self.cache.get('q=*:*'), None)
+        self.assertTrue(self.cache.set('q=*:*', b'results'))
+        self.assertEqual(self.cache.get('q=*:*'), b'results')
+        self.assertEqual(self.cache.get('q=other'), None)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+        self.cache.set('q=*:*', b'newer')
+        self.assertEqual(self.cache.get('q=*:*'), b'newer')
+
+        self.cache.delete('q=*:*')
+        self.assertEqual(self.cache.get('q=*:*'), None)
+
+        self.cache.set('q=*:*', b'results')
+        self.cache.clear()
+        self.assertEqual(self.cache.get('q=*:*'), None)
+
+    def test_too_big(self):
+        self.assertFalse(self.cache.set('big', b'x' * 256))
+        self.assertEqual(self.cache.get('big'), None)
+
+    def test_expiry(self):
+        self.cache.set('q', b'results', ttl=-1)
+        self.assertEqual(self.cache.get('q'), None)
+
+    def test_invalidate(self):
+        other = SharedResultsCache(self.path, slots=8, slot_size=256)
+        try:
+            self.cache.set('q', b'results')
+            generation = self.cache.generation
+            other.invalidate()
+            self.assertEqual(self.cache.generation, generation + 1)
+            self.assertEqual(self.cache.get('q'), None)
+
+            # Fetched before the invalidation: not cached.
+            self.assertFalse(self.cache.set('q', b'stale', generation=generation))
+            self.assertEqual(self.cache.get('q'), None)
+            self.assertTrue(self.cache.set('q', b'fresh', generation=generation + 1))
+            self.assertEqual(other.get('q'), b'fresh')
+        finally:
+            other.close()
+
+    def test_shared(self):
+        other = SharedResultsCache(self.path, slots=8, slot_size=256)
+        try:
+            self.cache.set('q', b'from the first')
+            self.assertEqual(other.get('q'), b'from the first')
+        finally:
+            other.close()
+
+        with self.assertRaises(ValueError):
+            SharedResultsCache(self.path, slots=16, slot_size=256)
+
+
+class DocumentCacheTestCase(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = DocumentCache(maxsize=2)
+        self.assertIsNone(cache.get('1'))
+        cache.set('1', None, {'id': '1', 'title': 'One'})
+        cache.set('1', 'id', {'id': '1'})
+        self.assertEqual(cache.get('1'), {'id': '1', 'title': 'One'})
+        self.assertEqual(cache.get('1', 'id'), {'id': '1'})
+        self.assertIsNone(cache.get('1', 'title'))
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_lru(self):
+        cache = DocumentCache(maxsize=2)
+        cache.set('1', None, {'id': '1'})
+        cache.set('2', None, {'id': '2'})
+        # Touch '1' so '2' is the one evicted.
+        cache.get('1')
+        cache.set('3', None, {'id': '3'})
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('2'))
+        self.assertIsNotNone(cache.get('1'))
+
+    def test_invalidate(self):
+        cache = DocumentCache()
+        cache.set('1', None, {'id': '1'})
+        cache.set('1', 'id', {'id': '1'})
+        cache.set('2', None, {'id': '2'})
+        cache.invalidate('1')
+        self.assertIsNone(cache.get('1'))
+        self.assertIsNone(cache.get('1', 'id'))
+        self.assertEqual(len(cache), 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_stale_fetch(self):
+        cache = DocumentCache()
+        first = cache.begin_fetch()
+        cache.invalidate('1')
+        second = cache.begin_fetch()
+
+        # ``first`` started before the write, ``second`` after it.
+        self.assertFalse(cache.set('1', None, {'id': '1', 'title': 'Old'}, first))
+        self.assertTrue(cache.set('2', None, {'id': '2'}, first))
+        self.assertTrue(cache.set('1', None, {'id': '1', 'title': 'New'}, second))
+        self.assertEqual(cache.get('1'), {'id': '1', 'title': 'New'})
+
+        cache.end_fetch(first)
+        self.assertEqual(cache._invalidated, {})
+        cache.clear()
+        self.assertFalse(cache.set('2', None, {'id': '2'}, second))
+        cache.end_fetch(second)
+
+        # Nothing in flight, nothing tracked.
+        cache.invalidate('3')
+        self.assertEqual(cache._invalidated, {})
+        self.assertTrue(cache.set('3', None, {'id': '3'}, cache.begin_fetch()))
@@ -1,15 +1,26 @@
 # coding: utf-8
 import gc
+import gzip
 import json
+import shutil
+import tempfile
 import datetime
 import unittest
 import asyncio
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from xml.etree import ElementTree
-from aiosolr import Solr, SolrError
-from aiosolr.result_cls import Results
+from aiosolr import Solr, SolrError, SolrNotFoundError
+from aiosolr import utils
+from aiosolr.cache import DocumentCache, SharedResultsCache
+from aiosolr.result_cls import Group, GroupedField, Results
 from aiosolr.utils import (
-    clean_xml_string, force_bytes, force_unicode, sanitize, unescape_html)
+    atomic_updates_idempotent, build_atomic_update, build_delete_xml,
+    build_docs_xml, canonical_params, clean_xml_string, convert_docs,
+    decode_response, encode_params, escape_ids, fl_includes, force_bytes, force_unicode,
+    gzip_compress, json_dumps, params_dict, params_key, params_length,
+    parse_extract_metadata, sanitize, unescape_html)
+from benchmarks.mock_solr import MockSolr
 from aiosolr.error_extractor import (
     extract_error, make_error_msg, scrape_response)
 
@@ -21,7 +32,9 @@ class BaseAIOTestCase(unittest.TestCase):
         asyncio.set_event_loop(None)
 
     def tearDown(self):
-        self.solr.close()
+        closing = self.solr.close()
+        if asyncio.iscoroutine(closing):
+            self.loop.run_until_complete(closing)
         self.loop.close()
         self.loop = None
         gc.collect()
@@ -55,6 +68,149 @@ class UtilsTestCase(unittest.TestCase):
     def test_clean_xml_string(self):
         self.assertEqual(clean_xml_string('\x00\x0b\x0d\uffff'), '\x0d')
 
+    def test_decode_response(self):
+        body = '{"response": {"numFound": 1, "docs": [{"id": "1", "when": "2013-01-18T00:30:28Z", "tags": ["true", "false"]}]}}'
+        self.assertEqual(decode_response(body)['response']['docs'][0]['id'], '1')
+        self.assertEqual(decode_response(body, json.JSONDecoder())['response']['numFound'], 1)
+
+        doc = decode_response(body, convert=True)['response']['docs'][0]
+        self.assertEqual(doc['id'], 1)
+        self.assertEqual(doc['when'], datetime.datetime(2013, 1, 18, 0, 30, 28))
+        self.assertEqual(doc['tags'], [True, False])
+
+    def test_convert_docs(self):
+        # Nothing to convert shouldn't blow up.
+        self.assertEqual(convert_docs({}), {})
+        self.assertEqual(convert_docs({'response': None}), {'response': None})
+
+    def test_build_docs_xml(self):
+        docs_xml = build_docs_xml([
+            {'id': 'doc_1', 'title': 'Example ☃ & co', 'empty': ''},
+            {'id': 'doc_2', 'popularity': 10, 'tags': ['a', None, 'b']},
+        ], fieldUpdates={'popularity': 'inc'})
+        self.assertEqual(
+            docs_xml,
+            '<doc><field name="id">doc_1</field><field name="title">Example ☃ &amp; co</field></doc>'
+            '<doc><field name="id">doc_2</field><field name="popularity" update="inc">10</field>'
+            '<field name="tags">a</field><field name="tags">b</field></doc>')
+        self.assertEqual(build_docs_xml([]), '')
+        self.assertIn('boost="2"', build_docs_xml([{'title': 'x'}], boost={'title': 2}))
+
+    def test_gzip_compress(self):
+        body = '<add><doc><field name="id">doc_1</field></doc></add>'.encode('utf-8') * 1000
+        compressed = gzip_compress(body, chunk_size=1000)
+        self.assertTrue(len(compressed) < len(body))
+        self.assertEqual(gzip.decompress(compressed), body)
+        self.assertEqual(gzip.decompress(gzip_compress(b'')), b'')
+
+    def test_build_atomic_update(self):
+        self.assertEqual(
+            build_atomic_update({
+                'id': 'doc_1',
+                'set': {'title': 'New', 'stale': None},
+                'inc': {'popularity': 2},
+                'add': {'tags': ['a', 'b']},
+                'remove': {'tags': 'c'},
+                '_version_': 42,
+            }),
+            {
+                'id': 'doc_1',
+                'title': {'set': 'New'},
+                'stale': {'set': None},
+                'popularity': {'inc': 2},
+                'tags': {'add': ['a', 'b'], 'remove': 'c'},
+                '_version_': 42,
+            })
+        self.assertEqual(
+            build_atomic_update({'sku': 'x', 'removeregex': {'tags': 'a.*'}}, unique_key='sku'),
+            {'sku': 'x', 'tags': {'removeregex': 'a.*'}})
+
+        with self.assertRaises(ValueError):
+            build_atomic_update({'inc': {'popularity': 1}})
+        with self.assertRaises(ValueError):
+            build_atomic_update({'id': 'doc_1', 'multiply': {'popularity': 2}})
+
+    def test_fl_includes(self):
+        self.assertTrue(fl_includes('id,title', 'id'))
+        self.assertTrue(fl_includes('title id score', 'id'))
+        self.assertTrue(fl_includes('*', 'id'))
+        self.assertTrue(fl_includes('title,i*', 'id'))
+        self.assertFalse(fl_includes('title,score', 'id'))
+        self.assertFalse(fl_includes('key:id', 'id'))
+
+    def test_atomic_updates_idempotent(self):
+        self.assertTrue(atomic_updates_idempotent([
+            {'id': 'doc_1', 'title': {'set': 'A'}},
+            {'id': 'doc_2', 'tags': {'remove': 'old', 'add-distinct': 'new'}},
+        ]))
+        self.assertFalse(atomic_updates_idempotent([{'id': 'doc_1', 'popularity': {'inc': 1}}]))
+        self.assertFalse(atomic_updates_idempotent([{'id': 'doc_1', 'tags': {'add': 'x'}}]))
+        self.assertFalse(atomic_updates_idempotent([{'id': 'doc_1', 'title': {'set': 'A'}, '_version_': 1}]))
+
+        # Plain documents, with ``add()``'s fieldUpdates.
+        docs = [{'id': 'doc_1', 'popularity': 1, 'tags': ['x']}]
+        self.assertTrue(atomic_updates_idempotent(docs))
+        self.assertTrue(atomic_updates_idempotent(docs, {'tags': 'set'}))
+        self.assertFalse(atomic_updates_idempotent(docs, {'popularity': 'inc'}))
+        self.assertFalse(atomic_updates_idempotent(docs, {'tags': 'add'}))
+
+    def test_build_delete_xml(self):
+        self.assertEqual(build_delete_xml(ids=['doc_1']), '<delete><id>doc_1</id></delete>')
+        self.assertEqual(
+            build_delete_xml(ids=['a&b', 2], queries=['price:[0 TO 15] && title:<x>']),
+            '<delete><id>a&amp;b</id><id>2</id><query>price:[0 TO 15] &amp;&amp; title:&lt;x&gt;</query></delete>')
+
+    def test_parse_extract_metadata(self):
+        self.assertEqual(parse_extract_metadata(None), {})
+        self.assertEqual(
+            parse_extract_metadata(['stream_name', ['a.html'], 'title', ['A', 'B']]),
+            {'stream_name': ['a.html'], 'title': ['A', 'B']})
+
+    def test_escape_ids(self):
+        self.assertEqual(escape_ids(['doc_1', 'a,b', 'c\\d', 3]), ['doc_1', 'a\\,b', 'c\\\\d', '3'])
+
+    def test_canonical_params(self):
+        self.assertEqual(
+            canonical_params({'rows': 10, 'q': '*:*', 'fq': ['b:1', 'a:1'], 'debug': True, 'sort': None}),
+            (('debug', ('true', )), ('fq', ('b:1', 'a:1')), ('q', ('*:*', )), ('rows', ('10', ))))
+        self.assertEqual(
+            canonical_params({'fq': {'b:1', 'a:1'}, 'since': datetime.date(2013, 1, 18)}),
+            (('fq', ('a:1', 'b:1')), ('since', ('2013-01-18T00:00:00Z', ))))
+
+    def test_encode_params(self):
+        self.assertEqual(encode_params({'q': 'title:"a b"', 'fq': ['x:1', 'y:2'], 'rows': 5}),
+                         'fq=x%3A1&fq=y%3A2&q=title%3A%22a+b%22&rows=5')
+
+        params = {'q': '*:*', 'rows': 10}
+        self.assertEqual(params_key(params), params_key({'rows': '10', 'q': '*:*'}))
+        self.assertNotEqual(params_key(params), params_key({'q': '*:*', 'rows': 11}))
+        # Callers' dicts are left alone.
+        self.assertEqual(params, {'q': '*:*', 'rows': 10})
+
+    def test_encode_params_cache(self):
+        misses = utils._cached_encode_canonical_params.cache_info().misses
+        self.assertEqual(encode_params({'q': 'cached'}), 'q=cached')
+        self.assertEqual(encode_params({'q': 'cached'}), 'q=cached')
+        self.assertEqual(utils._cached_encode_canonical_params.cache_info().misses, misses + 1)
+
+        # Huge parameters are encoded every time rather than kept around.
+        ids = ','.join('doc_%d' % i for i in range(utils.MAX_CACHED_PARAMS_LENGTH))
+        currsize = utils._cached_encode_canonical_params.cache_info().currsize
+        self.assertEqual(encode_params({'ids': ids}), 'ids=' + ids.replace(',', '%2C'))
+        self.assertEqual(utils._cached_encode_canonical_params.cache_info().currsize, currsize)
+
+    def test_params_dict(self):
+        canonical = canonical_params({'q': '*:*', 'fq': ['a:1', 'b:2'], 'rows': 10})
+        self.assertEqual(params_dict(canonical), {'q': '*:*', 'fq': ['a:1', 'b:2'], 'rows': '10'})
+        self.assertEqual(params_length(canonical), len('fq=a:1&fq=b:2&q=*:*&rows=10') + 1)
+
+    def test_json_dumps(self):
+        self.assertEqual(
+            json_dumps([{'id': 'doc_1', 'when': {'set': datetime.datetime(2013, 1, 18, 0, 30, 28)}, 'title': '☃'}]),
+            '[{"id":"doc_1","when":{"set":"2013-01-18T00:30:28Z"},"title":"☃"}]')
+        with self.assertRaises(TypeError):
+            json_dumps({'id': object()})
+
 
 class ResultsTestCase(unittest.TestCase):
 
@@ -103,6 +259,51 @@ class ResultsTestCase(unittest.TestCase):
         self.assertEqual(full_results.debug, True)
         self.assertEqual(full_results.grouped, ['a'])
 
+    def test_groups(self):
+        results = Results({
+            'grouped': {
+                'manu': {
+                    'matches': 3,
+                    'ngroups': 2,
+                    'groups': [
+                        {'groupValue': 'Belkin', 'doclist': {'numFound': 2, 'start': 0, 'docs': [{'id': 1}, {'id': 2}]}},
+                        {'groupValue': None, 'doclist': {'numFound': 1, 'start': 0, 'docs': [{'id': 3}]}},
+                    ],
+                },
+                'price:[0 TO 10]': {
+                    'matches': 3,
+                    'doclist': {'numFound': 1, 'start': 0, 'docs': [{'id': 2}]},
+                },
+            },
+        })
+
+        manu = results.groups['manu']
+        self.assertTrue(isinstance(manu, GroupedField))
+        self.assertEqual((manu.matches, manu.ngroups, len(manu)), (3, 2, 2))
+        self.assertEqual([group.value for group in manu], ['Belkin', None])
+        belkin = manu.get('Belkin')
+        self.assertTrue(isinstance(belkin, Group))
+        self.assertEqual(belkin.hits, 2)
+        self.assertEqual(list(belkin), [{'id': 1}, {'id': 2}])
+        self.assertEqual(manu.get('Nope'), None)
+
+        by_price = results.groups['price:[0 TO 10]']
+        self.assertEqual((by_price.hits, by_price.docs, len(by_price)), (1, [{'id': 2}], 0))
+
+        self.assertEqual(Results({}).groups, {})
+
+    def test_expanded(self):
+        results = Results({
+            'response': {'numFound': 2, 'docs': [{'id': 1, 'sku': 'a'}, {'id': 3, 'sku': 7}, {'id': 4}]},
+            'expanded': {
+                'a': {'numFound': 1, 'start': 0, 'docs': [{'id': 2, 'sku': 'a'}]},
+                '7': {'numFound': 1, 'start': 0, 'docs': [{'id': 5, 'sku': 7}]},
+            },
+        })
+        self.assertEqual(
+            [(head['id'], [doc['id'] for doc in expanded]) for head, expanded in results.with_expanded('sku')],
+            [(1, [2]), (3, [5]), (4, [])])
+
     def test_len(self):
         small_results = Results({
             'response': {
@@ -134,6 +335,365 @@ class ResultsTestCase(unittest.TestCase):
         self.assertEqual(to_iter[2], {'id': 3})
 
 
+class SolrRequestsTestCase(BaseAIOTestCase):
+
+    """
+    Checks what the client sends, without a Solr server.
+    """
+
+    def setUp(self):
+        super(SolrRequestsTestCase, self).setUp()
+        self.solr = Solr('http://localhost:8983/solr/core0', loop=self.loop)
+        self.requests = []
+        self.response = '{"responseHeader": {"status": 0}}'
+        # Requests (counting from 0) that fail.
+        self.failing_requests = ()
+
+        async def send_request(method, path='', body=None, headers=None, files=None,
+                               idempotent=None, stream=False):
+            self.requests.append({'method': method, 'path': path, 'idempotent': idempotent, 'body': body})
+            if len(self.requests) - 1 in self.failing_requests:
+                raise SolrError('Solr is down.')
+            return self.response
+
+        self.solr._send_request = send_request
+
+    def test_update_fields_idempotent(self):
+        self.loop.run_until_complete(self.solr.update_fields([
+            {'id': 'doc_1', 'set': {'title': 'A'}},
+            {'id': 'doc_2', 'add-distinct': {'tags': 'new'}},
+        ]))
+        self.loop.run_until_complete(self.solr.update_fields([
+            {'id': 'doc_1', 'set': {'title': 'A'}},
+            {'id': 'doc_2', 'inc': {'popularity': 1}},
+        ], batch_size=1))
+        self.loop.run_until_complete(self.solr.update_fields([
+            {'id': 'doc_1', 'add': {'tags': 'x'}},
+        ]))
+        self.loop.run_until_complete(self.solr.update_fields([
+            {'id': 'doc_1', 'set': {'title': 'A'}, '_version_': 1},
+        ]))
+        self.assertEqual([request['idempotent'] for request in self.requests], [True, False, False, False, False])
+
+    def test_add_idempotent(self):
+        docs = [{'id': 'doc_1', 'popularity': 1, 'tags': 'x'}]
+        self.loop.run_until_complete(self.solr.add(docs))
+        self.loop.run_until_complete(self.solr.add(docs, fieldUpdates={'tags': 'set'}))
+        self.loop.run_until_complete(self.solr.add(docs, fieldUpdates={'popularity': 'inc'}))
+        self.loop.run_until_complete(self.solr.add(docs, fieldUpdates={'tags': 'add'}))
+        self.loop.run_until_complete(self.solr.add([dict(docs[0], _version_=1)]))
+        self.assertEqual([request['idempotent'] for request in self.requests], [True, True, False, False, False])
+
+        del self.requests[:]
+        self.solr.stream_adds = True
+        self.loop.run_until_complete(self.solr.add(docs, fieldUpdates={'popularity': 'inc'}, commit=False))
+        self.assertEqual([request['idempotent'] for request in self.requests], [False])
+
+    def test_get_fl_without_unique_key(self):
+        self.solr.doc_cache = DocumentCache()
+        self.response = json.dumps({'response': {'numFound': 2, 'docs': [
+            {'id': 'doc_2', 'title': 'Two'}, {'id': 'doc_1', 'title': 'One'}]}})
+
+        docs = self.loop.run_until_complete(self.solr.get(['doc_1', 'doc_2'], fl='title'))
+        self.assertEqual(docs, [{'title': 'One'}, {'title': 'Two'}])
+        self.assertTrue('fl=title%2Cid' in self.requests[0]['path'])
+        self.assertEqual(self.solr.doc_cache.get('doc_1', 'title'), {'title': 'One'})
+        self.assertIsNone(self.solr.doc_cache.get('None', 'title'))
+
+    def cached_docs(self, ids):
+        self.solr.doc_cache = DocumentCache()
+        for id in ids:
+            self.solr.doc_cache.set(id, None, {'id': id})
+
+    def test_update_fields_failure_invalidates(self):
+        self.cached_docs(['doc_1', 'doc_2', 'doc_3'])
+        self.failing_requests = (1, )
+
+        with self.assertRaises(SolrError):
+            self.loop.run_until_complete(self.solr.update_fields([
+                {'id': 'doc_1', 'set': {'title': 'A'}},
+                {'id': 'doc_2', 'set': {'title': 'B'}},
+                {'id': 'doc_3', 'set': {'title': 'C'}},
+            ], batch_size=1))
+
+        # The first batch went through, the second may have: neither is
+        # served from the cache any more. The third was never sent.
+        self.assertIsNone(self.solr.doc_cache.get('doc_1', None))
+        self.assertIsNone(self.solr.doc_cache.get('doc_2', None))
+        self.assertIsNotNone(self.solr.doc_cache.get('doc_3', None))
+
+    def test_delete_many_failure_invalidates(self):
+        self.cached_docs(['doc_%d' % i for i in range(4)])
+        self.failing_requests = (0, )
+
+        with self.assertRaises(SolrError):
+            self.loop.run_until_complete(self.solr.delete_many(
+                ids=['doc_%d' % i for i in range(4)], chunk_size=2, concurrency=1, commit=False))
+
+        # Only the failed request's ids were attempted; both are dropped.
+        self.assertIsNone(self.solr.doc_cache.get('doc_0', None))
+        self.assertIsNone(self.solr.doc_cache.get('doc_1', None))
+
+    def test_write_failure_invalidates(self):
+        self.cached_docs(['doc_1', 'doc_2', 'doc_3'])
+        self.failing_requests = (0, 1, 2)
+
+        with self.assertRaises(SolrError):
+            self.loop.run_until_complete(self.solr.add([{'id': 'doc_1'}]))
+
+        self.solr.stream_adds = True
+        with self.assertRaises(SolrError):
+            self.loop.run_until_complete(self.solr.add([{'id': 'doc_2'}]))
+
+        with self.assertRaises(SolrError):
+            self.loop.run_until_complete(self.solr.delete(id='doc_3'))
+
+        # A timeout, say, doesn't mean Solr didn't apply them.
+        self.assertEqual(len(self.solr.doc_cache), 0)
+
+    def test_results_cache_invalidated(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.solr.results_cache = SharedResultsCache(directory + '/cache', slots=8, slot_size=1024)
+        self.addCleanup(self.solr.results_cache.close)
+        self.response = json.dumps({'response': {'numFound': 1, 'docs': [{'id': 'doc_1', 'title': 'Old'}]}})
+
+        self.loop.run_until_complete(self.solr.search('*:*'))
+        self.loop.run_until_complete(self.solr.search('*:*'))
+        self.assertEqual(len(self.requests), 1)
+
+        # Writes through the client, failed ones included, invalidate.
+        self.failing_requests = (1, )
+        with self.assertRaises(SolrError):
+            self.loop.run_until_complete(self.solr.add([{'id': 'doc_1', 'title': 'New'}]))
+        self.response = json.dumps({'response': {'numFound': 1, 'docs': [{'id': 'doc_1', 'title': 'New'}]}})
+        results = self.loop.run_until_complete(self.solr.search('*:*'))
+        self.assertEqual(results.docs[0]['title'], 'New')
+        self.assertEqual(len(self.requests), 3)
+
+        # Results that raced a write aren't cached.
+        send_request = self.solr._send_request
+
+        async def racing_send_request(*args, **kwargs):
+            self.solr.results_cache.invalidate()
+            return await send_request(*args, **kwargs)
+
+        self.solr._send_request = racing_send_request
+        self.loop.run_until_complete(self.solr.search('title:New'))
+        self.solr._send_request = send_request
+        self.loop.run_until_complete(self.solr.search('title:New'))
+        self.assertEqual(len(self.requests), 5)
+
+    def test_get_invalidated_while_fetching(self):
+        self.solr.doc_cache = DocumentCache()
+        self.response = json.dumps({'response': {'numFound': 1, 'docs': [{'id': 'doc_1', 'title': 'Old'}]}})
+        send_request = self.solr._send_request
+
+        async def slow_send_request(*args, **kwargs):
+            response = await send_request(*args, **kwargs)
+            # A write lands while the get is in flight.
+            self.solr._invalidate_docs(['doc_1'])
+            return response
+
+        self.solr._send_request = slow_send_request
+        docs = self.loop.run_until_complete(self.solr.get(['doc_1', 'doc_2']))
+        self.assertEqual(docs, [{'id': 'doc_1', 'title': 'Old'}])
+        self.assertEqual(len(self.solr.doc_cache), 0)
+
+    def fake_extract(self, fail=()):
+        self.extracting = set()
+        self.extracted = []
+
+        async def extract(file_obj, **kwargs):
+            self.extracting.add(file_obj)
+            try:
+                # The first file is the quickest.
+                await asyncio.sleep(0.01 if file_obj == 'file_0' else 0.05)
+            finally:
+                self.extracting.discard(file_obj)
+            if file_obj in fail:
+                raise ValueError('No name for %s.' % file_obj)
+            self.extracted.append(file_obj)
+            return {'contents': 'text of %s' % file_obj, 'metadata': {}}
+
+        self.solr.extract = extract
+
+    def test_extract_many(self):
+        self.fake_extract(fail=['file_3'])
+        pulled = []
+
+        def files():
+            for i in range(20):
+                pulled.append(i)
+                yield 'file_%d' % i
+
+        async def run():
+            results = {}
+            for future in self.solr.extract_many(files(), concurrency=2, return_exceptions=True):
+                # The files are pulled as results are picked up, not all at once.
+                self.assertTrue(len(pulled) <= len(results) + 3)
+                file_obj, data = await future
+                results[file_obj] = data
+            return results
+
+        results = self.loop.run_until_complete(run())
+        self.assertEqual(len(results), 20)
+        self.assertIsInstance(results['file_3'], ValueError)
+        self.assertEqual(results['file_4']['contents'], 'text of file_4')
+
+    def test_extract_many_stopped(self):
+        self.fake_extract()
+
+        async def run():
+            results = self.solr.extract_many(['file_%d' % i for i in range(10)], concurrency=3)
+            for future in results:
+                await future
+                break
+            self.assertTrue(self.extracting)
+            results.close()
+            await asyncio.sleep(0.1)
+
+        # The extractions in flight are cancelled, the rest never started.
+        self.loop.run_until_complete(run())
+        self.assertEqual(self.extracting, set())
+        self.assertEqual(len(self.extracted), 1)
+
+    def test_extract_and_index(self):
+        self.fake_extract(fail=['file_1'])
+
+        def transform(file_obj, data):
+            return {'id': file_obj, 'text': data['contents']}
+
+        indexed, failed = self.loop.run_until_complete(
+            self.solr.extract_and_index(['file_%d' % i for i in range(3)], transform))
+        self.assertEqual((indexed, failed), (2, ['file_1']))
+
+        def broken_transform(file_obj, data):
+            raise KeyError('title')
+
+        async def run():
+            with self.assertRaises(KeyError):
+                await self.solr.extract_and_index(['file_%d' % i for i in range(10)], broken_transform)
+            await asyncio.sleep(0.1)
+
+        # Nothing keeps uploading in the background.
+        self.extracted = []
+        self.loop.run_until_complete(run())
+        self.assertEqual(self.extracting, set())
+        self.assertEqual(len(self.extracted), 1)
+
+    def test_serialize_in_executor(self):
+        docs = [{'id': 'doc_%d' % i, 'title': 'Bell \x07 %d' % i} for i in range(5)]
+        self.loop.run_until_complete(self.solr.add(docs, commit=False))
+
+        # Cleaned by the workers rather than on the loop, to the same result.
+        self.solr.serialize_threshold = 1
+        self.solr.serialize_chunk_size = 2
+        sanitize = utils.sanitize
+        cleaned = []
+
+        def recording_sanitize(data):
+            cleaned.append(len(data))
+            return sanitize(data)
+
+        utils.sanitize = recording_sanitize
+        try:
+            self.loop.run_until_complete(self.solr.add(docs, commit=False))
+        finally:
+            utils.sanitize = sanitize
+
+        self.assertEqual(self.requests[0]['body'], self.requests[1]['body'])
+        self.assertNotIn(b'\x07', self.requests[1]['body'])
+        # Three chunks and the empty attributes, never the whole body.
+        self.assertEqual(len(cleaned), 4)
+        self.assertTrue(max(cleaned) < len(self.requests[1]['body']) / 2)
+
+    def test_custom_decoder(self):
+        decoded = []
+
+        class Decoder(json.JSONDecoder):
+            def decode(self, text):
+                decoded.append(text)
+                return super(Decoder, self).decode(text)
+
+        # Assigned after the fact, and used inline as well as in an executor.
+        self.solr.decoder = Decoder()
+        self.loop.run_until_complete(self.solr.search('*:*'))
+        self.solr.decode_threshold = 0
+        self.solr.executor = executor = ThreadPoolExecutor(1)
+
+        try:
+            self.loop.run_until_complete(self.solr.search('title:test'))
+        finally:
+            executor.shutdown()
+
+        self.assertEqual(decoded, [self.response] * 2)
+
+    def test_process_pool_decoder(self):
+        executor = ProcessPoolExecutor(1)
+
+        try:
+            with self.assertRaises(ValueError):
+                Solr('http://localhost:8983/solr/core0', loop=self.loop, executor=executor,
+                     decoder=json.JSONDecoder())
+
+            # The stock decoder stays on this side; json.loads is used over there.
+            solr = Solr('http://localhost:8983/solr/core0', loop=self.loop, executor=executor)
+            self.assertIsNone(solr._response_decoder())
+            closing = solr.close()
+            if asyncio.iscoroutine(closing):
+                self.loop.run_until_complete(closing)
+        finally:
+            executor.shutdown()
+
+
+class MockSolrTestCase(BaseAIOTestCase):
+
+    """
+    Sends real requests, to ``benchmarks.mock_solr.MockSolr``.
+    """
+
+    def setUp(self):
+        super(MockSolrTestCase, self).setUp()
+        self.server = MockSolr(record=True, loop=self.loop)
+        self.loop.run_until_complete(self.server.start())
+        self.solr = Solr(self.server.url, loop=self.loop)
+
+    def tearDown(self):
+        closing = self.solr.close()
+        if asyncio.iscoroutine(closing):
+            self.loop.run_until_complete(closing)
+        self.loop.run_until_complete(self.server.stop())
+        self.loop.close()
+
+    def test_add_streaming(self):
+        self.solr.max_add_bytes = 300
+        self.solr.stream_adds = True
+        docs = [{'id': 'doc_%d' % i, 'title': 'Title ☃ %d' % i} for i in range(10)]
+        self.loop.run_until_complete(self.solr.add(docs))
+
+        paths = [path for path, body in self.server.updates]
+        self.assertTrue(len(paths) > 2)
+        self.assertEqual(set(paths[:-1]), set(['/solr/core0/update/']))
+        self.assertEqual(self.server.updates[-1], ('/solr/core0/update/?commit=true', b'<commit />'))
+
+        sent = []
+        for path, body in self.server.updates[:-1]:
+            sent.extend(doc.find("field[@name='title']").text for doc in ElementTree.fromstring(body))
+        self.assertEqual(sent, [doc['title'] for doc in docs])
+
+    def test_error_not_parsed_for_log(self):
+        with self.assertLogs('aiosolr', level='ERROR') as logs:
+            with self.assertRaises(SolrNotFoundError) as raised:
+                self.loop.run_until_complete(self.solr.search('doc', search_handler='missing'))
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertTrue("HTTP 404 to '%s/missing/" % self.server.url in logs.output[0])
+        # Left for whoever catches the error.
+        self.assertIsNone(raised.exception._details)
+        self.assertEqual(raised.exception.status, 404)
+
+
 class SolrTestCase(BaseAIOTestCase):
 
     def setUp(self):
@@ -457,6 +1017,38 @@ class SolrTestCase(BaseAIOTestCase):
         # TODO: Can't get these working in my test setup.
         # self.assertEqual(results.grouped, '')
 
+    def test_search_json(self):
+        results = self.loop.run_until_complete(self.solr.search_json({'query': 'doc', 'filter': ['price:[0 TO 15]']}))
+        self.assertEqual(len(results), 2)
+
+        results = self.loop.run_until_complete(self.solr.search_json({'query': '*:*'}, rows=1))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results.hits, 5)
+
+    def test_search_iter(self):
+        async def read_all(stream):
+            return [doc async for doc in stream]
+
+        stream = self.loop.run_until_complete(self.solr.search_iter('doc', sort='id asc', facet='on', **{'facet.field': 'popularity'}))
+        self.assertEqual(stream.hits, 3)
+        docs = self.loop.run_until_complete(read_all(stream))
+        self.assertEqual([doc['id'] for doc in docs], [doc['id'] for doc in self.loop.run_until_complete(self.solr.search('doc', sort='id asc'))])
+        self.assertTrue('facet_counts' in stream.response)
+
+        # Stopping early.
+        stream = self.loop.run_until_complete(self.solr.search_iter('*:*'))
+        stream.close()
+
+    def test_parallel_scan(self):
+        async def read_all(scan):
+            return [doc async for doc in scan]
+
+        scan = self.loop.run_until_complete(self.solr.parallel_scan('*:*', partitions=2, rows=2, fl='id'))
+        docs = self.loop.run_until_complete(read_all(scan))
+        self.assertEqual(sorted(doc['id'] for doc in docs), ['doc_1', 'doc_2', 'doc_3', 'doc_4', 'doc_5'])
+        self.assertEqual(scan.hits, 5)
+        self.assertEqual(scan.progress, 1.0)
+
     def test_multiple_search_handlers(self):
         misspelled_words = 'anthr thng'
         # By default, the 'select' search handler should be used
@@ -583,6 +1175,60 @@ class SolrTestCase(BaseAIOTestCase):
             self.assertEqual(True, all(updatedDoc[k] == originalDoc[k] for k in updatedDoc.keys()
                                        if k not in ['_version_', 'word_ss']))
 
+    def test_add_streaming(self):
+        self.solr.max_add_bytes = 200
+        self.solr.stream_adds = True
+        self.loop.run_until_complete(self.solr.add([
+            {'id': 'doc_%d' % i, 'title': 'Streamed & split <%d>' % i} for i in range(6, 11)
+        ]))
+        results = self.loop.run_until_complete(self.solr.search('title:streamed', sort='id asc', rows=10))
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results.docs[0]['title'], 'Streamed & split <10>')
+
+    def test_update_fields(self):
+        self.loop.run_until_complete(self.solr.update_fields([
+            {'id': 'doc_1', 'inc': {'popularity': 5}},
+            {'id': 'doc_2', 'set': {'popularity': 1}},
+        ], batch_size=1))
+        results = self.loop.run_until_complete(self.solr.search('id:doc_1 OR id:doc_2', sort='id asc'))
+        self.assertEqual([doc['popularity'] for doc in results], [15, 1])
+
+        # A stale ``_version_`` is rejected.
+        with self.assertRaises(SolrError):
+            self.loop.run_until_complete(self.solr.update_fields([
+                {'id': 'doc_1', 'inc': {'popularity': 1}, '_version_': 1},
+            ]))
+
+    def test_get(self):
+        docs = self.loop.run_until_complete(self.solr.get(['doc_3', 'nope', 'doc_1'], fl='id,title'))
+        self.assertEqual(docs, [
+            {'id': 'doc_3', 'title': 'Another thing'},
+            {'id': 'doc_1', 'title': 'Example doc 1'},
+        ])
+        # Chunked.
+        docs = self.loop.run_until_complete(self.solr.get(
+            ['doc_%d' % i for i in range(1, 6)], fl='id', chunk_size=2))
+        self.assertEqual([doc['id'] for doc in docs], ['doc_1', 'doc_2', 'doc_3', 'doc_4', 'doc_5'])
+        # Uncommitted docs are visible.
+        self.loop.run_until_complete(self.solr.add([{'id': 'doc_6', 'title': 'Fresh'}], commit=False))
+        docs = self.loop.run_until_complete(self.solr.get('doc_6', fl='id,title'))
+        self.assertEqual(docs, [{'id': 'doc_6', 'title': 'Fresh'}])
+
+    def test_get_doc_cache(self):
+        self.solr.doc_cache = DocumentCache()
+        self.loop.run_until_complete(self.solr.get(['doc_1', 'doc_2'], fl='id,title'))
+        self.assertEqual(len(self.solr.doc_cache), 2)
+        self.loop.run_until_complete(self.solr.get(['doc_1'], fl='id,title'))
+        self.assertEqual(self.solr.doc_cache.hits, 1)
+
+        # Writes through the same client invalidate.
+        self.loop.run_until_complete(self.solr.add([{'id': 'doc_1', 'title': 'Changed'}], commit=False))
+        self.assertEqual(len(self.solr.doc_cache), 1)
+        docs = self.loop.run_until_complete(self.solr.get(['doc_1'], fl='id,title'))
+        self.assertEqual(docs[0]['title'], 'Changed')
+        self.loop.run_until_complete(self.solr.delete(q='id:doc_2'))
+        self.assertEqual(len(self.solr.doc_cache), 0)
+
     def test_delete(self):
         self.assertEqual(
             len(self.loop.run_until_complete(self.solr.search('doc'))), 3)
@@ -606,6 +1252,22 @@ class SolrTestCase(BaseAIOTestCase):
         with self.assertRaises(ValueError):
             self.loop.run_until_complete(self.solr.delete(id='foo', q='bar'))
 
+    def test_delete_many(self):
+        self.assertEqual(
+            len(self.loop.run_until_complete(self.solr.search('*:*'))), 5)
+        responses = self.loop.run_until_complete(self.solr.delete_many(
+            ids=['doc_1', 'doc_2', 'doc_3'], queries=['price:[90 TO *]'], chunk_size=2))
+        self.assertEqual(len(responses), 3)
+        # Nothing is committed by default.
+        self.assertEqual(
+            len(self.loop.run_until_complete(self.solr.search('*:*'))), 5)
+        self.loop.run_until_complete(self.solr.commit())
+        self.assertEqual(
+            len(self.loop.run_until_complete(self.solr.search('*:*'))), 1)
+
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(self.solr.delete_many())
+
     def test_commit(self):
         self.assertEqual(
             len(self.loop.run_until_complete(self.solr.search('doc'))), 3)
@@ -688,6 +1350,56 @@ class SolrTestCase(BaseAIOTestCase):
         # round-trip:
         self.assertEqual(['Test Title ☃☃'], m['title'])
 
+    def test_extract_many(self):
+        def fake_file(name, body):
+            fake_f = BytesIO(('<html><body>%s</body></html>' % body).encode('utf-8'))
+            fake_f.name = name
+            return fake_f
+
+        files = [fake_file('test_%d.html' % i, 'body %d' % i) for i in range(5)]
+
+        async def extract_all():
+            extracted = {}
+            for future in self.solr.extract_many(files, concurrency=2):
+                file_obj, data = await future
+                extracted[file_obj.name] = data
+            return extracted
+
+        extracted = self.loop.run_until_complete(extract_all())
+        self.assertEqual(sorted(extracted), ['test_%d.html' % i for i in range(5)])
+        self.assertIn('body 3', extracted['test_3.html']['contents'])
+
+    def test_extract_and_index(self):
+        files = []
+        for i in range(3):
+            fake_f = BytesIO(('<html><head><title>Extracted %d</title></head><body>doc</body></html>' % i).encode('utf-8'))
+            fake_f.name = 'extracted_%d.html' % i
+            files.append(fake_f)
+
+        def transform(file_obj, data):
+            if file_obj.name == 'extracted_2.html':
+                return None
+            return {'id': file_obj.name, 'title': data['metadata']['title'][0]}
+
+        indexed, failed = self.loop.run_until_complete(
+            self.solr.extract_and_index(files, transform, batch_size=1))
+        self.assertEqual((indexed, failed), (2, []))
+        results = self.loop.run_until_complete(self.solr.search('id:extracted_*', sort='id asc'))
+        self.assertEqual([doc['title'] for doc in results], ['Extracted 0', 'Extracted 1'])
+
+    def test_slow_log(self):
+        self.solr.slow_threshold = 0
+        with self.assertLogs('aiosolr.slow', level='WARNING') as logs:
+            self.loop.run_until_complete(self.solr.search('doc'))
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('Slow request to', logs.output[0])
+
+        # Sampled out entirely.
+        self.solr.slow_sample_rate = 0
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('aiosolr.slow', level='WARNING'):
+                self.loop.run_until_complete(self.solr.search('doc'))
+
     def test_full_url(self):
         self.solr.url = 'http://localhost:8983/solr/core0'
         full_url = self.solr._create_full_url(path='/update')
@@ -0,0 +1,129 @@
+# coding: utf-8
+import asyncio
+import unittest
+from aiosolr import CommitScheduler, SolrError
+from aiosolr.log import LOG
+
+
+class FakeSolr(object):
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.log = LOG
+        self.calls = []
+        self.fail_commits = 0
+        self.commit_delay = 0
+
+    async def commit(self, softCommit=False):
+        await asyncio.sleep(self.commit_delay)
+        if self.fail_commits:
+            self.fail_commits -= 1
+            raise SolrError('Solr is down.')
+        self.calls.append(('commit', softCommit))
+
+    async def add(self, docs, **kwargs):
+        self.calls.append(('add', kwargs))
+
+    async def delete(self, **kwargs):
+        self.calls.append(('delete', kwargs))
+
+
+class CommitSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.solr = FakeSolr(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_coalesces_commits(self):
+        scheduler = CommitScheduler(self.solr, interval=0.05)
+
+        async def write(i):
+            await scheduler.add([{'id': i}])
+            await scheduler.wait_visible()
+
+        async def write_all():
+            await asyncio.gather(*[write(i) for i in range(20)])
+
+        self.loop.run_until_complete(write_all())
+        self.assertEqual(scheduler.writes, 20)
+        self.assertEqual(scheduler.commits, 1)
+        self.assertEqual(self.solr.calls[-1], ('commit', True))
+        self.assertEqual(self.solr.calls[0], ('add', {'commit': False}))
+
+        # Writes after a commit wait for the interval to pass.
+        async def write_again():
+            start = self.loop.time()
+            await scheduler.delete(id='doc_1')
+            await scheduler.wait_visible()
+            return self.loop.time() - start
+
+        self.assertTrue(self.loop.run_until_complete(write_again()) > 0.02)
+        self.assertEqual(scheduler.commits, 2)
+        self.loop.run_until_complete(scheduler.close())
+
+    def test_nothing_to_wait_for(self):
+        scheduler = CommitScheduler(self.solr, interval=10)
+        self.loop.run_until_complete(scheduler.wait_visible())
+        self.loop.run_until_complete(scheduler.close())
+        self.assertEqual(self.solr.calls, [])
+
+    def test_close_flushes(self):
+        scheduler = CommitScheduler(self.solr, interval=10, softCommit=False)
+        self.loop.run_until_complete(scheduler.add([{'id': 1}]))
+        self.loop.run_until_complete(scheduler.close())
+        self.assertEqual(self.solr.calls[-1], ('commit', False))
+
+    def test_close_during_commit(self):
+        self.solr.commit_delay = 0.05
+        scheduler = CommitScheduler(self.solr, interval=10)
+
+        async def write_and_close():
+            await scheduler.add([{'id': 1}])
+            waiter = self.loop.create_task(scheduler.wait_visible())
+            await asyncio.sleep(0.01)
+            # The scheduled commit is under way; close() lets it finish.
+            await scheduler.close()
+            self.assertTrue(waiter.done())
+            await waiter
+
+        self.loop.run_until_complete(write_and_close())
+        self.assertEqual(self.solr.calls, [('add', {'commit': False}), ('commit', True)])
+        self.assertEqual(scheduler.commits, 1)
+
+    def test_write_after_close(self):
+        scheduler = CommitScheduler(self.solr, interval=10)
+        self.loop.run_until_complete(scheduler.close())
+
+        async def write():
+            await scheduler.add([{'id': 1}])
+            await asyncio.wait_for(scheduler.wait_visible(), 1)
+
+        # Committed on the spot rather than waiting for a commit that
+        # will never be scheduled.
+        self.loop.run_until_complete(write())
+        self.assertEqual(self.solr.calls[-1], ('commit', True))
+        self.assertEqual(scheduler.commits, 1)
+
+    def test_failed_commit(self):
+        self.solr.fail_commits = 1
+        scheduler = CommitScheduler(self.solr, interval=0.01)
+        self.loop.run_until_complete(scheduler.add([{'id': 1}]))
+
+        with self.assertRaises(SolrError):
+            self.loop.run_until_complete(scheduler.wait_visible())
+
+        # The write is still pending and goes out with the next commit.
+        self.loop.run_until_complete(scheduler.wait_visible())
+        self.assertEqual(scheduler.commits, 1)
+        self.loop.run_until_complete(scheduler.close())
+
+    def test_commit_within(self):
+        scheduler = CommitScheduler(self.solr, interval=0.02, commitWithin=True)
+        self.loop.run_until_complete(scheduler.add([{'id': 1}]))
+        self.loop.run_until_complete(scheduler.wait_visible())
+        self.assertEqual(self.solr.calls, [('add', {'commit': False, 'commitWithin': 20})])
+        self.assertEqual(scheduler.commits, 0)
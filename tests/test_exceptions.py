@@ -0,0 +1,131 @@
+# coding: utf-8
+import asyncio
+import unittest
+from aiosolr import (
+    SolrBadRequestError, SolrConnectionError, SolrError, SolrNotFoundError,
+    SolrOverloadedError, SolrTimeoutError)
+from aiosolr.error_extractor import parse_error_body, read_error_body
+from aiosolr.exceptions import error_for_status
+
+
+class FakeContent(object):
+
+    def __init__(self, body, chunk_size):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.read_bytes = 0
+
+    async def read(self, size):
+        size = min(size, self.chunk_size)
+        chunk = self.body[self.read_bytes:self.read_bytes + size]
+        self.read_bytes += len(chunk)
+        return chunk
+
+    def at_eof(self):
+        return self.read_bytes == len(self.body)
+
+
+class FakeResponse(object):
+
+    def __init__(self, body, chunk_size=10):
+        self.content = FakeContent(body, chunk_size)
+        self.closed = False
+        self.released = False
+
+    def close(self):
+        self.closed = True
+
+    def release(self):
+        self.released = True
+
+
+class ErrorsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_error_for_status(self):
+        self.assertIs(error_for_status(400), SolrBadRequestError)
+        self.assertIs(error_for_status('404'), SolrNotFoundError)
+        self.assertIs(error_for_status(503), SolrOverloadedError)
+        self.assertIs(error_for_status(429), SolrOverloadedError)
+        self.assertIs(error_for_status(504), SolrTimeoutError)
+        self.assertIs(error_for_status(500), SolrError)
+        self.assertTrue(issubclass(SolrOverloadedError, SolrError))
+
+    def test_read_error_body(self):
+        resp = FakeResponse(b'x' * 1000)
+        body = self.loop.run_until_complete(read_error_body(resp, max_bytes=25))
+        self.assertEqual(body, b'x' * 25)
+        self.assertEqual(resp.content.read_bytes, 25)
+        self.assertTrue(resp.closed)
+        self.assertFalse(resp.released)
+
+        # Read to the end: the connection is kept for the next request.
+        for body in (b'short', b'x' * 25):
+            resp = FakeResponse(body)
+            self.assertEqual(self.loop.run_until_complete(read_error_body(resp, max_bytes=25)), body)
+            self.assertTrue(resp.released)
+            self.assertFalse(resp.closed)
+
+    def test_parse_error_body(self):
+        self.assertEqual(
+            parse_error_body({}, b'{"error": {"msg": "It happens", "code": 400}}'),
+            ('It happens', None))
+        self.assertEqual(
+            parse_error_body({}, b'{"kinda": "weird"}'),
+            (None, '{"kinda": "weird"}'))
+        self.assertEqual(
+            parse_error_body({'server': 'jetty'}, b'<html><body><pre>Something is broke.</pre></body></html>'),
+            ('Something is broke.', ''))
+
+    def test_lazy_details(self):
+        err = SolrBadRequestError(
+            'Solr responded with an error (HTTP 400)', status=400,
+            body=b'{"error": {"msg": "undefined field foo"}}')
+        self.assertIsNone(err._details)
+        self.assertEqual(err.status, 400)
+        self.assertEqual(err.reason, 'undefined field foo')
+        self.assertEqual(str(err), 'Solr responded with an error (HTTP 400): [Reason: undefined field foo]')
+
+        err = SolrOverloadedError('Solr responded with an error (HTTP 503)', status=503, reason='Busy')
+        self.assertEqual(str(err), 'Solr responded with an error (HTTP 503): [Reason: Busy]')
+
+        self.assertEqual(str(SolrError('Plain')), 'Plain')
+        self.assertEqual(SolrError('Plain').details, (None, None))
+
+    def test_metadata(self):
+        err = SolrOverloadedError(
+            'Solr responded with an error (HTTP 503)', status=503,
+            headers={'Retry-After': '3'}, body=b'{"error": {"msg": "Busy", "code": 503}}',
+            url='http://localhost:8983/solr/core0/select/?q=*%3A*', elapsed=0.25)
+        self.assertEqual(err.solr_code, 503)
+        self.assertEqual(err.retry_after, 3.0)
+        self.assertEqual(err.url, 'http://localhost:8983/solr/core0/select/?q=*%3A*')
+        self.assertEqual(err.elapsed, 0.25)
+        # Rejected outright, so safe to retry either way.
+        self.assertTrue(err.retryable)
+
+        err = SolrBadRequestError(
+            'Solr responded with an error (HTTP 400)', status=400, idempotent=True,
+            body=b'<response><lst name="error"><int name="code">400</int></lst></response>')
+        self.assertEqual(err.solr_code, 400)
+        self.assertIsNone(err.retry_after)
+        self.assertFalse(err.retryable)
+
+        self.assertTrue(SolrTimeoutError('Timed out', idempotent=True).retryable)
+        self.assertFalse(SolrTimeoutError('Timed out', idempotent=False).retryable)
+        self.assertTrue(SolrConnectionError('Refused', idempotent=True).retryable)
+        self.assertTrue(SolrError('Gateway', status=504, idempotent=True).retryable)
+        self.assertFalse(SolrError('Boom', status=500, idempotent=True).retryable)
+        self.assertIsNone(SolrError('Boom').solr_code)
+
+    def test_retry_after_date(self):
+        err = SolrError('Busy', status=503, headers={'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        self.assertEqual(err.retry_after, 0.0)
+        err = SolrError('Busy', status=503, headers={'Retry-After': 'soon'})
+        self.assertIsNone(err.retry_after)
@@ -0,0 +1,214 @@
+# coding: utf-8
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+from aiosolr import SolrBadRequestError, SolrOverloadedError
+from aiosolr.indexing_queue import IndexingQueue, estimate_doc_size
+from aiosolr.log import LOG
+
+
+class FakeSolr(object):
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.log = LOG
+        self.batches = []
+        self.down = False
+        self.calls = 0
+        # Calls (counting from 0) that fail.
+        self.failing_calls = ()
+
+    async def add(self, docs, **kwargs):
+        await asyncio.sleep(0)
+        self.calls += 1
+        if self.down or self.calls - 1 in self.failing_calls:
+            raise SolrOverloadedError('Solr is down.', status=503)
+        if any('rejected' in doc for doc in docs):
+            raise SolrBadRequestError('Unknown field.', status=400)
+        if any('bad' in doc for doc in docs):
+            raise TypeError("Can't serialize 'bad'.")
+        self.batches.append((list(docs), kwargs))
+
+
+class IndexingQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.solr = FakeSolr(self.loop)
+        self.spill_path = os.path.join(tempfile.mkdtemp(), 'spill.jsonl')
+
+    def tearDown(self):
+        if os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+        os.rmdir(os.path.dirname(self.spill_path))
+        self.loop.close()
+
+    def test_estimate_doc_size(self):
+        self.assertEqual(estimate_doc_size({'id': 'abc', 'tags': ['x', 'yz'], 'n': 1}), 2 + 3 + 4 + 3 + 1 + 16)
+
+    def test_batches(self):
+        queue = IndexingQueue(self.solr, batch_size=3, flush_interval=0.01, commit=False)
+
+        async def run():
+            await queue.start()
+            for i in range(7):
+                await queue.put({'id': str(i)})
+            await queue.close()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual([len(docs) for docs, kwargs in self.solr.batches], [3, 3, 1])
+        self.assertEqual(self.solr.batches[0][1], {'commit': False})
+        self.assertEqual(queue.sent, 7)
+        self.assertEqual(queue.pending_bytes, 0)
+
+    def test_backpressure(self):
+        queue = IndexingQueue(self.solr, batch_size=10, max_bytes=10, flush_interval=0.01)
+        queue.put_nowait({'id': '1234'})
+
+        with self.assertRaises(asyncio.QueueFull):
+            queue.put_nowait({'id': '5678'})
+
+        async def run():
+            await queue.start()
+            # Waits for the first doc to be sent instead of failing.
+            await queue.put({'id': '5678'})
+            await queue.close()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(queue.sent, 2)
+
+    def test_spill_and_replay(self):
+        self.solr.down = True
+        queue = IndexingQueue(self.solr, batch_size=2, flush_interval=0.01,
+                              spill_path=self.spill_path, retry_interval=60)
+
+        async def run(queue, count):
+            await queue.start()
+            for i in range(count):
+                await queue.put({'id': str(i)})
+            await queue.close()
+
+        self.loop.run_until_complete(run(queue, 3))
+        self.assertEqual(queue.spilled, 3)
+        with open(self.spill_path) as spill_file:
+            self.assertEqual([json.loads(line)['id'] for line in spill_file], ['0', '1', '2'])
+
+        # A new queue replays the spill before anything else.
+        self.solr.down = False
+        queue = IndexingQueue(self.solr, batch_size=2, flush_interval=0.01, spill_path=self.spill_path)
+        self.loop.run_until_complete(run(queue, 0))
+        self.assertEqual(queue.replayed, 3)
+        self.assertFalse(os.path.exists(self.spill_path))
+        self.assertEqual([doc['id'] for docs, kwargs in self.solr.batches for doc in docs], ['0', '1', '2'])
+
+    def test_replay_resumes(self):
+        with open(self.spill_path, 'w') as spill_file:
+            spill_file.write(''.join(json.dumps({'id': str(i)}) + '\n' for i in range(5)))
+
+        # The second batch of the replay fails; the retry starts there.
+        self.solr.failing_calls = (1, )
+        queue = IndexingQueue(self.solr, batch_size=2, flush_interval=0.01,
+                              spill_path=self.spill_path, retry_interval=0.01)
+
+        async def run():
+            await queue.start()
+            while os.path.exists(self.spill_path):
+                await asyncio.sleep(0.01)
+            await queue.close()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual([[doc['id'] for doc in docs] for docs, kwargs in self.solr.batches], [['0', '1'], ['2', '3'], ['4']])
+        self.assertEqual(queue.replayed, 5)
+
+    def test_unexpected_error(self):
+        queue = IndexingQueue(self.solr, batch_size=2, flush_interval=0.01)
+
+        async def run():
+            await queue.start()
+            for doc in ({'id': '1'}, {'id': '2', 'bad': object()}, {'id': '3'}):
+                await queue.put(doc)
+            await queue.flush()
+            await queue.put({'id': '4'})
+            await queue.close()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(queue.failed, 2)
+        self.assertEqual(queue.sent, 2)
+        self.assertEqual([doc['id'] for docs, kwargs in self.solr.batches for doc in docs], ['3', '4'])
+
+    def test_rejected(self):
+        queue = IndexingQueue(self.solr, batch_size=2, flush_interval=0.01)
+
+        async def run():
+            await queue.start()
+            for doc in ({'id': '1'}, {'id': '2', 'rejected': 1}, {'id': '3'}):
+                await queue.put(doc)
+            await queue.close()
+
+        # Dropped rather than retried forever.
+        self.loop.run_until_complete(run())
+        self.assertEqual(queue.failed, 2)
+        self.assertEqual([doc['id'] for docs, kwargs in self.solr.batches for doc in docs], ['3'])
+
+    def test_rejected_spill(self):
+        with open(self.spill_path, 'w') as spill_file:
+            spill_file.write(''.join(json.dumps(doc) + '\n' for doc in (
+                {'id': '1'}, {'id': '2', 'rejected': 1}, {'id': '3'}, {'id': '4'})))
+
+        queue = IndexingQueue(self.solr, batch_size=2, flush_interval=0.01, spill_path=self.spill_path)
+
+        async def run():
+            await queue.start()
+            await queue.put({'id': '5'})
+            await queue.close()
+
+        # The rejected batch is skipped; what's behind it still goes through.
+        self.loop.run_until_complete(run())
+        self.assertEqual(queue.failed, 2)
+        self.assertEqual(queue.replayed, 2)
+        self.assertEqual([doc['id'] for docs, kwargs in self.solr.batches for doc in docs], ['3', '4', '5'])
+        self.assertFalse(os.path.exists(self.spill_path))
+
+    def test_spill_fails(self):
+        self.solr.failing_calls = (0, )
+        spill_path = os.path.join(self.spill_path, 'missing', 'spill.jsonl')
+        queue = IndexingQueue(self.solr, batch_size=2, flush_interval=0.01,
+                              spill_path=spill_path, retry_interval=0.01)
+
+        async def run():
+            await queue.start()
+            await queue.put({'id': '1'})
+            await queue.close()
+
+        # Kept in memory and retried instead.
+        self.loop.run_until_complete(run())
+        self.assertEqual(queue.spilled, 0)
+        self.assertEqual(queue.sent, 1)
+
+    def test_unreadable_spill_line(self):
+        with open(self.spill_path, 'w') as spill_file:
+            spill_file.write('{"id": "1"}\n{"id": \n{"id": "2"}\n')
+
+        queue = IndexingQueue(self.solr, batch_size=5, flush_interval=0.01, spill_path=self.spill_path)
+
+        async def run():
+            await queue.start()
+            await queue.close()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual([doc['id'] for docs, kwargs in self.solr.batches for doc in docs], ['1', '2'])
+        self.assertEqual(queue.failed, 1)
+        self.assertFalse(os.path.exists(self.spill_path))
+
+    def test_close_without_start(self):
+        queue = IndexingQueue(self.solr, flush_interval=0.01)
+        queue.put_nowait({'id': '1'})
+        self.loop.run_until_complete(queue.close())
+        self.assertEqual(queue.sent, 1)
+
+        # Nothing queued: nothing to do.
+        self.loop.run_until_complete(IndexingQueue(self.solr).close())
+
@@ -0,0 +1,186 @@
+# coding: utf-8
+import json
+import asyncio
+import unittest
+from aiosolr import SolrTimeoutError
+from aiosolr.json_stream import DocsParser, ResultsStream
+
+
+RESPONSE = {
+    'responseHeader': {'status': 0, 'QTime': 7, 'params': {'q': 'title:"docs":[ \\ "x"', 'wt': 'json'}},
+    'response': {'numFound': 1234, 'start': 0, 'docs': [
+        {'id': 'doc_%d' % i, 'title': 'Title ☃ %d with "quotes", [brackets] & {braces}' % i,
+         'path': 'C:\\docs\\ "%d" \\' % i, 'tags': ['a', 'b'], 'price': i * 1.5, 'nested': {'docs': [1, 2]}}
+        for i in range(50)
+    ]},
+    'facet_counts': {'facet_fields': {'tags': ['a', 50, 'b', 50]}},
+    'highlighting': {'doc_1': {'title': ['<em>Title</em>']}},
+}
+
+
+def without_docs(response):
+    response = json.loads(json.dumps(response))
+    response['response']['docs'] = []
+    return response
+
+
+class FakeContent(object):
+
+    def __init__(self, body):
+        self.body = body
+        self.position = 0
+        # Stalls for good once this much has been read.
+        self.stall_at = None
+
+    async def read(self, size):
+        if self.stall_at is not None and self.position >= self.stall_at:
+            await asyncio.sleep(3600)
+        chunk = self.body[self.position:self.position + size]
+        self.position += len(chunk)
+        return chunk
+
+
+class FakeResponse(object):
+
+    def __init__(self, body):
+        self.content = FakeContent(body)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class DocsParserTestCase(unittest.TestCase):
+
+    def parse(self, text, size):
+        parser = DocsParser()
+        docs = []
+        for start in range(0, len(text), size):
+            docs.extend(parser.feed(text[start:start + size]))
+        parser.close()
+        return parser, docs
+
+    def test_chunk_sizes(self):
+        for indent in (None, 2):
+            text = json.dumps(RESPONSE, indent=indent, ensure_ascii=False)
+
+            for size in (1, 7, 100, 4096, len(text)):
+                parser, docs = self.parse(text, size)
+                self.assertEqual(docs, RESPONSE['response']['docs'])
+                self.assertEqual(parser.response, without_docs(RESPONSE))
+                self.assertEqual(parser.header['response']['numFound'], 1234)
+                self.assertEqual(parser.header['responseHeader']['params'], RESPONSE['responseHeader']['params'])
+
+    def test_large_doc(self):
+        decoded = []
+
+        class Decoder(json.JSONDecoder):
+            def decode(self, text):
+                decoded.append(len(text))
+                return super().decode(text)
+
+        doc = {'id': 'big', 'body': 'x}"\\' * 50000, 'parts': [{'n': i} for i in range(5000)]}
+        text = json.dumps({'response': {'numFound': 1, 'docs': [doc, {'id': 'small'}]}})
+        parser = DocsParser(decoder=Decoder())
+        docs = []
+
+        for start in range(0, len(text), 1000):
+            docs.extend(parser.feed(text[start:start + 1000]))
+        parser.close()
+
+        self.assertEqual(docs, [doc, {'id': 'small'}])
+        # The big document is decoded once, whole; the small one straight
+        # from its piece.
+        self.assertEqual(decoded, [len(json.dumps(doc))])
+
+    def test_decode_only_decoder(self):
+        class Decoder(object):
+            def decode(self, text):
+                return dict(json.loads(text), decoded=True)
+
+        text = json.dumps(RESPONSE)
+        parser = DocsParser(decoder=Decoder())
+        docs = []
+        for start in range(0, len(text), 100):
+            docs.extend(parser.feed(text[start:start + 100]))
+        parser.close()
+
+        self.assertEqual(len(docs), 50)
+        self.assertTrue(all(doc.pop('decoded') for doc in docs))
+        self.assertEqual(docs, RESPONSE['response']['docs'])
+
+    def test_header_early(self):
+        text = json.dumps(RESPONSE)
+        parser = DocsParser()
+        docs = parser.feed(text[:text.index('doc_3')])
+        self.assertEqual(parser.header['response'], {'numFound': 1234, 'start': 0, 'docs': []})
+        self.assertEqual([doc['id'] for doc in docs], ['doc_0', 'doc_1', 'doc_2'])
+        self.assertIsNone(parser.response)
+
+    def test_no_docs(self):
+        grouped = {'responseHeader': {'QTime': 1}, 'grouped': {'type': {'matches': 2, 'groups': []}}}
+        parser, docs = self.parse(json.dumps(grouped), 5)
+        self.assertEqual(docs, [])
+        self.assertEqual(parser.response, grouped)
+
+        empty = {'responseHeader': {'QTime': 1}, 'response': {'numFound': 0, 'docs': []}}
+        parser, docs = self.parse(json.dumps(empty), 3)
+        self.assertEqual(docs, [])
+        self.assertEqual(parser.response, empty)
+
+    def test_truncated(self):
+        text = json.dumps(RESPONSE)
+        parser = DocsParser()
+        parser.feed(text[:len(text) // 2])
+        with self.assertRaises(ValueError):
+            parser.close()
+
+
+class ResultsStreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_stream(self):
+        resp = FakeResponse(json.dumps(RESPONSE, ensure_ascii=False).encode('utf-8'))
+        # Small chunks split the snowmen's UTF-8 bytes.
+        stream = ResultsStream(resp, chunk_size=5)
+
+        async def read_all():
+            await stream.start()
+            self.assertEqual(stream.hits, 1234)
+            self.assertEqual(stream.qtime, 7)
+            return [doc async for doc in stream]
+
+        docs = self.loop.run_until_complete(read_all())
+        self.assertEqual(docs, RESPONSE['response']['docs'])
+        self.assertEqual(stream.response['facet_counts'], RESPONSE['facet_counts'])
+        self.assertTrue(resp.closed)
+
+    def test_stalled(self):
+        resp = FakeResponse(json.dumps(RESPONSE).encode('utf-8'))
+        resp.content.stall_at = 1000
+        stream = ResultsStream(resp, chunk_size=100, timeout=0.05)
+
+        async def read_all():
+            await stream.start()
+            return [doc async for doc in stream]
+
+        with self.assertRaises(SolrTimeoutError) as raised:
+            self.loop.run_until_complete(read_all())
+        self.assertTrue(raised.exception.retryable)
+        self.assertTrue(resp.closed)
+
+    def test_convert(self):
+        body = {'response': {'numFound': 1, 'docs': [{'id': 'doc_1', 'ok': 'true', 'n': '5'}]}}
+        stream = ResultsStream(FakeResponse(json.dumps(body).encode('utf-8')), convert=True)
+
+        async def read_all():
+            await stream.start()
+            return [doc async for doc in stream]
+
+        self.assertEqual(self.loop.run_until_complete(read_all()), [{'id': 'doc_1', 'ok': True, 'n': 5}])
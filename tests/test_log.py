@@ -0,0 +1,27 @@
+# coding: utf-8
+import logging
+import unittest
+from aiosolr.log import LOG, BodyPreview
+
+
+class Unrepresentable(object):
+
+    def __repr__(self):
+        raise AssertionError('Formatted a body nobody logs.')
+
+
+class BodyPreviewTestCase(unittest.TestCase):
+
+    def test_preview(self):
+        self.assertEqual(str(BodyPreview(None)), '')
+        self.assertEqual(str(BodyPreview('<add><doc>...</doc></add>')), '<add><doc>')
+        self.assertEqual(str(BodyPreview('<add><doc>', length=4)), '<add')
+        self.assertEqual(str(BodyPreview(b'\x1f\x8b\x08\x00rest', length=4)), "b'\\x1f\\x8b\\x08\\x00'")
+        self.assertEqual(str(BodyPreview({'extractOnly': 'true'}, length=6)), "{'extr")
+
+    def test_lazy(self):
+        level = LOG.level
+        LOG.setLevel(logging.WARNING)
+        self.addCleanup(LOG.setLevel, level)
+        # Not formatted, so never repr'd.
+        LOG.debug("Body '%s'", BodyPreview(Unrepresentable()))
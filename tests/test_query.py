@@ -0,0 +1,55 @@
+# coding: utf-8
+import datetime
+import unittest
+from aiosolr.query import (
+    And, LocalParams, Not, Or, Pattern, Phrase, Query, Range, Raw, Template,
+    Term, Terms, escape, phrase)
+
+
+class QueryTestCase(unittest.TestCase):
+
+    def test_escape(self):
+        self.assertEqual(escape('a+b (c) && d:e'), 'a\\+b\\ \\(c\\)\\ \\&\\&\\ d\\:e')
+        self.assertEqual(escape(True), 'true')
+        self.assertEqual(escape(datetime.date(2013, 1, 18)), '2013\\-01\\-18T00\\:00\\:00Z')
+        self.assertEqual(phrase('say "hi" \\o/'), '"say \\"hi\\" \\\\o/"')
+
+    def test_clauses(self):
+        self.assertEqual(str(Term('id', 'doc:1')), 'id:doc\\:1')
+        self.assertEqual(str(Phrase('title', 'banana split')), 'title:"banana split"')
+        self.assertEqual(str(Range('price', 0, 10)), 'price:[0 TO 10]')
+        self.assertEqual(str(Range('price', None, 10, include_end=False)), 'price:[* TO 10}')
+        self.assertEqual(
+            str(And(Term('a', 1), Or(Term('b', 2), 'c:3'), Not(Term('d', 4)))),
+            '(a:1 AND (b:2 OR c:3) AND -d:4)')
+        self.assertEqual(str(And(Raw('*:*'))), '*:*')
+        self.assertEqual(str(LocalParams('terms', 'a,b', f='id')), '{!terms f=id}a,b')
+        self.assertEqual(str(LocalParams(cache='false', cost=150)), '{!cache=false cost=150}')
+        self.assertEqual(str(LocalParams('lucene', df='my field')), "{!lucene df='my field'}")
+
+    def test_terms(self):
+        self.assertEqual(str(Terms('id', ['a', 'b', 3])), '{!terms f=id}a,b,3')
+        self.assertEqual(str(Terms('id', ['a,1', 'b'], method='booleanQuery')),
+                         '{!terms f=id method=booleanQuery separator=|}a,1|b')
+        self.assertEqual(str(Terms('id', [])), '{!terms f=id}')
+
+    def test_query(self):
+        query = Query(Term('title', 'a b'), fq=[Range('price', 1, 2)], rows=5)
+        self.assertEqual(query.to_params(), {'q': 'title:a\\ b', 'fq': ['price:[1 TO 2]'], 'rows': 5})
+        self.assertEqual(query.to_json(), {'query': 'title:a\\ b', 'filter': ['price:[1 TO 2]'], 'params': {'rows': 5}})
+        self.assertEqual(Query().to_json(), {'query': '*:*'})
+
+    def test_template(self):
+        pattern = Pattern('title:{title:phrase} AND id:{id} AND price:{* TO {max:raw}} {!v=$qq}')
+        self.assertEqual(pattern.names, set(['title', 'id', 'max']))
+        self.assertEqual(
+            pattern.bind({'title': 'a "b"', 'id': 'x:y', 'max': 10}),
+            'title:"a \\"b\\"" AND id:x\\:y AND price:{* TO 10} {!v=$qq}')
+
+        with self.assertRaises(ValueError):
+            pattern.bind({'title': 'a'})
+
+        template = Template('type:{type}', fq=['lang:{lang}'], rows=10)
+        self.assertEqual(
+            template.bind(type='book', lang='en').to_params(),
+            {'q': 'type:book', 'fq': ['lang:en'], 'rows': 10})
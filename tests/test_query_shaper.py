@@ -0,0 +1,56 @@
+# coding: utf-8
+import unittest
+from aiosolr.query_shaper import QueryShaper, split_conjunction, tokenize
+
+
+class QueryShaperTestCase(unittest.TestCase):
+
+    def test_tokenize(self):
+        self.assertEqual(
+            tokenize('title:"a b" AND price:[1 TO 5} (x OR y) id:a\\ b'),
+            ['title:"a b"', 'AND', 'price:[1 TO 5}', '(x OR y)', 'id:a\\ b'])
+        self.assertEqual(tokenize('title:"unbalanced'), None)
+        self.assertEqual(tokenize('(a'), None)
+
+    def test_split_conjunction(self):
+        self.assertEqual(split_conjunction('a:1 AND b:2 && NOT c:3'), ['a:1', 'b:2', '-c:3'])
+        self.assertEqual(split_conjunction('+a:1 +b:2 -c:3'), ['+a:1', '+b:2', '-c:3'])
+        self.assertEqual(split_conjunction('a:1 b:2', default_and=True), ['a:1', 'b:2'])
+        self.assertEqual(split_conjunction('a:1'), ['a:1'])
+        # Not plain conjunctions.
+        self.assertEqual(split_conjunction('a:1 b:2'), None)
+        self.assertEqual(split_conjunction('a:1 AND b:2 OR c:3'), None)
+        self.assertEqual(split_conjunction('a:1 AND'), None)
+        self.assertEqual(split_conjunction(''), None)
+
+    def test_shape(self):
+        shaper = QueryShaper(filter_fields=['type', 'status', 'geo'], uncached_fields={'geo': 200})
+        params = {'q': 'title:bananas AND type:fruit AND NOT status:deleted', 'fq': 'lang:en', 'rows': 10}
+        self.assertEqual(shaper.shape(params), {
+            'q': 'title:bananas',
+            'fq': ['lang:en', 'type:fruit', '-status:deleted'],
+            'rows': 10,
+        })
+        # The caller's params are left alone.
+        self.assertEqual(params['q'], 'title:bananas AND type:fruit AND NOT status:deleted')
+
+        self.assertEqual(
+            shaper.shape({'q': '+type:fruit +geo:[1 TO 2]'}),
+            {'q': '*:*', 'fq': ['type:fruit', '{!cache=false cost=200}geo:[1 TO 2]']})
+        self.assertEqual(
+            shaper.shape({'q': 'type:fruit title:x', 'q.op': 'AND'}),
+            {'q': 'title:x', 'q.op': 'AND', 'fq': ['type:fruit']})
+
+        # Left alone.
+        for params in ({'q': 'type:fruit OR title:x'}, {'q': 'type:fruit title:x'},
+                       {'q': '{!edismax}type:fruit AND x'}, {'q': 'type:fruit AND x', 'defType': 'edismax'}):
+            self.assertEqual(shaper.shape(params), params)
+
+        self.assertEqual(shaper.shapes['type:fruit'], 3)
+        self.assertEqual(shaper.shapes['lang:en'], 1)
+
+    def test_max_tracked(self):
+        shaper = QueryShaper(max_tracked=1)
+        shaper.shape({'q': '*:*', 'fq': ['a:1', 'b:1']})
+        shaper.shape({'q': '*:*', 'fq': ['a:1']})
+        self.assertEqual(dict(shaper.shapes), {'a:1': 2})
@@ -0,0 +1,216 @@
+# coding: utf-8
+import asyncio
+import unittest
+from aiosolr import SolrError, SolrOverloadedError, SolrTimeoutError
+from aiosolr.scan import ParallelScan, range_bounds, range_filters, with_tiebreak
+from aiosolr.log import LOG
+
+
+class FakeStream(object):
+
+    def __init__(self, docs, hits, next_cursor):
+        self.docs = list(docs)
+        self.hits = hits
+        self.response = None
+        self.next_cursor = next_cursor
+        self.closed = False
+        # Times out after handing out this many docs.
+        self.fail_after = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        if self.fail_after is not None:
+            if not self.fail_after:
+                raise SolrTimeoutError('Timed out reading the response.', idempotent=True)
+            self.fail_after -= 1
+        if not self.docs:
+            self.response = {'response': {'numFound': self.hits, 'docs': []}, 'nextCursorMark': self.next_cursor}
+            raise StopAsyncIteration()
+        return self.docs.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeResults(object):
+
+    def __init__(self, stats):
+        self.stats = stats
+
+
+class FakeSolr(object):
+
+    """
+    Holds ``count`` docs with ids ``0..count-1``; the ``{!hash}`` filter
+    splits them by id modulo the number of workers.
+    """
+
+    unique_key = 'id'
+
+    def __init__(self, loop, count=25, fail_worker=None):
+        self.loop = loop
+        self.log = LOG
+        self.count = count
+        self.fail_worker = fail_worker
+        self.requests = []
+        self.streams = []
+        # Request index: ``None`` to fail it outright, or how many docs it
+        # hands out before timing out.
+        self.failures = {}
+
+    def _matches(self, params):
+        ids = range(self.count)
+
+        for fq in params.get('fq', []):
+            if fq.startswith('{!hash'):
+                workers, worker = [int(bit.split('=')[1]) for bit in fq[7:-1].split()]
+                if worker == self.fail_worker:
+                    raise SolrError('Worker %d is down.' % worker)
+                ids = [i for i in ids if i % workers == worker]
+            elif fq.startswith('n:['):
+                low, high = fq[3:-1].split(' TO ')
+                ids = [i for i in ids if int(low) <= i and (i <= int(high) if fq.endswith(']') else i < int(high))]
+
+        return [{'id': i} for i in ids]
+
+    async def search_iter(self, q, **params):
+        self.requests.append(params)
+        failure = self.failures.get(len(self.requests) - 1, -1)
+        if failure is None:
+            raise SolrOverloadedError('Solr is overloaded.', status=503)
+        docs = self._matches(params)
+
+        if params.get('search_handler') == 'export':
+            stream = FakeStream(docs, len(docs), None)
+        else:
+            start = 0 if params['cursorMark'] == '*' else int(params['cursorMark'])
+            page = docs[start:start + params['rows']]
+            stream = FakeStream(page, len(docs), str(start + len(page)))
+
+        if failure >= 0:
+            stream.fail_after = failure
+        self.streams.append(stream)
+        return stream
+
+    async def search(self, q, **params):
+        self.requests.append(params)
+        return FakeResults({'stats_fields': {'n': {'min': 0.0, 'max': float(self.count - 1)}}})
+
+
+class ParallelScanTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.solr = FakeSolr(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def scan_all(self, scan):
+        async def run():
+            await scan.start()
+            return [doc async for doc in scan]
+
+        return self.loop.run_until_complete(run())
+
+    def test_helpers(self):
+        self.assertEqual(range_bounds(0, 9, 4), [0, 2, 5, 7, 9])
+        self.assertEqual(range_bounds(0.0, 1.5, 3), [0.0, 0.5, 1.0, 1.5])
+        self.assertEqual(range_filters('n', [0, 5, 10]), ['n:[0 TO 5}', 'n:[5 TO 10]'])
+        self.assertEqual(with_tiebreak(None, 'id'), 'id asc')
+        self.assertEqual(with_tiebreak('price desc', 'id'), 'price desc,id asc')
+        self.assertEqual(with_tiebreak('price desc, id desc', 'id'), 'price desc, id desc')
+
+    def test_hash(self):
+        scan = ParallelScan(self.solr, '*:*', partitions=3, rows=4, fq='type:doc', fl='id')
+        docs = self.scan_all(scan)
+
+        self.assertEqual(sorted(doc['id'] for doc in docs), list(range(25)))
+        self.assertEqual([partition.hits for partition in scan.partitions], [9, 8, 8])
+        self.assertEqual([partition.requests for partition in scan.partitions], [4, 3, 3])
+        self.assertEqual(scan.docs, 25)
+        self.assertEqual(scan.hits, 25)
+        self.assertEqual(scan.progress, 1.0)
+        self.assertTrue(all(stream.closed for stream in self.solr.streams))
+
+        params = self.solr.requests[0]
+        self.assertEqual(params['fq'], ['type:doc', '{!hash workers=3 worker=0}'])
+        self.assertEqual(params['partitionKeys'], 'id')
+        self.assertEqual(params['sort'], 'id asc')
+        self.assertEqual(params['fl'], 'id')
+        self.assertEqual(params['cursorMark'], '*')
+
+    def test_range(self):
+        scan = ParallelScan(self.solr, partitions=2, field='n', method='range', rows=100)
+        docs = self.scan_all(scan)
+        self.assertEqual(sorted(doc['id'] for doc in docs), list(range(25)))
+        self.assertEqual(self.solr.requests[0], {'rows': 0, 'stats': 'true', 'stats.field': 'n'})
+        self.assertEqual([partition.params['fq'] for partition in scan.partitions], [['n:[0 TO 12}'], ['n:[12 TO 24]']])
+
+        scan = ParallelScan(self.solr, partitions=2, field='n', method='range', bounds=[0, 20, 30])
+        self.assertEqual(len(self.scan_all(scan)), 25)
+        self.assertEqual([partition.hits for partition in scan.partitions], [20, 5])
+
+    def test_export_and_replicas(self):
+        replica = FakeSolr(self.loop)
+        scan = ParallelScan(self.solr, partitions=4, replicas=[replica], export=True, fl='id')
+        self.assertEqual(len(self.scan_all(scan)), 25)
+        self.assertEqual(len(self.solr.requests), 2)
+        self.assertEqual(len(replica.requests), 2)
+        self.assertEqual(replica.requests[0]['search_handler'], 'export')
+
+    def test_shard(self):
+        with self.assertRaises(ValueError):
+            ParallelScan(self.solr, method='shard')
+
+        scan = ParallelScan(self.solr, method='shard', shards=['shard1', 'shard2'])
+        self.assertEqual(len(self.scan_all(scan)), 50)
+        # The second request of each partition confirms the cursor is done.
+        self.assertEqual(sorted(params['shards'] for params in self.solr.requests), ['shard1', 'shard1', 'shard2', 'shard2'])
+
+    def test_error(self):
+        self.solr.fail_worker = 1
+        scan = ParallelScan(self.solr, partitions=2)
+
+        with self.assertRaises(SolrError):
+            self.scan_all(scan)
+
+        self.assertIsInstance(scan.partitions[1].error, SolrError)
+        self.assertFalse(scan.partitions[1].done)
+
+    def test_retries(self):
+        # The second page fails outright, then halfway through.
+        self.solr.failures = {1: None, 2: 2}
+        scan = ParallelScan(self.solr, partitions=1, rows=4, retry_delay=0)
+        docs = self.scan_all(scan)
+
+        self.assertEqual(sorted(doc['id'] for doc in docs), list(range(25)))
+        self.assertEqual(scan.partitions[0].retries, 2)
+        self.assertEqual([params['cursorMark'] for params in self.solr.requests[:4]], ['*', '4', '4', '4'])
+
+    def test_retries_exhausted(self):
+        self.solr.failures = dict((i, None) for i in range(1, 10))
+        scan = ParallelScan(self.solr, partitions=1, rows=4, retries=2, retry_delay=0)
+
+        with self.assertRaises(SolrOverloadedError):
+            self.scan_all(scan)
+
+        self.assertEqual(len(self.solr.requests), 4)
+        self.assertEqual(scan.partitions[0].retries, 2)
+
+    def test_close(self):
+        scan = ParallelScan(self.solr, partitions=2, rows=2, queue_size=1)
+
+        async def run():
+            await scan.start()
+            doc = await scan.__anext__()
+            await scan.close()
+            return doc
+
+        self.assertTrue('id' in self.loop.run_until_complete(run()))
+        self.assertTrue(all(stream.closed for stream in self.solr.streams))
+        self.assertFalse(any(partition.done for partition in scan.partitions))
@@ -0,0 +1,148 @@
+# coding: utf-8
+import os
+import mmap
+import asyncio
+import datetime
+import tempfile
+import unittest
+from io import BytesIO
+from xml.etree import ElementTree
+from aiosolr.streams import FileReader, XMLAddStream, _generator_body
+from aiosolr.utils import build_docs_xml, iter_doc_xml
+
+
+class FileReaderTestCase(unittest.TestCase):
+
+    def test_bytes_io(self):
+        reader = FileReader(BytesIO(b'0123456789'))
+        self.assertTrue(reader.readable())
+        self.assertEqual([reader.read(4), reader.read(4), reader.read(4), reader.read(4)], [b'0123', b'4567', b'89', b''])
+        self.assertEqual(reader.bytes_read, 10)
+
+    def test_mmap(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        data = os.urandom(100 * 1024)
+
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+
+        with open(path, 'rb') as tmp:
+            mapped = mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                reader = FileReader(mapped)
+                chunks = list(iter(lambda: reader.read(32 * 1024), b''))
+                self.assertEqual(reader.read(), b'')
+            finally:
+                mapped.close()
+
+        self.assertEqual([len(chunk) for chunk in chunks], [32768, 32768, 32768, 4096])
+        self.assertEqual(b''.join(chunks), data)
+
+    def test_empty(self):
+        self.assertEqual(FileReader(BytesIO()).read(), b'')
+
+
+class XMLAddStreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def bodies(self, docs, max_bytes=None, buffer_size=64 * 1024):
+        async def send_all():
+            bodies = []
+            remaining = iter(docs)
+            for first in remaining:
+                stream = XMLAddStream(first, remaining, iter_doc_xml, max_bytes=max_bytes,
+                                      buffer_size=buffer_size)
+                bodies.append(b''.join([chunk async for chunk in stream]))
+            return bodies
+        return self.loop.run_until_complete(send_all())
+
+    def test_matches_build_docs_xml(self):
+        docs = [
+            {'id': 'doc_1', 'title': 'Fish & <Chips>', 'tags': ['a', 'b'], 'empty': '', 'none': None},
+            {'id': 'doc_2', 'when': datetime.datetime(2013, 1, 18, 10, 0), 'ok': True, 'dirty': 'a\x00b'},
+        ]
+        self.assertEqual(
+            self.bodies(docs),
+            [('<add>%s</add>' % build_docs_xml(docs)).encode('utf-8')])
+        self.assertEqual(
+            b''.join(iter_doc_xml({'id': 1, 'title': 'x'}, fieldUpdates={'title': 'set'})),
+            b'<doc><field name="id">1</field><field name="title" update="set">x</field></doc>')
+
+    def test_huge_value(self):
+        text = 'a&b<\x01 ' * 10000
+        pieces = list(iter_doc_xml({'text': text}, chunk_size=1000))
+        # Opening tags, 60 chunks of escaped text, closing tags.
+        self.assertEqual(len(pieces), 64)
+        self.assertTrue(all(len(piece) < 2100 for piece in pieces))
+        body = b''.join(pieces)
+        self.assertEqual(ElementTree.fromstring(body).find('field').text, 'a&b< ' * 10000)
+
+    def test_max_bytes(self):
+        docs = [{'id': 'doc_%d' % i, 'text': 'x' * 100} for i in range(10)]
+        # 168 bytes a doc.
+        bodies = self.bodies(docs, max_bytes=400, buffer_size=50)
+        self.assertEqual(len(bodies), 4)
+        counts = [len(ElementTree.fromstring(body).findall('doc')) for body in bodies]
+        self.assertEqual(counts, [3, 3, 3, 1])
+
+        # A document over the budget goes out on its own.
+        bodies = self.bodies([{'id': 'big', 'text': 'x' * 1000}, {'id': 'small'}], max_bytes=300)
+        self.assertEqual(len(bodies), 2)
+
+
+class Chunks(object):
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        if not self.chunks:
+            raise StopAsyncIteration()
+        return self.chunks.pop(0)
+
+
+class RequestBodyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_generator_body(self):
+        # Drives the generator the way aiohttp before 2.0 sends one.
+        async def send(body):
+            written = []
+            value = error = None
+
+            while True:
+                try:
+                    result = body.throw(error) if error is not None else body.send(value)
+                except StopIteration:
+                    return written
+
+                value = error = None
+
+                if isinstance(result, asyncio.Future):
+                    try:
+                        value = await result
+                    except Exception as err:
+                        error = err
+                else:
+                    written.append(result)
+
+        body = _generator_body(Chunks([b'<add>', b'<doc/>', b'</add>']), self.loop)
+        self.assertEqual(self.loop.run_until_complete(send(body)), [b'<add>', b'<doc/>', b'</add>'])
+